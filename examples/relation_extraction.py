@@ -38,6 +38,8 @@ parser.add_argument("--weight_decay", default=0.0, type=float, help="Weight deca
 parser.add_argument("--num_train_epochs", default=3, type=int, help="Total number of training epochs to perform.")
 parser.add_argument("--warmup_ratio", default=0, type=float, help="Linear warmup over warmup_ratio * total_steps.")
 parser.add_argument("--seed", default=42, type=int, help="random seed for initialization")
+parser.add_argument("--cache_dir", default=None, type=str, required=False, help="Directory of the preprocessed data, no caching if not set.")
+parser.add_argument("--preprocess_workers", default=1, type=int, help="Number of processes preprocessing the data.")
 parser.add_argument('--device', choices=['cpu', 'gpu'], default="gpu", help="Select which device to train model, defaults to gpu.")
 
 args = parser.parse_args()
@@ -5,4 +5,8 @@
 init
 """
 from .mmd import *
-from .mtg import *
\ No newline at end of file
+from .mtg import *
+from .chunked import *
+from .columnar_mtg import *
+from .snapshot import *
+from .graph_index import *
\ No newline at end of file
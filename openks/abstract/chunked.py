@@ -0,0 +1,92 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Lazy, re-iterable and chunked bodies for MMD in streaming mode
+"""
+import os
+import pickle
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List
+
+
+class ChunkedReader(object):
+	"""
+	A body of MMD which never holds the whole table in memory.
+	opener: a callable returning a fresh row iterator over the source, called once per full pass
+	chunk_size: the maximum number of rows handed out at once by iter_chunks
+	spill_path: if given, the first complete pass is written to this file as pickled chunks,
+		and later passes read the spill file instead of re-parsing (and decompressing) the source
+	Iterating the reader yields single rows, so it can be used wherever a list of rows was used before.
+	"""
+	def __init__(
+		self,
+		opener: Callable[[], Iterator],
+		chunk_size: int = 10000,
+		spill_path: str = None
+		) -> None:
+		if chunk_size <= 0:
+			raise ValueError("chunk_size should be a positive integer, got {}.".format(chunk_size))
+		self._opener = opener
+		self._chunk_size = chunk_size
+		self._spill_path = spill_path
+		self._spilled = False
+
+	@property
+	def chunk_size(self):
+		return self._chunk_size
+
+	@property
+	def spill_path(self):
+		return self._spill_path
+
+	def iter_chunks(self) -> Iterator[List]:
+		""" yield lists of at most chunk_size rows """
+		if self._spilled:
+			with open(self._spill_path, 'rb') as load_f:
+				while True:
+					try:
+						yield pickle.load(load_f)
+					except EOFError:
+						break
+		elif self._spill_path:
+			# only mark the spill file usable after a complete pass, an interrupted pass is re-parsed next time
+			tmp_path = self._spill_path + '.tmp'
+			with open(tmp_path, 'wb') as dump_f:
+				for chunk in _batched(self._opener(), self._chunk_size):
+					pickle.dump(chunk, dump_f, protocol=pickle.HIGHEST_PROTOCOL)
+					yield chunk
+			os.replace(tmp_path, self._spill_path)
+			self._spilled = True
+		else:
+			for chunk in _batched(self._opener(), self._chunk_size):
+				yield chunk
+
+	def __iter__(self) -> Iterator:
+		for chunk in self.iter_chunks():
+			for row in chunk:
+				yield row
+
+	def __getstate__(self):
+		# spill files belong to the process which wrote them
+		state = self.__dict__.copy()
+		state['_spilled'] = False
+		return state
+
+
+def _batched(rows: Iterable, size: int) -> Iterator[List]:
+	rows = iter(rows)
+	while True:
+		chunk = list(islice(rows, size))
+		if not chunk:
+			break
+		yield chunk
+
+
+def iter_chunks(data: Iterable, chunk_size: int = 10000) -> Iterator[List]:
+	""" chunk any MMD body or MTG member, using its own chunking when it is a ChunkedReader """
+	if isinstance(data, ChunkedReader):
+		return data.iter_chunks()
+	elif isinstance(data, (list, tuple)):
+		return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+	return _batched(data, chunk_size)
@@ -0,0 +1,247 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Array-backed MTG storage for large graphs
+"""
+from collections.abc import Sequence
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from .mtg import MTG
+from .chunked import iter_chunks
+
+
+class Vocab(object):
+	"""
+	Interned strings such as relation and entity type names, mapped to consecutive integer codes
+	"""
+	def __init__(self, items: Iterable = ()) -> None:
+		self._items = []
+		self._index = {}
+		for item in items:
+			self.add(item)
+
+	def add(self, item) -> int:
+		if item not in self._index:
+			self._index[item] = len(self._items)
+			self._items.append(item)
+		return self._index[item]
+
+	def encode(self, items: Iterable) -> np.ndarray:
+		return np.array([self.add(item) for item in items], dtype=np.int32)
+
+	def id_of(self, item) -> int:
+		return self._index[item]
+
+	def to_dict(self) -> Dict:
+		return dict(self._index)
+
+	@property
+	def items(self) -> List:
+		return self._items
+
+	def __getitem__(self, code: int):
+		return self._items[code]
+
+	def __len__(self) -> int:
+		return len(self._items)
+
+	def __contains__(self, item) -> bool:
+		return item in self._index
+
+
+class AttributeColumns(object):
+	"""
+	Variable-length attribute tuples stored column-wise: one object array per attribute position
+	and the tuple length of every row, so rows of different types can share the same columns
+	"""
+	def __init__(self, columns: List = None, lengths: np.ndarray = None) -> None:
+		self.columns = columns if columns is not None else []
+		self.lengths = lengths if lengths is not None else np.zeros(0, dtype=np.int16)
+
+	@classmethod
+	def from_rows(cls, rows: List[Tuple]) -> 'AttributeColumns':
+		lengths = np.array([len(row) for row in rows], dtype=np.int16)
+		width = int(lengths.max()) if len(rows) else 0
+		columns = []
+		for col in range(width):
+			column = np.empty(len(rows), dtype=object)
+			column[:] = [row[col] if col < len(row) else None for row in rows]
+			columns.append(column)
+		return cls(columns, lengths)
+
+	@classmethod
+	def concatenate(cls, parts: List['AttributeColumns']) -> 'AttributeColumns':
+		width = max([len(part.columns) for part in parts] + [0])
+		columns = []
+		for col in range(width):
+			pieces = []
+			for part in parts:
+				if col < len(part.columns):
+					pieces.append(part.columns[col])
+				else:
+					pieces.append(np.full(len(part.lengths), None, dtype=object))
+			columns.append(np.concatenate(pieces))
+		lengths = np.concatenate([part.lengths for part in parts]) if parts else np.zeros(0, dtype=np.int16)
+		return cls(columns, lengths)
+
+	def row(self, index: int) -> Tuple:
+		return tuple([self.columns[col][index] for col in range(self.lengths[index])])
+
+	def take(self, key) -> 'AttributeColumns':
+		return AttributeColumns([column[key] for column in self.columns], self.lengths[key])
+
+
+class _ColumnView(Sequence):
+	"""
+	Read-only sequence over columnar rows that yields the legacy MTG tuples on access.
+	Slicing returns another view backed by numpy views of the same arrays, so nothing is copied.
+	"""
+	def __init__(self, graph: 'ColumnarMTG', start: int, stop: int) -> None:
+		self._graph = graph
+		self._start = start
+		self._stop = stop
+
+	def __len__(self) -> int:
+		return self._stop - self._start
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			start, stop, step = index.indices(len(self))
+			if step != 1:
+				return [self[i] for i in range(start, stop, step)]
+			return self.__class__(self._graph, self._start + start, self._start + max(start, stop))
+		if index < 0:
+			index += len(self)
+		if index < 0 or index >= len(self):
+			raise IndexError('{} index out of range'.format(self.__class__.__name__))
+		return self._row(self._start + index)
+
+	def __iter__(self):
+		for index in range(self._start, self._stop):
+			yield self._row(index)
+
+	def _row(self, index: int):
+		raise NotImplementedError
+
+
+class EntityView(_ColumnView):
+	""" entities as ( <entity_id>, <entity_type>, (<entity_attr1>, ...) ) """
+	def _row(self, index: int):
+		graph = self._graph
+		return (int(graph.entity_ids[index]), graph.type_vocab[graph.entity_types[index]], graph.entity_attrs.row(index))
+
+
+class TripleView(_ColumnView):
+	""" triples as ( ( <head_entity_id>, <relation_type>, <tail_entity_id> ), ( <relation_attr1>, ... ) ) """
+	def _row(self, index: int):
+		head, rel, tail = self._graph.triple_array[index].tolist()
+		return ((head, self._graph.relation_vocab[rel], tail), self._graph.triple_attrs.row(index))
+
+
+class ColumnarMTG(MTG):
+	"""
+	An MTG backend storing the graph as numpy columns instead of Python tuples.
+	entity_ids: int64 [n_entities]
+	entity_types: int32 [n_entities], codes into type_vocab
+	triple_array: int64 [n_triples, 3] of (head_id, relation_code, tail_id), codes into relation_vocab
+	entity_attrs / triple_attrs: AttributeColumns, one object array per attribute position
+
+	Relation codes follow the relation order of the schema, so they agree with relation_to_id,
+	and trainers can use triple_array (or contiguous slices of it) directly as id triples.
+	The entities and triples properties still return sequences of the legacy tuples for old callers,
+	and assigning lists of legacy tuples to them converts the lists into columns.
+	"""
+	def __init__(
+		self,
+		name: str = '',
+		schema: List = [],
+		entities: Iterable = [],
+		triples: Iterable = [],
+		chunk_size: int = 100000
+		) -> None:
+		self._chunk_size = chunk_size
+		self.type_vocab = Vocab()
+		self.relation_vocab = Vocab()
+		self.entity_ids = np.zeros(0, dtype=np.int64)
+		self.entity_types = np.zeros(0, dtype=np.int32)
+		self.entity_attrs = AttributeColumns()
+		self.triple_array = np.zeros((0, 3), dtype=np.int64)
+		self.triple_attrs = AttributeColumns()
+		super(ColumnarMTG, self).__init__(name=name)
+		# the schema goes first so that relation codes follow its order
+		self.schema = schema
+		self.entities = entities
+		self.triples = triples
+
+	@classmethod
+	def from_mtg(cls, graph: MTG, chunk_size: int = 100000) -> 'ColumnarMTG':
+		return cls(name=graph.name, schema=graph.schema, entities=graph.entities, triples=graph.triples, chunk_size=chunk_size)
+
+	def to_mtg(self) -> MTG:
+		""" materialize a tuple based MTG, mainly for code which mutates the lists in place """
+		return MTG(name=self.name, schema=self.schema, entities=list(self.entities), triples=list(self.triples))
+
+	@property
+	def schema(self):
+		return self._schema
+
+	@schema.setter
+	def schema(self, schema):
+		self._schema = schema
+		for item in schema:
+			if item['type'] == 'entity':
+				self.type_vocab.add(item['concept'])
+			elif item['type'] == 'relation':
+				self.relation_vocab.add(item['concept'])
+
+	@property
+	def entities(self):
+		return EntityView(self, 0, len(self.entity_ids))
+
+	@entities.setter
+	def entities(self, entities):
+		ids, types, attrs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int32)], []
+		for chunk in iter_chunks(entities, self._chunk_size):
+			ids.append(np.array([item[0] for item in chunk], dtype=np.int64))
+			types.append(self.type_vocab.encode([item[1] for item in chunk]))
+			attrs.append(AttributeColumns.from_rows([tuple(item[2]) for item in chunk]))
+		self.entity_ids = np.concatenate(ids)
+		self.entity_types = np.concatenate(types)
+		self.entity_attrs = AttributeColumns.concatenate(attrs)
+
+	@property
+	def triples(self):
+		return TripleView(self, 0, len(self.triple_array))
+
+	@triples.setter
+	def triples(self, triples):
+		arrays, attrs = [np.zeros((0, 3), dtype=np.int64)], []
+		for chunk in iter_chunks(triples, self._chunk_size):
+			rels = self.relation_vocab.encode([item[0][1] for item in chunk])
+			array = np.empty((len(chunk), 3), dtype=np.int64)
+			array[:, 0] = [item[0][0] for item in chunk]
+			array[:, 1] = rels
+			array[:, 2] = [item[0][2] for item in chunk]
+			arrays.append(array)
+			attrs.append(AttributeColumns.from_rows([tuple(item[1]) for item in chunk]))
+		self.triple_array = np.concatenate(arrays)
+		self.triple_attrs = AttributeColumns.concatenate(attrs)
+
+	@property
+	def heads(self) -> np.ndarray:
+		return self.triple_array[:, 0]
+
+	@property
+	def relations(self) -> np.ndarray:
+		return self.triple_array[:, 1]
+
+	@property
+	def tails(self) -> np.ndarray:
+		return self.triple_array[:, 2]
+
+	def get_entity_num(self):
+		return len(self.entity_ids)
+
+	def get_triple_num(self):
+		return len(self.triple_array)
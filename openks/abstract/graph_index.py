@@ -0,0 +1,125 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Read-only lookup indexes over an MTG for serving queries such as question answering
+"""
+import threading
+import weakref
+import numpy as np
+from .mtg import MTG
+from .columnar_mtg import ColumnarMTG, Vocab
+
+
+class CSRMap(object):
+	"""
+	Maps int64 keys to groups of int64 values in CSR form: sorted unique keys, offsets and values.
+	Lookups are binary searches and return zero-copy slices of the values array.
+	"""
+	def __init__(self, keys: np.ndarray, values: np.ndarray) -> None:
+		order = np.argsort(keys, kind='stable')
+		keys = keys[order]
+		self.values = values[order]
+		self.keys, starts = np.unique(keys, return_index=True)
+		self.indptr = np.append(starts, len(keys)).astype(np.int64)
+
+	def get(self, key: int) -> np.ndarray:
+		pos = int(np.searchsorted(self.keys, key))
+		if pos == len(self.keys) or self.keys[pos] != key:
+			return self.values[0:0]
+		return self.values[self.indptr[pos]:self.indptr[pos + 1]]
+
+
+class GraphIndex(object):
+	"""
+	Indexes built once per MTG:
+	adjacency in both directions, (head, relation) -> tails and (tail, relation) -> heads, as CSR maps,
+	entity id -> entity row through a sorted id array, and entity type -> entity rows.
+	The index is immutable after construction, so it can serve concurrent requests without locking.
+	"""
+	def __init__(self, graph: MTG) -> None:
+		self.graph = graph
+		if isinstance(graph, ColumnarMTG):
+			self.relation_vocab = graph.relation_vocab
+			self.type_vocab = graph.type_vocab
+			entity_ids = np.asarray(graph.entity_ids)
+			entity_types = np.asarray(graph.entity_types)
+			triples = np.asarray(graph.triple_array)
+		else:
+			self.relation_vocab = Vocab(graph.relation_to_id().keys())
+			self.type_vocab = Vocab()
+			entity_ids = np.array([item[0] for item in graph.entities], dtype=np.int64)
+			entity_types = self.type_vocab.encode([item[1] for item in graph.entities])
+			triples = np.array([
+				(item[0][0], self.relation_vocab.add(item[0][1]), item[0][2]) for item in graph.triples
+			], dtype=np.int64).reshape(-1, 3)
+		self.nrelation = max(len(self.relation_vocab), 1)
+		self.num_entities = len(entity_ids)
+		self.num_triples = len(triples)
+
+		self.id_order = np.argsort(entity_ids, kind='stable')
+		self.sorted_ids = entity_ids[self.id_order]
+		self.type_rows = CSRMap(entity_types.astype(np.int64), np.arange(len(entity_types), dtype=np.int64))
+		self.entity_types = entity_types
+		self.out_edges = CSRMap(triples[:, 0] * self.nrelation + triples[:, 1], triples[:, 2].copy())
+		self.in_edges = CSRMap(triples[:, 2] * self.nrelation + triples[:, 1], triples[:, 0].copy())
+
+	def neighbors(self, entity_id: int, relation: str, direction: str = 'out') -> np.ndarray:
+		"""
+		tails of (entity_id, relation) for direction 'out', heads of (relation, entity_id) for direction 'in'
+		"""
+		if relation not in self.relation_vocab:
+			return np.zeros(0, dtype=np.int64)
+		key = entity_id * self.nrelation + self.relation_vocab.id_of(relation)
+		if direction == 'out':
+			return self.out_edges.get(key)
+		elif direction == 'in':
+			return self.in_edges.get(key)
+		raise ValueError("direction should be 'out' or 'in', got {}.".format(direction))
+
+	def entity_rows(self, entity_ids, entity_type: str = None) -> np.ndarray:
+		"""
+		rows in graph.entities of the given ids, ids which are missing (or of another type) are dropped
+		"""
+		entity_ids = np.asarray(entity_ids, dtype=np.int64)
+		if not len(self.sorted_ids):
+			return np.zeros(0, dtype=np.int64)
+		pos = np.minimum(np.searchsorted(self.sorted_ids, entity_ids), len(self.sorted_ids) - 1)
+		rows = self.id_order[pos[self.sorted_ids[pos] == entity_ids]]
+		if entity_type is not None:
+			if entity_type not in self.type_vocab:
+				return rows[0:0]
+			rows = rows[self.entity_types[rows] == self.type_vocab.id_of(entity_type)]
+		return rows
+
+	def rows_of_type(self, entity_type: str) -> np.ndarray:
+		""" rows in graph.entities of all entities of a type, in graph order """
+		if entity_type not in self.type_vocab:
+			return np.zeros(0, dtype=np.int64)
+		return self.type_rows.get(self.type_vocab.id_of(entity_type))
+
+	def entities_of_type(self, entity_type: str):
+		for row in self.rows_of_type(entity_type):
+			yield self.graph.entities[int(row)]
+
+	def entity(self, entity_id: int):
+		""" the entity tuple of an id, or None """
+		rows = self.entity_rows([entity_id])
+		return self.graph.entities[int(rows[0])] if len(rows) else None
+
+
+_index_cache = weakref.WeakKeyDictionary()
+_index_lock = threading.Lock()
+
+
+def get_graph_index(graph: MTG) -> GraphIndex:
+	"""
+	the GraphIndex of a graph, built on first use and cached with the graph.
+	It is rebuilt if the number of entities or triples changed since it was built.
+	"""
+	with _index_lock:
+		index = _index_cache.get(graph)
+		if index is None or index.num_entities != graph.get_entity_num() or index.num_triples != graph.get_triple_num():
+			index = GraphIndex(graph)
+			_index_cache[graph] = index
+		return index
@@ -53,5 +53,8 @@ class MMD(object):
 		print("字段名：" + str(self.headers))
 		print("数据示例：")
 		for data in self.bodies:
-			print(data[0])
+			# bodies may be lazy readers in streaming mode, so only take the first row
+			for row in data:
+				print(row)
+				break
 		print("-----------------------------------------------")
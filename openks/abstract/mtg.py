@@ -141,6 +141,17 @@ class MTG(MMD):
 			index += 1
 		return res
 
+	def save_snapshot(self, path: str, extra: Dict = None) -> str:
+		""" write a versioned binary snapshot directory, see abstract/snapshot.py for the layout """
+		from .snapshot import save_snapshot
+		return save_snapshot(self, path, extra)
+
+	@staticmethod
+	def load_snapshot(path: str, mmap: bool = True, verify: bool = False) -> 'MTG':
+		""" load a snapshot directory as an array-backed ColumnarMTG, memory-mapped by default """
+		from .snapshot import load_snapshot
+		return load_snapshot(path, mmap, verify)
+
 	def info_display(self):
 		print("\n")
 		print("载入MTG知识图谱信息：")
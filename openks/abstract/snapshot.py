@@ -0,0 +1,212 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Versioned binary snapshot of MTG for fast, memory-mapped warm starts
+
+layout of a snapshot directory:
+	meta.json                        format version, name, schema, relation/type vocabularies, column kinds, content hash
+	entity_ids.npy                   int64 [n_entities]
+	entity_types.npy                 int32 [n_entities]
+	entity_attr_lengths.npy          int16 [n_entities]
+	triple_array.npy                 int64 [n_triples, 3]
+	triple_attr_lengths.npy          int16 [n_triples]
+	<entity|triple>_attr_<i>.*       one attribute column, either
+		.offsets.npy / .data.npy / .valid.npy   utf-8 strings: int64 offsets [n + 1], uint8 bytes, uint8 not-None mask
+		.pkl                                    pickled object array for columns holding other values
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+from typing import Dict, List
+import numpy as np
+from .columnar_mtg import ColumnarMTG, AttributeColumns, Vocab
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 'openks-mtg-snapshot'
+SNAPSHOT_VERSION = 1
+
+_ARRAYS = ['entity_ids', 'entity_types', 'entity_attr_lengths', 'triple_array', 'triple_attr_lengths']
+
+
+class StringColumn(object):
+	"""
+	A read-only column of utf-8 strings stored as one byte buffer plus an offsets table.
+	Values are decoded on access, so a memory-mapped column costs no memory until it is read.
+	"""
+	def __init__(self, offsets: np.ndarray, data: np.ndarray, valid: np.ndarray) -> None:
+		self.offsets = offsets
+		self.data = data
+		self.valid = valid
+
+	@classmethod
+	def from_values(cls, values) -> 'StringColumn':
+		encoded = [b'' if value is None else value.encode('utf-8') for value in values]
+		offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+		np.cumsum([len(item) for item in encoded], out=offsets[1:])
+		data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+		valid = np.array([value is not None for value in values], dtype=np.uint8)
+		return cls(offsets, data, valid)
+
+	def __len__(self) -> int:
+		return len(self.valid)
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			start, stop, step = key.indices(len(self))
+			if step == 1:
+				stop = max(start, stop)
+				return StringColumn(self.offsets[start:stop + 1], self.data, self.valid[start:stop])
+			key = range(start, stop, step)
+		if isinstance(key, (int, np.integer)):
+			# negative indices count from the end as for lists, offsets[key + 1] would be wrong for them
+			if key < 0:
+				key += len(self)
+			if key < 0 or key >= len(self):
+				raise IndexError('StringColumn index out of range')
+			if not self.valid[key]:
+				return None
+			return bytes(self.data[self.offsets[key]:self.offsets[key + 1]]).decode('utf-8')
+		# integer arrays, possibly negative, and boolean masks as numpy indexes them
+		key = np.arange(len(self))[key]
+		column = np.empty(len(key), dtype=object)
+		column[:] = [self[int(index)] for index in key]
+		return column
+
+
+def _is_string_column(column) -> bool:
+	return all(value is None or isinstance(value, str) for value in column)
+
+
+def _save_columns(path: str, prefix: str, attrs: AttributeColumns) -> List[str]:
+	kinds = []
+	for index, column in enumerate(attrs.columns):
+		base = os.path.join(path, '{}_attr_{}'.format(prefix, index))
+		if isinstance(column, StringColumn) or _is_string_column(column):
+			if not isinstance(column, StringColumn):
+				column = StringColumn.from_values(column)
+			# rebase offsets, a sliced column may not start at the beginning of its buffer
+			start, stop = int(column.offsets[0]), int(column.offsets[-1])
+			np.save(base + '.offsets.npy', np.asarray(column.offsets) - start)
+			np.save(base + '.data.npy', np.asarray(column.data[start:stop]))
+			np.save(base + '.valid.npy', np.asarray(column.valid))
+			kinds.append('str')
+		else:
+			with open(base + '.pkl', 'wb') as f:
+				pickle.dump(np.asarray(column, dtype=object), f, protocol=pickle.HIGHEST_PROTOCOL)
+			kinds.append('pickle')
+	return kinds
+
+
+def _load_columns(path: str, prefix: str, kinds: List[str], mmap_mode) -> List:
+	columns = []
+	for index, kind in enumerate(kinds):
+		base = os.path.join(path, '{}_attr_{}'.format(prefix, index))
+		if kind == 'str':
+			columns.append(StringColumn(
+				np.load(base + '.offsets.npy', mmap_mode=mmap_mode),
+				np.load(base + '.data.npy', mmap_mode=mmap_mode),
+				np.load(base + '.valid.npy', mmap_mode=mmap_mode)
+			))
+		elif kind == 'pickle':
+			with open(base + '.pkl', 'rb') as f:
+				columns.append(pickle.load(f))
+		else:
+			raise ValueError("Unknown attribute column kind {} in snapshot {}.".format(kind, path))
+	return columns
+
+
+def _data_files(path: str) -> List[str]:
+	return sorted(name for name in os.listdir(path) if name != 'meta.json' and not name.endswith('.tmp'))
+
+
+def content_hash(path: str, meta: Dict) -> str:
+	""" sha256 over the snapshot metadata (without the hash itself) and every data file in name order """
+	digest = hashlib.sha256()
+	body = {key: value for key, value in meta.items() if key != 'content_hash'}
+	digest.update(json.dumps(body, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+	for name in _data_files(path):
+		digest.update(name.encode('utf-8'))
+		with open(os.path.join(path, name), 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				digest.update(block)
+	return digest.hexdigest()
+
+
+def read_snapshot_meta(path: str) -> Dict:
+	with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+		meta = json.load(f)
+	if meta.get('format') != SNAPSHOT_FORMAT:
+		raise ValueError("{} is not an MTG snapshot.".format(path))
+	if meta.get('version', 0) > SNAPSHOT_VERSION:
+		raise ValueError("Snapshot {} has version {}, only versions up to {} are supported.".format(path, meta['version'], SNAPSHOT_VERSION))
+	return meta
+
+
+def save_snapshot(graph, path: str, extra: Dict = None) -> str:
+	"""
+	write graph (any MTG, converted to columns when needed) as a snapshot directory
+	extra: JSON-serializable information stored with the snapshot, e.g. a signature of the source files
+	return the content hash
+	"""
+	if not isinstance(graph, ColumnarMTG):
+		graph = ColumnarMTG.from_mtg(graph)
+	if not os.path.exists(path):
+		os.makedirs(path)
+	# only files of a previous snapshot are replaced, anything else in the directory is left alone
+	for name in os.listdir(path):
+		if name.startswith(('meta.json', 'entity_', 'triple_')):
+			os.remove(os.path.join(path, name))
+	arrays = {
+		'entity_ids': graph.entity_ids,
+		'entity_types': graph.entity_types,
+		'entity_attr_lengths': graph.entity_attrs.lengths,
+		'triple_array': graph.triple_array,
+		'triple_attr_lengths': graph.triple_attrs.lengths
+	}
+	for key in _ARRAYS:
+		np.save(os.path.join(path, key + '.npy'), np.ascontiguousarray(arrays[key]))
+	meta = {
+		'format': SNAPSHOT_FORMAT,
+		'version': SNAPSHOT_VERSION,
+		'name': graph.name,
+		'schema': graph.schema,
+		'relation_vocab': graph.relation_vocab.items,
+		'type_vocab': graph.type_vocab.items,
+		'entity_attr_kinds': _save_columns(path, 'entity', graph.entity_attrs),
+		'triple_attr_kinds': _save_columns(path, 'triple', graph.triple_attrs),
+		'extra': extra or {}
+	}
+	meta['content_hash'] = content_hash(path, meta)
+	# meta.json is written last, a directory without it is never mistaken for a complete snapshot
+	with open(os.path.join(path, 'meta.json.tmp'), 'w', encoding='utf-8') as f:
+		json.dump(meta, f, ensure_ascii=False)
+	os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+	logger.info("Saved MTG snapshot {} to {}.".format(meta['content_hash'][:12], path))
+	return meta['content_hash']
+
+
+def load_snapshot(path: str, mmap: bool = True, verify: bool = False) -> ColumnarMTG:
+	"""
+	load a snapshot directory as ColumnarMTG
+	mmap: memory-map id arrays and string columns read-only, processes on the same host share the pages
+	verify: recompute the content hash, this reads every file once
+	"""
+	meta = read_snapshot_meta(path)
+	if verify and content_hash(path, meta) != meta['content_hash']:
+		raise ValueError("Snapshot {} is corrupted, content hash does not match.".format(path))
+	mmap_mode = 'r' if mmap else None
+	arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode=mmap_mode) for key in _ARRAYS}
+	graph = ColumnarMTG(name=meta['name'])
+	graph.relation_vocab = Vocab(meta['relation_vocab'])
+	graph.type_vocab = Vocab(meta['type_vocab'])
+	graph.schema = meta['schema']
+	graph.entity_ids = arrays['entity_ids']
+	graph.entity_types = arrays['entity_types']
+	graph.entity_attrs = AttributeColumns(_load_columns(path, 'entity', meta['entity_attr_kinds'], mmap_mode), arrays['entity_attr_lengths'])
+	graph.triple_array = arrays['triple_array']
+	graph.triple_attrs = AttributeColumns(_load_columns(path, 'triple', meta['triple_attr_kinds'], mmap_mode), arrays['triple_attr_lengths'])
+	return graph
@@ -39,19 +39,16 @@ class Model(TFModel):
 
         self.config = config
         self.graph = graph
-        if self.config['walker'] == "first":
-            self.walker = RandomWalker(self.graph, nx.nodes(graph), self.config['num_of_walks'],
-                                       self.config['random_walk_length'])
-            self.degrees, self.walks = self.walker.do_walks()
-        else:
-            self.walker = SecondOrderRandomWalker(self.graph, False, self.config['P'], self.config['Q'])
-            self.walker.preprocess_transition_probs()
-            self.walks, self.degrees = self.walker.simulate_walks(self.config['num_of_walks'],
-                                                                  self.config['random_walk_length'])
+        walker = CSRWalker(self.graph, self.config['random_walk_length'], second_order=self.config['walker'] != "first",
+                           p=self.config['P'], q=self.config['Q'])
+        self.degrees, self.walks = walker.do_walks(self.config['num_of_walks'], self.config.get('walk_workers', 1),
+                                                   self.config.get('seed'))
         self.nodes = self.graph.nodes()
-        del self.walker
         self.vocab_size = len(self.degrees)
-        self.true_step_size = self.config['num_of_walks'] * self.vocab_size
+        # number of walks fed per session.run
+        self.batch_size = self.config.get('batch_size', 1)
+        self.walks_per_epoch = len(self.walks) // self.config['num_of_walks']
+        self.true_step_size = self.config['num_of_walks'] * int(math.ceil(self.walks_per_epoch / float(self.batch_size)))
         self.build()
 
     def build(self):
@@ -109,16 +106,15 @@ class GEMSECWithRegularization(Model):
 
             self.init = tf.global_variables_initializer()
 
-        self.weights = overlap_generator(self.config, self.graph)
-
-    def feed_dict_generator(self, a_random_walk, step, gamma):
-        index_1, index_2, overlaps = index_generation(self.weights, a_random_walk)
+        self.weights = overlap_weights(self.config, self.graph)
 
-        batch_inputs = batch_input_generator(a_random_walk, self.config['random_walk_length'],
-                                             self.config['window_size'])
+    def feed_dict_generator(self, walks, step, gamma):
+        """
+        Method to generate the features, labels, edge indices and overlaps of a batch of walks.
+        """
+        index_1, index_2, overlaps = batch_index_generation(self.weights, walks, self.config['window_size'])
 
-        batch_labels = batch_label_generator(a_random_walk, self.config['random_walk_length'],
-                                             self.config['window_size'])
+        batch_inputs, batch_labels = walk_batch_generator(walks, self.config['window_size'])
 
         feed_dict = {self.walker_layer.train_labels: batch_labels,
                      self.walker_layer.train_inputs: batch_inputs,
@@ -140,26 +136,24 @@ class GEMSECWithRegularization(Model):
             print("Model Initialized.")
             for repetition in range(0, self.config['num_of_walks']):
 
-                random.shuffle(list(self.nodes))
-                self.optimization_time = 0
                 self.average_loss = 0
 
                 epoch_printer(repetition)
 
-                for node in tqdm(self.nodes):
+                walks = self.walks[repetition * self.walks_per_epoch:(repetition + 1) * self.walks_per_epoch]
+                start = time.time()
+                for batch_start in tqdm(range(0, self.walks_per_epoch, self.batch_size)):
+                    batch = walks[batch_start:batch_start + self.batch_size]
                     self.current_step = self.current_step + 1
                     self.current_gamma = gamma_incrementer(self.current_step, self.config['initial_gamma'],
                                                            self.current_gamma, self.true_step_size)
-                    feed_dict = self.feed_dict_generator(self.walks[self.current_step - 1], self.current_step,
-                                                         self.current_gamma)
-                    start = time.time()
+                    feed_dict = self.feed_dict_generator(batch, self.current_step, self.current_gamma)
                     _, loss = session.run([self.train_op, self.loss], feed_dict=feed_dict)
-                    end = time.time()
-                    self.optimization_time = self.optimization_time + (end - start)
-                    self.average_loss = self.average_loss + loss
+                    self.average_loss = self.average_loss + loss * len(batch)
+                self.optimization_time = time.time() - start
 
                 print("")
-                self.average_loss = self.average_loss / self.vocab_size
+                self.average_loss = self.average_loss / self.walks_per_epoch
                 self.final_embeddings = self.walker_layer.embedding_matrix.eval()
                 if "GEMSEC" in self.config['model']:
                     self.c_means = self.cluster_layer.cluster_means.eval()
@@ -206,12 +200,11 @@ class GEMSEC(GEMSECWithRegularization):
 
             self.init = tf.global_variables_initializer()
 
-    def feed_dict_generator(self, a_random_walk, step, gamma):
-        batch_inputs = batch_input_generator(a_random_walk, self.config['random_walk_length'],
-                                             self.config['window_size'])
-
-        batch_labels = batch_label_generator(a_random_walk, self.config['random_walk_length'],
-                                             self.config['window_size'])
+    def feed_dict_generator(self, walks, step, gamma):
+        """
+        Method to generate the features and labels of a batch of walks.
+        """
+        batch_inputs, batch_labels = walk_batch_generator(walks, self.config['window_size'])
 
         feed_dict = {self.walker_layer.train_labels: batch_labels,
                      self.walker_layer.train_inputs: batch_inputs,
@@ -252,17 +245,15 @@ class DeepWalkWithRegularization(GEMSECWithRegularization):
 
             self.init = tf.global_variables_initializer()
 
-        self.weights = overlap_generator(self.config, self.graph)
+        self.weights = overlap_weights(self.config, self.graph)
 
-    def feed_dict_generator(self, a_random_walk, step, gamma):
+    def feed_dict_generator(self, walks, step, gamma):
         """
         Method to generate random walk features, left and right handside matrices, proper time index and overlap vector.
         """
-        index_1, index_2, overlaps = index_generation(self.weights, a_random_walk)
-
-        batch_inputs = batch_input_generator(a_random_walk, self.config['random_walk_length'], self.config['window_size'])
+        index_1, index_2, overlaps = batch_index_generation(self.weights, walks, self.config['window_size'])
 
-        batch_labels = batch_label_generator(a_random_walk, self.config['random_walk_length'], self.config['window_size'])
+        batch_inputs, batch_labels = walk_batch_generator(walks, self.config['window_size'])
 
         feed_dict = {self.walker_layer.train_labels: batch_labels,
                      self.walker_layer.train_inputs: batch_inputs,
@@ -306,13 +297,12 @@ class DeepWalk(GEMSECWithRegularization):
 
             self.init = tf.global_variables_initializer()
 
-    def feed_dict_generator(self, a_random_walk, step, gamma):
+    def feed_dict_generator(self, walks, step, gamma):
         """
         Method to generate random walk features, gamma and proper time index.
         """
 
-        batch_inputs = batch_input_generator(a_random_walk, self.config['random_walk_length'], self.config['window_size'])
-        batch_labels = batch_label_generator(a_random_walk, self.config['random_walk_length'], self.config['window_size'])
+        batch_inputs, batch_labels = walk_batch_generator(walks, self.config['window_size'])
 
         feed_dict = {self.walker_layer.train_labels: batch_labels,
                      self.walker_layer.train_inputs: batch_inputs,
@@ -133,10 +133,12 @@ class Regularization:
         self.left_features = tf.nn.embedding_lookup(Walker.embedding_partial, self.edge_indices_left, max_norm=1)
         self.right_features = tf.nn.embedding_lookup(Walker.embedding_partial, self.edge_indices_right, max_norm=1)
         print(type(self.config['random_walk_length']))
-        self.regularization_differences = self.left_features - self.right_features + np.random.uniform(
-            -float(self.config['regularization_noise']), float(self.config['regularization_noise']),
-            (self.config['random_walk_length'] - 1, self.config['dimensions']))
+        self.regularization_differences = self.left_features - self.right_features + tf.random_uniform(
+            tf.shape(self.left_features), -float(self.config['regularization_noise']),
+            float(self.config['regularization_noise']))
         self.regularization_distances = tf.norm(self.regularization_differences, ord=2, axis=1)
         self.regularization_distances = tf.reshape(self.regularization_distances, [-1, 1])
-        self.regularization_loss = tf.reduce_mean(tf.matmul(tf.transpose(self.overlap), self.regularization_distances))
+        # weighted distance sum of the edges of every walk, averaged over the walks of the batch
+        self.num_walks = tf.cast(tf.shape(self.overlap)[0], tf.float32) / float(self.config['random_walk_length'] - 1)
+        self.regularization_loss = tf.reduce_sum(self.overlap * self.regularization_distances) / self.num_walks
         return self.config['lambd'] * self.regularization_loss
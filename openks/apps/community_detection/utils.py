@@ -19,6 +19,8 @@ from tqdm import tqdm
 from sklearn.cluster import KMeans
 from texttable import Texttable
 import json
+import multiprocessing
+import scipy.sparse as sp
 from community.community_louvain import modularity as Cmodularity
 
 
@@ -80,29 +82,102 @@ def min_norm(g, node_1, node_2):
     return float(inter) / float(min_norm)
 
 
-def overlap_generator(config, graph):
+class EdgeWeights:
     """
-    Function to generate weight for all of the edges.
-    :param config: configuration
+    Edge weights aligned with the CSR adjacency of graph_to_csr, both directions of every edge included.
+    The values can be passed to CSRWalker as weights, lookups of many edges are vectorized.
+    """
+
+    def __init__(self, indptr, indices, values):
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.num_nodes = len(indptr) - 1
+        self.sources = np.repeat(np.arange(self.num_nodes, dtype=np.int64), np.diff(indptr))
+        self.keys = self.sources * self.num_nodes + indices
+
+    def lookup(self, sources, targets):
+        """
+        Weights of the edges (sources[i], targets[i]), which must exist.
+        """
+
+        positions = np.searchsorted(self.keys, np.asarray(sources, dtype=np.int64) * self.num_nodes + targets)
+        return self.values[positions]
+
+    def to_dict(self):
+        """
+        The weights as {(node_1, node_2): weight}.
+        """
+
+        return dict(zip(zip(self.sources.tolist(), self.indices.tolist()), self.values.tolist()))
+
+
+def common_neighbor_counts(indptr, indices, chunk_size=1000000):
+    """
+    Function to count the common neighbors of the end points of every edge, (A.A)[i, j] for every edge (i, j).
+    The product is computed by blocks of rows holding about chunk_size edges, to cap memory.
+    :param indptr: CSR row pointers.
+    :param indices: CSR indices.
+    :param chunk_size: number of edges per row block.
+    :return: counts aligned with the CSR indices
+    """
+
+    num_nodes = len(indptr) - 1
+    adjacency = sp.csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr), shape=(num_nodes, num_nodes))
+    counts = np.zeros(len(indices), dtype=np.float64)
+    bounds = np.unique(np.append(np.searchsorted(indptr, np.arange(0, len(indices), chunk_size), side='right') - 1,
+                                 num_nodes))
+    for row_start, row_end in zip(bounds[:-1], bounds[1:]):
+        product = (adjacency[row_start:row_end] @ adjacency).tocsr()
+        product.sort_indices()
+        product_rows = np.repeat(np.arange(row_start, row_end, dtype=np.int64), np.diff(product.indptr))
+        product_keys = product_rows * num_nodes + product.indices
+        edge_start, edge_end = indptr[row_start], indptr[row_end]
+        edge_keys = np.repeat(np.arange(row_start, row_end, dtype=np.int64), np.diff(indptr[row_start:row_end + 1])) \
+            * num_nodes + indices[edge_start:edge_end]
+        positions = np.minimum(np.searchsorted(product_keys, edge_keys), max(len(product_keys) - 1, 0))
+        if len(product_keys):
+            found = product_keys[positions] == edge_keys
+            counts[edge_start:edge_end] = np.where(found, product.data[positions], 0)
+    return counts
+
+
+def overlap_weights(config, graph):
+    """
+    Function to generate the weights of all of the edges at once with sparse matrix products.
+    :param config: configuration, overlap_weighting is one of normalized_overlap, overlap, min_norm or unit
     :param graph: graph
-    :return: weight
+    :return: EdgeWeights
     """
 
+    indptr, indices = graph_to_csr(graph)
+    degrees = np.diff(indptr).astype(np.float64)
+    sources = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    if config['overlap_weighting'] in ("normalized_overlap", "overlap", "min_norm"):
+        inter = common_neighbor_counts(indptr, indices, config.get('overlap_chunk_size', 1000000))
     if config['overlap_weighting'] == "normalized_overlap":
-        overlap_weighter = normalized_overlap
+        values = inter / (degrees[sources] + degrees[indices] - inter)
     elif config['overlap_weighting'] == "overlap":
-        overlap_weighter = overlap
+        values = inter
     elif config['overlap_weighting'] == "min_norm":
-        overlap_weighter = min_norm
+        values = inter / np.minimum(degrees[sources], degrees[indices])
     else:
-        overlap_weighter = unit
+        values = np.ones(len(indices), dtype=np.float64)
+    return EdgeWeights(indptr, indices, values)
+
+
+def overlap_generator(config, graph):
+    """
+    Function to generate weight for all of the edges.
+    :param config: configuration
+    :param graph: graph
+    :return: weight
+    """
+
     print(" ")
     print("Weight calculation started.")
     print(" ")
-    edges = nx.edges(graph)
-    weights = {edge: overlap_weighter(graph, edge[0], edge[1]) for edge in tqdm(edges)}
-    weights_prime = {(edge[1], edge[0]): value for edge, value in weights.items()}
-    weights.update(weights_prime)
+    weights = overlap_weights(config, graph).to_dict()
     print(" ")
     return weights
 
@@ -413,6 +488,236 @@ def alias_draw(J, q):
         return J[kk]
 
 
+def graph_to_csr(graph):
+    """
+    Function to turn a networkx graph with nodes 0..n-1 into CSR adjacency arrays, neighbors sorted per node.
+    :param graph: NX graph.
+    :return: indptr, indices
+    """
+
+    edges = np.array(list(graph.edges()), dtype=np.int64).reshape(-1, 2)
+    num_nodes = max(graph.number_of_nodes(), int(edges.max()) + 1 if len(edges) else 0)
+    if not graph.is_directed():
+        edges = np.concatenate([edges, edges[:, ::-1]])
+        edges = edges[edges[:, 0] != edges[:, 1]] if len(edges) else edges
+        loops = np.array([(node, node) for node in nx.nodes_with_selfloops(graph)], dtype=np.int64).reshape(-1, 2)
+        edges = np.concatenate([edges, loops])
+    order = np.lexsort((edges[:, 1], edges[:, 0]))
+    edges = edges[order]
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 0], minlength=num_nodes), out=indptr[1:])
+    return indptr, np.ascontiguousarray(edges[:, 1])
+
+
+def alias_tables(indptr, weights):
+    """
+    Function to build the alias tables of the transition probabilities of every node at once.
+    :param indptr: CSR row pointers.
+    :param weights: edge weights aligned with the CSR indices.
+    :return: J, q aligned with the CSR indices, positions are relative to the row start
+    """
+
+    J = np.zeros(len(weights), dtype=np.int64)
+    q = np.zeros(len(weights), dtype=np.float64)
+    for node in range(len(indptr) - 1):
+        start, end = indptr[node], indptr[node + 1]
+        if end > start:
+            probs = np.asarray(weights[start:end], dtype=np.float64)
+            J[start:end], q[start:end] = alias_setup_array(probs / probs.sum())
+    return J, q
+
+
+def alias_setup_array(probs):
+    """
+    Alias table of one discrete distribution with NumPy arrays.
+    :param probs: probabilities
+    :return: J, q
+    """
+
+    K = len(probs)
+    q = probs * K
+    J = np.zeros(K, dtype=np.int64)
+    smaller = list(np.nonzero(q < 1.0)[0])
+    larger = list(np.nonzero(q >= 1.0)[0])
+    while len(smaller) > 0 and len(larger) > 0:
+        small = smaller.pop()
+        large = larger.pop()
+        J[small] = large
+        q[large] = q[large] + q[small] - 1.0
+        if q[large] < 1.0:
+            smaller.append(large)
+        else:
+            larger.append(large)
+    q[larger] = 1.0
+    return J, q
+
+
+class CSRWalker:
+    """
+    Vectorized random walker over CSR adjacency arrays.
+    All walks of a batch advance together, one NumPy step per walk position.
+    First order walks draw the next node from per-node alias tables (uniform when there are no edge weights),
+    second order (node2vec) walks use rejection sampling, which for unit edge weights gives the same transition
+    probabilities as the per-edge alias tables of SecondOrderRandomWalker without building them.
+    Nodes are expected to be 0..n-1, as everywhere in the model. A walk reaching a node without neighbors stays there.
+    """
+
+    def __init__(self, graph, length, second_order=False, p=1.0, q=1.0, weights=None):
+        """
+        :param graph: NX graph.
+        :param length: length of the walks.
+        :param second_order: node2vec walks with return parameter p and in-out parameter q.
+        :param weights: optional edge weights aligned with the CSR indices of graph_to_csr, first order only.
+        """
+
+        self.indptr, self.indices = graph_to_csr(graph)
+        self.num_nodes = len(self.indptr) - 1
+        self.degree = np.diff(self.indptr)
+        self.length = length
+        self.second_order = second_order
+        self.p = float(p)
+        self.q = float(q)
+        self.alias = alias_tables(self.indptr, weights) if weights is not None else None
+        sources = np.repeat(np.arange(self.num_nodes, dtype=np.int64), self.degree)
+        # CSR rows and their indices are sorted, so the edge keys are sorted too
+        self.edge_keys = sources * self.num_nodes + self.indices
+
+    def has_edge(self, sources, targets):
+        """
+        Vectorized edge membership test.
+        """
+
+        keys = sources * self.num_nodes + targets
+        positions = np.minimum(np.searchsorted(self.edge_keys, keys), max(len(self.edge_keys) - 1, 0))
+        return self.edge_keys[positions] == keys if len(self.edge_keys) else np.zeros(len(keys), dtype=bool)
+
+    def first_order_step(self, current, rng):
+        """
+        Draw one neighbor of every current node.
+        """
+
+        if not len(self.indices):
+            return current.copy()
+        degree = self.degree[current]
+        offsets = np.minimum(np.floor(rng.random(len(current)) * degree).astype(np.int64), np.maximum(degree - 1, 0))
+        # nodes without neighbors point past their row, positions are clipped and the node is kept below
+        positions = np.minimum(self.indptr[current] + offsets, len(self.indices) - 1)
+        if self.alias is not None:
+            reject = rng.random(len(current)) >= self.alias[1][positions]
+            positions = np.minimum(self.indptr[current] + np.where(reject, self.alias[0][positions], offsets),
+                                   len(self.indices) - 1)
+        return np.where(degree > 0, self.indices[positions], current)
+
+    def second_order_step(self, previous, current, rng):
+        """
+        Draw the next node of every walk with the node2vec biased transition.
+        """
+
+        upper = max(1.0 / self.p, 1.0, 1.0 / self.q)
+        result = current.copy()
+        pending = np.nonzero(self.degree[current] > 0)[0]
+        while len(pending):
+            candidates = self.first_order_step(current[pending], rng)
+            weights = np.where(candidates == previous[pending], 1.0 / self.p,
+                               np.where(self.has_edge(candidates, previous[pending]), 1.0, 1.0 / self.q))
+            accept = rng.random(len(pending)) * upper < weights
+            result[pending[accept]] = candidates[accept]
+            pending = pending[~accept]
+        return result
+
+    def walk(self, starts, rng):
+        """
+        Walks from the given start nodes.
+        :param starts: start nodes.
+        :param rng: NumPy random generator.
+        :return: walks, int64 [len(starts), length]
+        """
+
+        walks = np.empty((len(starts), self.length), dtype=np.int64)
+        walks[:, 0] = starts
+        for step in range(1, self.length):
+            if self.second_order and step > 1:
+                walks[:, step] = self.second_order_step(walks[:, step - 2], walks[:, step - 1], rng)
+            else:
+                walks[:, step] = self.first_order_step(walks[:, step - 1], rng)
+        return walks
+
+    def repetition(self, seed):
+        """
+        One series of walks, one from every node in shuffled order.
+        """
+
+        rng = np.random.default_rng(seed)
+        return self.walk(rng.permutation(self.num_nodes), rng)
+
+    def do_walks(self, repetitions, workers=1, seed=None):
+        """
+        Do a series of random walks, repetitions run in parallel processes if workers > 1.
+        :return: degrees (occurrence counts of every node), walks int64 [repetitions * n, length]
+        """
+
+        seeds = np.random.SeedSequence(seed).spawn(repetitions)
+        if workers > 1 and repetitions > 1:
+            with multiprocessing.Pool(min(workers, repetitions), initializer=_init_walker, initargs=(self,)) as pool:
+                series = pool.map(_walk_repetition, seeds)
+        else:
+            series = [self.repetition(item) for item in tqdm(seeds)]
+        walks = np.concatenate(series) if series else np.zeros((0, self.length), dtype=np.int64)
+        degrees = np.bincount(walks.ravel(), minlength=self.num_nodes).tolist()
+        return degrees, walks
+
+
+_walker = None
+
+
+def _init_walker(walker):
+    global _walker
+    _walker = walker
+
+
+def _walk_repetition(seed):
+    return _walker.repetition(seed)
+
+
+def walk_batch_generator(walks, window_size):
+    """
+    Function to generate the features and labels of a batch of walks at once.
+    The pairs of every walk are laid out as by batch_input_generator and batch_label_generator, walk after walk.
+    :param walks: walks of the batch, int64 [batch_size, random_walk_length]
+    :param window_size: window_size
+    :return: features, labels
+    """
+
+    length = walks.shape[1]
+    windows = np.lib.stride_tricks.sliding_window_view(walks, window_size, axis=1)
+    inputs = np.concatenate([walks[:, :length - window_size], walks[:, window_size:]], axis=1).reshape(-1)
+    labels = np.concatenate([windows[:, 1:], windows[:, :length - window_size]], axis=1).reshape(-1, window_size)
+    return inputs, labels
+
+
+def batch_index_generation(weights, walks, window_size):
+    """
+    Function to generate overlaps and indices for a batch of walks.
+    Indices point into the per-pair embeddings of the batch, walk b starts at b * 2 * (length - window_size) * window_size.
+    :param weights: weights, a dict or EdgeWeights
+    :param walks: walks of the batch, int64 [batch_size, length]
+    :param window_size: window_size
+    :return: edge_set_1, edge_set_2, overlaps
+    """
+
+    batch_size, length = walks.shape
+    offsets = (np.arange(batch_size) * 2 * (length - window_size) * window_size).reshape(-1, 1)
+    edge_set_1 = (offsets + np.arange(0, length - 1)).reshape(-1)
+    edge_set_2 = (offsets + np.arange(1, length)).reshape(-1)
+    if isinstance(weights, EdgeWeights):
+        overlaps = weights.lookup(walks[:, :-1].reshape(-1), walks[:, 1:].reshape(-1))
+    else:
+        pairs = zip(walks[:, :-1].reshape(-1).tolist(), walks[:, 1:].reshape(-1).tolist())
+        overlaps = [weights[pair] for pair in pairs]
+    overlaps = np.asarray(overlaps, dtype=np.float32).reshape((-1, 1))
+    return edge_set_1, edge_set_2, overlaps
+
+
 def graph_reader(input_path):
     """
     Function to read a csv edge list and transform it to a networkx graph object.
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 HangZhou Hikvision Digital Technology Co., Ltd. All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+
+
+def sort_codes(values):
+    """
+    int64 codes ordered like the values, so that sorting the codes sorts the values
+    :param values: column to sort by, missing values go last as with pandas sort_values
+    :return: codes
+    """
+    codes, _ = pd.factorize(values, sort=True)
+    codes = codes.astype(np.int64)
+    if len(codes):
+        codes[codes < 0] = codes.max() + 1
+    return codes
+
+
+def map_vocab(values, vocab_dic, col, default):
+    """
+    vocab_dic[(col, value)] for every value, the dictionary is looked up once per distinct value
+    :param values: column to map
+    :param default: index of values which are missing or not in the dictionary
+    :return: int64 indexes
+    """
+    codes, uniques = pd.factorize(values)
+    # code -1 of missing values picks the trailing default
+    lookup = np.array([vocab_dic.get((col, value), default) for value in uniques] + [default], dtype=np.int64)
+    return lookup[codes]
+
+
+def frame_chunks(datas, chunk_size):
+    """
+    consecutive row chunks of a DataFrame, so that the pandas temporaries of a transform stay small
+    """
+    for start in range(0, len(datas), chunk_size):
+        yield datas.iloc[start:start + chunk_size]
+
+
+def build_events(datas, transform, chunk_size=100000):
+    """
+    preprocess an event log chunk by chunk and group the result by user
+    :param datas: DataFrame with user_id and event_time columns
+    :param transform: function from a DataFrame chunk to a dict of arrays with one row per event
+    :param chunk_size: number of events transformed at once
+    :return: EventArrays
+    """
+    parts = [transform(chunk.copy()) for chunk in frame_chunks(datas, chunk_size)]
+    arrays = {name: np.concatenate([part[name] for part in parts]) for name in (parts[0] if parts else {})}
+    return EventArrays.group(datas["user_id"].values, datas["event_time"].values, arrays)
+
+
+def user_labels(labels, users):
+    """
+    label of every user, in the order of users
+    """
+    return labels.drop_duplicates("user_id").set_index("user_id")["label"].reindex(users).values
+
+
+def cache_key(datas, *params):
+    """
+    digest of the event log and the parameters of its preprocessing (vocabulary, scaler, columns...)
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([str(col) for col in datas.columns]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(datas, index=False).values.tobytes())
+    digest.update(pickle.dumps(params, protocol=4))
+    return digest.hexdigest()
+
+
+class EventArrays(object):
+    """
+    Event log of many users as contiguous arrays, rows sorted by (user_id, event_time):
+    users: sorted user ids, int64 [n_users] or object array
+    offsets: int64 [n_users + 1], the events of users[i] are rows offsets[i]:offsets[i + 1]
+    arrays: name -> array of shape [n_events, ...], e.g. category indexes, dense features and masks
+    """
+
+    def __init__(self, users, offsets, arrays):
+        self.users = users
+        self.offsets = offsets
+        self.arrays = arrays
+
+    @classmethod
+    def group(cls, user_ids, event_times, arrays):
+        """
+        sort the rows of arrays by user and event time and index them by user
+        :param user_ids: user id of every row
+        :param event_times: event time of every row
+        :param arrays: name -> array, rows in the order of user_ids
+        :return: EventArrays
+        """
+        user_ids = np.asarray(user_ids)
+        # lexsort is stable, events with the same time keep their order as in pandas sort_values
+        order = np.lexsort((sort_codes(event_times), sort_codes(user_ids)))
+        users, starts = np.unique(user_ids[order], return_index=True)
+        offsets = np.append(starts, len(order)).astype(np.int64)
+        return cls(users, offsets, {name: np.ascontiguousarray(array[order]) for name, array in arrays.items()})
+
+    def __len__(self):
+        return len(self.users)
+
+    def window(self, item, seq_len):
+        """
+        rows of the last seq_len events of the item-th user
+        :return: start, stop
+        """
+        stop = int(self.offsets[item + 1])
+        return max(int(self.offsets[item]), stop - seq_len), stop
+
+    def padded(self, name, start, stop, seq_len, reverse=False):
+        """
+        rows start:stop of an array, optionally in reverse order, followed by zero rows up to seq_len
+        """
+        array = self.arrays[name]
+        out = np.zeros((seq_len,) + array.shape[1:], dtype=array.dtype)
+        rows = array[start:stop]
+        out[:stop - start] = rows[::-1] if reverse else rows
+        return out
+
+    def save(self, path):
+        """
+        write one .npy file per array into path, meta.json is written last and marks a complete cache
+        """
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'users.npy'), self.users, allow_pickle=True)
+        np.save(os.path.join(tmp_path, 'offsets.npy'), self.offsets)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'arrays': list(self.arrays)}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        read arrays written by save, memory-mapped read-only by default so DataLoader workers share the pages
+        """
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        users = np.load(os.path.join(path, 'users.npy'), allow_pickle=True)
+        offsets = np.load(os.path.join(path, 'offsets.npy'))
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in meta['arrays']}
+        return cls(users, offsets, arrays)
+
+    @classmethod
+    def cached(cls, cache_dir, key, builder):
+        """
+        load the arrays of key from cache_dir, or build and save them
+        :param cache_dir: directory of cached arrays, no caching if empty
+        :param key: cache key, see cache_key
+        :param builder: function returning EventArrays
+        :return: EventArrays
+        """
+        if not cache_dir:
+            return builder()
+        path = os.path.join(cache_dir, key)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            return cls.load(path)
+        events = builder()
+        events.save(path)
+        return cls.load(path)
@@ -20,6 +20,7 @@ import numpy as np
 import pandas as pd
 from torch.autograd import Variable
 from .utils import *
+from .event_arrays import EventArrays, map_vocab, cache_key, build_events, user_labels
 
 from openks.models import TorchDataset
 
@@ -29,6 +30,8 @@ class CatEmbdConcatData(TorchDataset):
     get data for category column embedding pre-mode
     data: user_id event_time cat1~catN  dense1~denseN
     labels: user_id label
+
+    the event log is preprocessed once into per-user arrays (see EventArrays), cached in config["cache_dir"] if set
     """
 
     def __init__(self, datas, config, labels=None, isStandScaler=True, dropTime=True):
@@ -42,69 +45,48 @@ class CatEmbdConcatData(TorchDataset):
         vocab_dic = config["vocab_dic"]
         ss = config["standardScaler"]
         if labels is not None:
-            self.labels = labels.sort_values('user_id').reset_index(drop=True)
             datas = datas.merge(labels[["user_id"]].drop_duplicates(), on="user_id", how="inner")
-        else:
-            self.labels = None
-
-        self.user_id = datas['user_id'].drop_duplicates().sort_values().reset_index(drop=True)
-        self.data_len = self.user_id.shape[0]
-        datas = datas.sort_values(["user_id", "event_time"])
-        self.att_mask = datas.set_index(["user_id"]).notnull().astype(np.int).reset_index(drop=False)
-
-        # datas = datas.sort_values(["user_id", "event_time"])
-        # self.att_mask = self.att_mask.sort_values(["user_id", "event_time"])
-        if isStandScaler:
-            datas[self.dense_cols] = ss.transform(datas[self.dense_cols])
-        for cat_col in ["event_time"] + self.cat_cols:
-            datas[cat_col] = datas[cat_col].map(
-                lambda x: vocab_dic[(cat_col, x)] if (cat_col, x) in vocab_dic else 0)
-        datas.fillna(0, inplace=True)
-        if dropTime:
-            datas.drop("event_time", axis=1, inplace=True)
-            self.att_mask.drop("event_time", axis=1, inplace=True)
-            self.time_num = 0
-        self.datas = datas.groupby("user_id")
-
-        self.att_mask = self.att_mask.groupby("user_id")
-        self.pad_vector = [0 for i in range(self.cat_num + self.time_num)] + [0 for i in range(self.dense_num)]
+        feature_cols = [col for col in datas.columns if col != "user_id" and not (dropTime and col == "event_time")]
+        cat_end = self.cat_num + self.time_num
+
+        def transform(chunk):
+            att_mask = chunk[feature_cols].notnull().values.astype(np.int8)
+            if isStandScaler:
+                chunk[self.dense_cols] = ss.transform(chunk[self.dense_cols])
+            for cat_col in ["event_time"] + self.cat_cols:
+                chunk[cat_col] = map_vocab(chunk[cat_col], vocab_dic, cat_col, 0)
+            values = chunk[feature_cols].fillna(0).values
+            return {
+                'cat': values[:, :cat_end].astype(np.int64),
+                'dense': values[:, cat_end:].astype(np.float32),
+                'cat_mask': att_mask[:, :cat_end],
+                'dense_mask': att_mask[:, cat_end:]
+            }
+
+        key = cache_key(datas, self.__class__.__name__, feature_cols, cat_end, isStandScaler, self.dense_cols, vocab_dic, ss)
+        self.events = EventArrays.cached(
+            config.get("cache_dir"), key, lambda: build_events(datas, transform, config.get("chunk_size", 100000)))
+        self.user_id = pd.Series(self.events.users)
+        self.data_len = len(self.events)
+        self.labels = user_labels(labels, self.events.users) if labels is not None else None
 
     def __len__(self):
         return self.data_len
 
     def __getitem__(self, item):
-        user_id = self.user_id[item]
-        user_id_df = pd.DataFrame({'user_id': user_id})
-        if self.labels:
-            label = self.labels.merge(user_id_df, on='user_id')['label'].values
-
-        event_data = self.datas.get_group(user_id).iloc[-self.config["seq_len"]:, :].drop("user_id", axis=1).values
-        event_attmask = self.att_mask.get_group(user_id).iloc[-self.config["seq_len"]:, :].drop("user_id",
-                                                                                                axis=1).values
-        inv_eventData = event_data[::-1]
-        real_eventNum = len(event_data)
-        padding_data = np.array([self.pad_vector for i in range(self.config["seq_len"] - real_eventNum)])
-        if self.config["seq_len"] - real_eventNum > 0:
-            event_data = np.concatenate([event_data, padding_data])
-            inv_eventData = np.concatenate([inv_eventData, padding_data])
-            event_attmask = np.concatenate([event_attmask, padding_data])
-        masks = np.array([1 for i in range(real_eventNum)] + [0 for i in range(self.config["seq_len"] - real_eventNum)])
+        start, stop = self.events.window(item, self.seq_len)
+        masks = (np.arange(self.seq_len) < stop - start).astype(np.int64)
+        inputs = (torch.as_tensor(self.events.padded('cat', start, stop, self.seq_len, reverse=True), dtype=torch.long), \
+                  torch.as_tensor(self.events.padded('dense', start, stop, self.seq_len, reverse=True), dtype=torch.float32), \
+                  torch.as_tensor(self.events.padded('cat', start, stop, self.seq_len), dtype=torch.long), \
+                  torch.as_tensor(self.events.padded('dense', start, stop, self.seq_len), dtype=torch.float32), \
+                  torch.as_tensor(self.events.padded('cat_mask', start, stop, self.seq_len), dtype=torch.long), \
+                  torch.as_tensor(self.events.padded('dense_mask', start, stop, self.seq_len), dtype=torch.long), \
+                  torch.as_tensor(masks))
         if self.labels is not None:
-            return (torch.as_tensor(inv_eventData[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(inv_eventData[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_data[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(event_data[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_attmask[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(event_attmask[:, (self.cat_num + self.time_num):].copy(), dtype=torch.long), \
-                    torch.as_tensor(masks)), torch.as_tensor(label)
+            return inputs, torch.as_tensor(self.labels[item])
         else:
-            return (torch.as_tensor(inv_eventData[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(inv_eventData[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_data[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(event_data[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_attmask[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(event_attmask[:, (self.cat_num + self.time_num):].copy(), dtype=torch.long), \
-                    torch.as_tensor(masks))
+            return inputs
 
 
 class CatOneHotConcatData(TorchDataset):
@@ -112,6 +94,8 @@ class CatOneHotConcatData(TorchDataset):
     get data for category column one-hot pre-mode：
     data: user_id event_time cat1~catN  dense1~denseN
     labels: user_id label
+
+    one-hot features are kept as the indexes of their active columns and only densified per sample window
     """
 
     def __init__(self, datas, config, labels=None, isStandScaler=True):
@@ -126,58 +110,52 @@ class CatOneHotConcatData(TorchDataset):
         ss = config["standardScaler"]
 
         if labels is not None:
-            self.labels = labels.sort_values('user_id').reset_index(drop=True)
             datas = datas.merge(labels[["user_id"]].drop_duplicates(), on="user_id", how="inner")
-        else:
-            self.labels = None
-
-        self.user_id = datas['user_id'].drop_duplicates().sort_values().reset_index(drop=True)
-        self.data_len = self.user_id.shape[0]
-        final_datas = datas[["user_id", "event_time"]].copy()
-
-        cat_datas = enc.transform(datas[self.cat_cols].fillna(-1)).todense()
-        encCatCols = enc.get_feature_names()
-        catEnc_df = pd.DataFrame(cat_datas, columns=encCatCols)
-
-        if isStandScaler:
-            dense_df = pd.DataFrame(ss.transform(datas[self.dense_cols]), columns=self.dense_cols)
-        else:
-            dense_df = datas[self.dense_cols]
-        final_datas = pd.concat([final_datas, catEnc_df, dense_df], axis=1)
-        final_datas.fillna(0, inplace=True)
-        final_datas = final_datas.sort_values(["user_id", "event_time"])
-
-        final_datas.drop("event_time", axis=1, inplace=True)
-        self.datas = final_datas.groupby("user_id")
-
-        self.pad_vector = [0 for i in range(len(encCatCols))] + [0 for i in range(self.dense_num)]
+        self.onehot_dim = enc.transform(datas[self.cat_cols].iloc[:1].fillna(-1)).shape[1]
+
+        def transform(chunk):
+            onehot = enc.transform(chunk[self.cat_cols].fillna(-1)).tocsr()
+            # 1 + index of every active one-hot column, 0 for none, at most one per category column
+            rows = np.repeat(np.arange(len(chunk)), np.diff(onehot.indptr))
+            slots = np.arange(onehot.nnz) - onehot.indptr[rows]
+            active = np.zeros((len(chunk), len(self.cat_cols)), dtype=np.int32)
+            active[rows, slots] = onehot.indices + 1
+            if isStandScaler:
+                dense = ss.transform(chunk[self.dense_cols])
+            else:
+                dense = chunk[self.dense_cols].values
+            return {'onehot': active, 'dense': np.nan_to_num(np.asarray(dense, dtype=np.float32))}
+
+        key = cache_key(datas, self.__class__.__name__, isStandScaler, self.cat_cols, self.dense_cols, enc, ss)
+        self.events = EventArrays.cached(
+            config.get("cache_dir"), key, lambda: build_events(datas, transform, config.get("chunk_size", 100000)))
+        self.user_id = pd.Series(self.events.users)
+        self.data_len = len(self.events)
+        self.labels = user_labels(labels, self.events.users) if labels is not None else None
 
     def __len__(self):
         return self.data_len
 
-    def __getitem__(self, item):
+    def _window(self, start, stop, reverse=False):
+        """
+        dense one-hot and numerical features of rows start:stop padded to seq_len
+        """
+        event_data = np.zeros((self.seq_len, self.onehot_dim + self.events.arrays['dense'].shape[1]), dtype=np.float32)
+        active = self.events.padded('onehot', start, stop, self.seq_len, reverse)
+        rows, slots = np.nonzero(active)
+        event_data[rows, active[rows, slots] - 1] = 1
+        event_data[:, self.onehot_dim:] = self.events.padded('dense', start, stop, self.seq_len, reverse)
+        return event_data
 
-        user_id = self.user_id[item]
+    def __getitem__(self, item):
+        start, stop = self.events.window(item, self.seq_len)
+        masks = (np.arange(self.seq_len) < stop - start).astype(np.int64)
+        inputs = (torch.as_tensor(self._window(start, stop, reverse=True), dtype=torch.float32), \
+                  torch.as_tensor(self._window(start, stop), dtype=torch.float32), torch.as_tensor(masks))
         if self.labels is not None:
-            label = self.labels['label'][item]
-        event_data = self.datas.get_group(user_id).iloc[-self.config["seq_len"]:, :].drop("user_id", axis=1).values
-
-        inv_eventData = event_data[::-1]
-        real_eventNum = len(event_data)
-        padding_data = np.array(
-            [self.pad_vector for i in range(self.config["seq_len"] - real_eventNum)])
-        if self.config["seq_len"] - real_eventNum > 0:
-            event_data = np.concatenate([event_data, padding_data])
-            inv_eventData = np.concatenate([inv_eventData, padding_data])
-
-        masks = np.array([1 for i in range(real_eventNum)] + [0 for i in range(self.config["seq_len"] - real_eventNum)])
-        if self.labels:
-            return (torch.as_tensor(inv_eventData.copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_data.copy(), dtype=torch.float32), torch.as_tensor(masks)), torch.as_tensor(
-                label)
+            return inputs, torch.as_tensor(self.labels[item])
         else:
-            return (torch.as_tensor(inv_eventData.copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_data.copy(), dtype=torch.float32), torch.as_tensor(masks))
+            return inputs
 
 
 class AllEmbdSumData(TorchDataset):
@@ -185,6 +163,8 @@ class AllEmbdSumData(TorchDataset):
     get data for all column embedding pre-mode
     data: user_id event_time cat1~catN  dense1~denseN
     labels: user_id label
+
+    the event log is preprocessed once into per-user arrays (see EventArrays), cached in config["cache_dir"] if set
     """
 
     def __init__(self, datas, config, labels=None, isStandScaler=True, dropTime=True):
@@ -195,38 +175,35 @@ class AllEmbdSumData(TorchDataset):
         self.dense_num = config["dense_num"]
         self.cat_cols = config["cat_cols"]
         self.cat_num = config["cat_num"]
-        self.time_num = config["time_num"]
+        self.time_num = 0 if dropTime else config["time_num"]
         vocab_dic = config["vocab_dic"]
         ss = config["standScaler"]
         if labels is not None:
-            self.labels = labels.sort_values('user_id').reset_index(drop=True)
             datas = datas.merge(labels[["user_id"]].drop_duplicates(), on="user_id", how="inner")
-        else:
-            self.labels = None
-
-        self.user_id = datas['user_id'].drop_duplicates().sort_values().reset_index(drop=True)
-        self.data_len = self.user_id.shape[0]
-        datas = datas.sort_values(["user_id", "event_time"])
-        self.att_mask = datas.set_index(["user_id", "event_time"]).notnull().astype(np.int).reset_index(drop=False)
-
-        # datas = datas.sort_values(["user_id", "event_time"])
-        # self.att_mask = self.att_mask.sort_values(["user_id", "event_time"])
-        self.att_mask["event_time"] = 1
-        if isStandScaler:
-            datas[self.dense_cols] = ss.transform(datas[self.dense_cols])
-        for cat_col in self.cat_cols:
-            datas[cat_col] = datas[cat_col].map(
-                lambda x: vocab_dic[(cat_col, x)] if (cat_col, x) in vocab_dic else vocab_dic[
-                    cat_col])
-        datas.fillna(0, inplace=True)
-        if dropTime:
-            datas.drop("event_time", axis=1, inplace=True)
-            self.att_mask.drop("event_time", axis=1, inplace=True)
-            self.time_num = 0
-        self.datas = datas.groupby("user_id")
-
-        self.att_mask = self.att_mask.groupby("user_id")
-        self.pad_vector = [0 for i in range(self.cat_num + self.time_num)] + [0 for i in range(self.dense_num)]
+        feature_cols = [col for col in datas.columns if col != "user_id" and not (dropTime and col == "event_time")]
+        cat_end = self.cat_num + self.time_num
+
+        def transform(chunk):
+            att_mask = chunk[feature_cols].notnull().values.astype(np.float32)
+            # the time column is always attended to
+            att_mask[:, [col == "event_time" for col in feature_cols]] = 1
+            if isStandScaler:
+                chunk[self.dense_cols] = ss.transform(chunk[self.dense_cols])
+            for cat_col in self.cat_cols:
+                chunk[cat_col] = map_vocab(chunk[cat_col], vocab_dic, cat_col, vocab_dic[cat_col])
+            values = chunk[feature_cols].fillna(0).values
+            return {
+                'cat': values[:, :cat_end].astype(np.int64),
+                'dense': values[:, cat_end:].astype(np.float32),
+                'att_mask': att_mask
+            }
+
+        key = cache_key(datas, self.__class__.__name__, feature_cols, cat_end, isStandScaler, self.dense_cols, vocab_dic, ss)
+        self.events = EventArrays.cached(
+            config.get("cache_dir"), key, lambda: build_events(datas, transform, config.get("chunk_size", 100000)))
+        self.user_id = pd.Series(self.events.users)
+        self.data_len = len(self.events)
+        self.labels = user_labels(labels, self.events.users) if labels is not None else None
 
     def __len__(self):
         return self.data_len
@@ -237,35 +214,16 @@ class AllEmbdSumData(TorchDataset):
         :param item:
         :return:
         """
-        user_id = self.user_id[item]
-        if self.labels is not None:
-            label = self.labels['label'][item]
-
-        event_data = self.datas.get_group(user_id).iloc[-self.seq_len:, :].drop("user_id", axis=1).values
-        event_attmask = self.att_mask.get_group(user_id).iloc[-self.seq_len:, :].drop("user_id", axis=1).values
-        inv_eventData = event_data[::-1]
-        inv_eventAttmask = event_attmask[::-1]
-        real_eventNum = len(event_data)
-        padding_data = np.array(
-            [self.pad_vector for i in range(self.config["seq_len"] - real_eventNum)])
-        if self.config["seq_len"] - real_eventNum > 0:
-            event_data = np.concatenate([event_data, padding_data])
-            inv_eventData = np.concatenate([inv_eventData, padding_data])
-            event_attmask = np.concatenate([event_attmask, padding_data])
-            inv_eventAttmask = np.concatenate([inv_eventAttmask, padding_data])
-        masks = np.array([1 for i in range(real_eventNum)] + [0 for i in range(self.config["seq_len"] - real_eventNum)])
+        start, stop = self.events.window(item, self.seq_len)
+        masks = (np.arange(self.seq_len) < stop - start).astype(np.int64)
+        inputs = (torch.as_tensor(self.events.padded('cat', start, stop, self.seq_len, reverse=True), dtype=torch.long), \
+                  torch.as_tensor(self.events.padded('dense', start, stop, self.seq_len, reverse=True), dtype=torch.float32), \
+                  torch.as_tensor(self.events.padded('cat', start, stop, self.seq_len), dtype=torch.long), \
+                  torch.as_tensor(self.events.padded('dense', start, stop, self.seq_len), dtype=torch.float32), \
+                  torch.as_tensor(self.events.padded('att_mask', start, stop, self.seq_len, reverse=True), dtype=torch.float32), \
+                  torch.as_tensor(self.events.padded('att_mask', start, stop, self.seq_len), dtype=torch.float32), \
+                  torch.as_tensor(masks))
         if self.labels is not None:
-            return (torch.as_tensor(inv_eventData[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(inv_eventData[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_data[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(event_data[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(inv_eventAttmask.copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_attmask.copy(), dtype=torch.float32), torch.as_tensor(masks)), \
-                   torch.as_tensor(label)
+            return inputs, torch.as_tensor(self.labels[item])
         else:
-            return (torch.as_tensor(inv_eventData[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(inv_eventData[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_data[:, :(self.cat_num + self.time_num)].copy(), dtype=torch.long), \
-                    torch.as_tensor(event_data[:, (self.cat_num + self.time_num):].copy(), dtype=torch.float32), \
-                    torch.as_tensor(inv_eventAttmask.copy(), dtype=torch.float32), \
-                    torch.as_tensor(event_attmask.copy(), dtype=torch.float32), torch.as_tensor(masks))
+            return inputs
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import multiprocessing
+import numpy as np
 import pandas as pd
 from functools import reduce
 import networkx as nx
@@ -12,18 +14,108 @@ import networkx as nx
 #     参数说明：person_or_enterprise：string类型，输入枚举（’person‘）个人或（’enterprise‘）企业，返回个人控股关系或企业控股关系；
 #             deep_num：int类型，用于控制控股关系的最大穿透层数；
 #             ratio_p：double类型，用于筛选控股关系的控股比例阈值
+#             workers：int类型，计算控股比例的进程数，默认为1
 #     返回值：dict类型，key为主控人（法人），value为dict类型，包含被控企业以及控股比例
 # 2 一致行动人识别concerted_action_people()
 #     返回值：tuple类型，列出了三类（总监高，个人直接持股30%以上，公用董监高三种一致行动人结果）
 # 3 实控人识别actual_controller()
 #     无需输入参数
 #     返回所有实控人dict，key为公司，value为实控人
+# 控股比例由control_chain_engine计算：投资关系图只构建一次（CSR邻接表与(src, dst)->投资比例索引），
+# 每个投资方做一次限制深度的深度优先搜索，累加所有路径上投资比例的乘积，耗时与搜索到的路径数成正比
+
+
+class control_chain_engine:
+    #构建投资关系图，节点按src_uid、dst_uid首次出现的顺序编号，因此编号小于num_sources的节点即为投资方
+    def __init__(self,data):
+        codes, self.uids = pd.factorize(pd.concat([data['src_uid'], data['dst_uid']], ignore_index=True))
+        src = codes[:len(data)].astype(np.int64)
+        dst = codes[len(data):].astype(np.int64)
+        self.num_nodes = len(self.uids)
+        self.num_sources = int(src.max()) + 1 if len(src) else 0
+        #(src, dst)->投资比例索引，重复的边取第一条记录的比例
+        keys = src * self.num_nodes + dst
+        self.edge_keys, first = np.unique(keys, return_index=True)
+        self.edge_ratios = data['invest_ratio'].values.astype(np.float64)[first]
+        #CSR邻接表，邻居保持数据中的顺序，重复的边保留，与逐条记录遍历一致
+        order = np.argsort(src, kind='stable')
+        self.indptr = np.append(0, np.cumsum(np.bincount(src, minlength=self.num_nodes))).astype(np.int64)
+        self.indices = dst[order]
+        self.ratios = self.edge_ratios[np.searchsorted(self.edge_keys, keys[order])]
+        self.codes = {uid: i for i, uid in enumerate(self.uids)}
+        #深度优先搜索逐个访问元素，使用list比numpy数组快
+        self.csr_lists = (self.indptr.tolist(), self.indices.tolist(), self.ratios.tolist())
+
+    #查询单条投资关系的比例，不存在时返回None
+    def ratio(self,src,dst):
+        if src not in self.codes or dst not in self.codes:
+            return None
+        key = self.codes[src] * self.num_nodes + self.codes[dst]
+        pos = np.searchsorted(self.edge_keys, key)
+        if pos < len(self.edge_keys) and self.edge_keys[pos] == key:
+            return self.edge_ratios[pos]
+        return None
+
+    #从source出发，累加所有不超过deep_num个节点的简单路径上投资比例的乘积，返回{节点编号: 控股比例}
+    def ownership(self,source,deep_num):
+        indptr, indices, ratios = self.csr_lists
+        result = {}
+        if deep_num < 2:
+            return result
+        on_path = {source}
+        #栈中保存(节点, 路径节点数, 路径比例乘积, 下一个邻居的位置)
+        stack = [(source, 1, 1.0, indptr[source])]
+        while stack:
+            node, length, product, pos = stack[-1]
+            if pos == indptr[node + 1]:
+                stack.pop()
+                on_path.discard(node)
+                continue
+            stack[-1] = (node, length, product, pos + 1)
+            nxt = indices[pos]
+            if nxt in on_path:
+                continue
+            #第一跳直接取投资比例，之后依次相乘
+            nxt_product = ratios[pos] if length == 1 else product * ratios[pos]
+            result[nxt] = result.get(nxt, 0) + nxt_product
+            if length + 1 < deep_num:
+                on_path.add(nxt)
+                stack.append((nxt, length + 1, nxt_product, indptr[nxt]))
+        return result
+
+    #source对其它投资方的控股比例中超过ratio_p的部分，按数据中出现的顺序返回{uid: 控股比例}
+    def holdings(self,source,deep_num,ratio_p):
+        source = self.codes[source]
+        ownership = self.ownership(source,deep_num)
+        return {self.uids[i]: ownership[i] for i in sorted(ownership)
+                if i < self.num_sources and i != source and ownership[i] > ratio_p}
+
+    #批量计算多个投资方的控股关系，workers大于1时使用进程池
+    def batch_holdings(self,sources,deep_num,ratio_p,workers=1):
+        if workers <= 1:
+            return [self.holdings(i,deep_num,ratio_p) for i in sources]
+        with multiprocessing.Pool(workers, initializer=_init_engine, initargs=(self,)) as pool:
+            return pool.map(_engine_holdings, [(i, deep_num, ratio_p) for i in sources],
+                            chunksize=max(1, len(sources) // (workers * 4)))
+
+
+_engine = None
+
+
+def _init_engine(engine):
+    global _engine
+    _engine = engine
+
+
+def _engine_holdings(args):
+    return _engine.holdings(*args)
 
 
 class financial_risk_control_model:
     #数据初始化
     def __init__(self,filename):
         self.data = pd.read_csv(filename)
+        self.engine = control_chain_engine(self.data)
 
     #获取投资对象数据，即在有向图中为邻居
     def get_all_neighbors(self):
@@ -37,7 +129,9 @@ class financial_risk_control_model:
         if start == end:
             return [path]
         paths = [] #存储全部路径    
-        for node in nei_graph[start]:
+        if len(path) >= deep_num:
+            return paths
+        for node in nei_graph.get(start, []):
             if node not in path:
                 newpaths = self.findAllPath(nei_graph,node,end,deep_num,path) 
                 for newpath in newpaths:
@@ -55,42 +149,33 @@ class financial_risk_control_model:
                 invest_list = []
                 invest_list_ratio = 0
                 for j in [(x,y) for x, y in zip(i, i[1:])]:                   
-                    invest_r = self.data[(self.data['src_uid']==j[0])&(self.data['dst_uid']==j[1])]
-                    if len(invest_r)>0:
-                        invest_list.append(invest_r.invest_ratio.values[0])                       
+                    invest_r = self.engine.ratio(j[0],j[1])
+                    if invest_r is not None:
+                        invest_list.append(invest_r)                       
                 if len(invest_list)>1:
                     invest_list_ratio = reduce(lambda x, y: x*y, invest_list)
                 if len(invest_list)==1:
                     invest_list_ratio = invest_list[0]
                 inv.append(invest_list_ratio)
             if len(i)==2:
-                invest_r = self.data[(self.data['src_uid']==i[0])&(self.data['dst_uid']==i[1])].invest_ratio.values
-                if len(invest_r)>0:
-                    inv.append(invest_r[0])
+                invest_r = self.engine.ratio(i[0],i[1])
+                if invest_r is not None:
+                    inv.append(invest_r)
         return sum(inv)
     
     #计算所有投资比例之和    
     def find_all_invest(self,start_company,deep_num,ratio_p):
         if start_company not in self.data.src_uid.values:
             return None
-        data = self.data
-        result = {}
-        graph = self.get_all_neighbors()
-        for i in data.src_uid.values:
-            if i!=start_company:
-                all_path = self.findAllPath(graph,start_company,i,deep_num,path=[])
-                start_company_inv_ratio = self.comp_invest_ratio(all_path)
-                if start_company_inv_ratio>ratio_p:
-                    result[i] = start_company_inv_ratio
-        return result
+        return self.engine.holdings(start_company,deep_num,ratio_p)
     
     #计算数据中的所有控股信息
-    def holding_invest(self,person_or_enterprise,deep_num,ratio_p):
+    def holding_invest(self,person_or_enterprise,deep_num,ratio_p,workers=1):
         data = self.data
         data = data[data.src_label==person_or_enterprise]
+        sources = list(pd.unique(data.src_uid.values))
         result = {}
-        for i in set(data.src_uid.values):
-            k = self.find_all_invest(i,deep_num,ratio_p)
+        for i, k in zip(sources, self.engine.batch_holdings(sources,deep_num,ratio_p,workers)):
             if len(k)>0:
                 result[i] = k
         return result
@@ -104,9 +189,9 @@ class financial_risk_control_model:
         return (data1.values,data2.values,data3)
     
     #实际控制人识别
-    def actual_controller(self):
+    def actual_controller(self,workers=1):
         edges = []
-        h = self.holding_invest('person',3,0.5)
+        h = self.holding_invest('person',3,0.5,workers)
         for i in h.keys():
             for j in h[i]:
                 edges.append((i,j))
@@ -118,7 +203,8 @@ class financial_risk_control_model:
             n = [i]
             while True:
                 n = list(G.predecessors(n[0]))
-                if len(n) != 0:
+                #相互控股时沿控制链回到已经过的节点即停止
+                if len(n) != 0 and n[0] != i and n[0] not in con_i:
                     con_i.append(n[0])
                 else:
                     break
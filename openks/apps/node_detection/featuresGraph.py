@@ -17,195 +17,193 @@
 
 import numpy as np
 import pandas as pd
-
-
-def calculate_label_percent(data, n_class):
-    """calculate the percent of label"""
-    label_count = np.zeros(n_class + 1)
-    for index, value in zip(data.value_counts().index, data.value_counts().values):
-        label_count[index + 1] = value
-    label_percent = np.zeros(n_class + 1)
-    neighbors_num = np.sum(label_count)
-    if neighbors_num != 0:
-        label_percent = label_count / neighbors_num
-    return np.concatenate([label_count, label_percent])
+import scipy.sparse as sp
+from multiprocessing import Pool
+
+
+class GraphFeatures(object):
+    """
+    sparse graph feature engine, the edge table is converted once into arrays:
+    degrees are bincounts, neighbor aggregations are segment reductions over CSR neighbor lists
+    and neighbor label histograms are products of the sparse adjacency with a sparse one-hot label matrix
+    """
+
+    def __init__(self, edge_file, node_num, node_features=None):
+        """
+        :param edge_file: DataFrame with src_idx, dst_idx and edge_weight columns
+        :param node_num: number of nodes
+        :param node_features: optional [node_num, n_features] array aggregated by aggregate_node_features
+        """
+        self.node_num = node_num
+        self.src = edge_file['src_idx'].values.astype(np.int64)
+        self.dst = edge_file['dst_idx'].values.astype(np.int64)
+        self.edge_weight = np.nan_to_num(edge_file['edge_weight'].values.astype(np.float64), nan=0.0)
+        self.node_features = node_features
+        self.in_degree = np.bincount(self.dst, minlength=node_num)[:node_num].astype(np.float64)
+        self.out_degree = np.bincount(self.src, minlength=node_num)[:node_num].astype(np.float64)
+        self.is_directed = bool((self.in_degree != self.out_degree).any())
+        self._neighbors = {}
+
+    def neighbors(self, in_or_out):
+        """
+        CSR neighbor lists, for 'in' the sources of the in-edges of every node, for 'out' the destinations of its out-edges
+        :return: indptr, neighbors
+        """
+        if in_or_out not in self._neighbors:
+            node, neighbor = (self.dst, self.src) if in_or_out == 'in' else (self.src, self.dst)
+            keep = node < self.node_num
+            node, neighbor = node[keep], neighbor[keep]
+            indptr = np.append(0, np.cumsum(np.bincount(node, minlength=self.node_num))).astype(np.int64)
+            self._neighbors[in_or_out] = (indptr, neighbor[np.argsort(node)])
+        return self._neighbors[in_or_out]
+
+    def edge_weight_sum(self, in_or_out):
+        """sum of the weights of the in-edges or out-edges of every node"""
+        node = self.dst if in_or_out == 'in' else self.src
+        return np.bincount(node, weights=self.edge_weight, minlength=self.node_num)[:self.node_num]
+
+    def neighbor_sum(self, values, in_or_out):
+        """sum of values over the in-neighbors or out-neighbors of every node, neighbors without a value count as 0"""
+        indptr, neighbors = self.neighbors(in_or_out)
+        valid = neighbors < len(values)
+        node = np.repeat(np.arange(self.node_num), np.diff(indptr))
+        return np.bincount(node[valid], weights=values[neighbors[valid]], minlength=self.node_num)
+
+    def aggregate(self, features, in_or_out, max_elements=1 << 24):
+        """
+        sum, max, min and mean of the features of the in-neighbors or out-neighbors of every node,
+        0 for nodes without neighbors, and neighbors outside the feature table or with missing features count as 0
+        :param features: [node_num, n_features] array
+        :param max_elements: size of the neighbor feature block gathered at once
+        :return: [node_num, 4 * n_features], columns ordered as pandas agg(['sum', 'max', 'min', 'mean'])
+        """
+        features = np.asarray(features, dtype=np.float64).reshape(len(features), -1)
+        indptr, neighbors = self.neighbors(in_or_out)
+        counts = np.diff(indptr)
+        rows = np.flatnonzero(counts)
+        starts = indptr[rows]
+        # missing features are zeros, and neighbors outside the table point to an extra zero row
+        features = np.where(np.isnan(features), 0, features)
+        if len(neighbors) and neighbors.max() >= len(features):
+            neighbors = np.minimum(neighbors, len(features))
+            features = np.vstack((features, np.zeros((1, features.shape[1]))))
+        result = np.zeros((self.node_num, features.shape[1], 4))
+        step = max(1, max_elements // max(len(neighbors), 1))
+        for start in range(0, features.shape[1], step):
+            if not len(rows):
+                break
+            stop = min(start + step, features.shape[1])
+            values = features[neighbors, start:stop]
+            total = np.add.reduceat(values, starts, axis=0)
+            result[rows, start:stop] = np.stack((total, np.maximum.reduceat(values, starts, axis=0),
+                                                 np.minimum.reduceat(values, starts, axis=0),
+                                                 total / counts[rows, None]), axis=-1)
+        return result.reshape(self.node_num, -1)
+
+    def aggregate_node_features(self, in_or_out, start=0, stop=None):
+        """aggregate of the columns start:stop of node_features"""
+        return self.aggregate(self.node_features[:, start:stop], in_or_out)
+
+    def label_features(self, node_labels, in_or_out, n_class):
+        """
+        count and percent of every label among the in-neighbors or out-neighbors of every node,
+        label -1 (first column) stands for unlabeled neighbors
+        :param node_labels: label of every node, -1 if unknown
+        :return: [node_num, 2 * n_class + 2]
+        """
+        indptr, neighbors = self.neighbors(in_or_out)
+        label_num = max(len(node_labels), int(neighbors.max()) + 1 if len(neighbors) else 0)
+        labels = np.full(label_num, -1, dtype=np.int64)
+        labels[:len(node_labels)] = node_labels
+        adjacency = sp.csr_matrix((np.ones(len(neighbors)), neighbors, indptr), shape=(self.node_num, label_num))
+        one_hot = sp.csr_matrix((np.ones(label_num), (np.arange(label_num), labels + 1)), shape=(label_num, n_class + 1))
+        label_count = (adjacency @ one_hot).toarray()
+        neighbors_num = label_count.sum(axis=1, keepdims=True)
+        label_percent = np.divide(label_count, neighbors_num, out=np.zeros_like(label_count), where=neighbors_num != 0)
+        return np.hstack((label_count, label_percent))
+
+    def node_labels(self, train_label):
+        """label of every node from the train labels, -1 for the others"""
+        labels = np.full(self.node_num, -1, dtype=np.int64)
+        labels[train_label['node_index'].values] = train_label['label'].values
+        return labels
+
+    def first_order_features(self, train_label, n_class):
+        """see extract_1st_features"""
+        if not self.is_directed:
+            return self.in_degree.reshape(-1, 1)
+        node_labels = self.node_labels(train_label)
+        blocks = []
+        for in_or_out, degree in (('in', self.in_degree), ('out', self.out_degree)):
+            weight_sum = self.edge_weight_sum(in_or_out)
+            blocks += [degree.reshape(-1, 1), weight_sum.reshape(-1, 1),
+                       self.label_features(node_labels, in_or_out, n_class),
+                       self.aggregate(degree, in_or_out), self.aggregate(weight_sum, in_or_out)]
+        return np.hstack(blocks)
+
+    def second_order_features(self):
+        """see extract_2nd_features"""
+        in_degree_2nd = self.neighbor_sum(self.in_degree, 'in')
+        if self.is_directed:
+            out_degree_2nd = self.neighbor_sum(self.out_degree, 'out')
+            return np.hstack((in_degree_2nd.reshape(-1, 1), out_degree_2nd.reshape(-1, 1)))
+        return np.hstack((in_degree_2nd.reshape(-1, 1), self.aggregate(in_degree_2nd, 'in')))
+
+
+_shared_graph = None
+
+
+def _init_shared_graph(graph):
+    global _shared_graph
+    _shared_graph = graph
+
+
+def _shared_graph_task(task):
+    name, args = task
+    return getattr(_shared_graph, name)(*args)
+
+
+def run_feature_tasks(graph, tasks, workers=1):
+    """
+    run (method name, args) tasks of a GraphFeatures, in a process pool if workers > 1.
+    the graph is handed to the workers once through the pool initializer, with the fork start method
+    they inherit its arrays without any copy and only the task arguments and results are pickled
+    :return: results in the order of tasks
+    """
+    if workers <= 1:
+        return [getattr(graph, name)(*args) for name, args in tasks]
+    with Pool(min(workers, len(tasks)), initializer=_init_shared_graph, initargs=(graph,)) as pool:
+        return pool.map(_shared_graph_task, tasks, chunksize=1)
 
 
 def agg_features(edge_file, features, in_or_out):
     """get aggregator features"""
-    features_df = pd.DataFrame(features).reset_index().rename(columns={'index': 'node_index'})
-
-    if in_or_out == 'in':
-        df = pd.merge(features_df, edge_file, left_on='node_index', right_on='dst_idx', how='left')
-        df = df[['node_index', 'src_idx', 'dst_idx']]
-
-        df = pd.merge(df, features_df, left_on='src_idx', right_on='node_index', how='left')
-        df = df.fillna(0)
-        df = df.drop(columns=['src_idx', 'dst_idx', 'node_index_y'])
-        in_agg_features = df.groupby('node_index_x').agg(['sum', 'max', 'min', 'mean']).sort_index()
-        return in_agg_features.values
-
-    if in_or_out == 'out':
-        # out
-        df = pd.merge(features_df, edge_file, left_on='node_index', right_on='src_idx', how='left')
-        df = df[['node_index', 'src_idx', 'dst_idx']]
-        df = pd.merge(df, features_df, left_on='dst_idx', right_on='node_index', how='left')
-        df = df.fillna(0)
-        df = df.drop(columns=['src_idx', 'dst_idx', 'node_index_y'])
-        out_agg_features = df.groupby('node_index_x').agg(['sum', 'max', 'min', 'mean']).sort_index()
-
-        return out_agg_features.values
+    return GraphFeatures(edge_file, len(features)).aggregate(features, in_or_out)
 
 
 def is_directed_graph(edge_file, train_indices, test_indices):
     """whether it is a directed graph"""
-    node_num = len(train_indices) + len(test_indices)
+    return GraphFeatures(edge_file, len(train_indices) + len(test_indices)).is_directed
 
-    out_1st_degree_temp = edge_file.groupby('src_idx')['dst_idx'].agg(lambda x: len(x))
-    out_1st_degree = np.zeros(node_num)
-    for index in out_1st_degree_temp.index:
-        out_1st_degree[index] = out_1st_degree_temp[index]
 
-    in_1st_degree_temp = edge_file.groupby('dst_idx')['src_idx'].agg(lambda x: len(x))
-    in_1st_degree = np.zeros(node_num)
-    for index in in_1st_degree_temp.index:
-        in_1st_degree[index] = in_1st_degree_temp[index]
-
-    for i in range(len(in_1st_degree)):
-        if in_1st_degree[i] != out_1st_degree[i]:
-            return True
-    return False
-
-
-def origin_feature_agg(edge_file, train_indices, test_indices, fea_table):
+def origin_feature_agg(edge_file, train_indices, test_indices, fea_table, graph=None):
     """get aggregator feature table"""
-    directed_flag = is_directed_graph(edge_file, train_indices, test_indices)
-    if directed_flag:
-        agg_fea_table_in = agg_features(edge_file, fea_table.values, 'in')
-        agg_fea_table_out = agg_features(edge_file, fea_table.values, 'out')
-        agg_fea_table = np.hstack((agg_fea_table_in, agg_fea_table_out))
-    else:
-        agg_fea_table_in = agg_features(edge_file, fea_table.values, 'in')
-        agg_fea_table = agg_fea_table_in
+    if graph is None:
+        graph = GraphFeatures(edge_file, len(train_indices) + len(test_indices))
+    if graph.is_directed:
+        return np.hstack((graph.aggregate(fea_table.values, 'in'), graph.aggregate(fea_table.values, 'out')))
+    return graph.aggregate(fea_table.values, 'in')
 
-    return agg_fea_table
 
-
-def extract_1st_features(edge_file, train_indices, test_indices, train_label, n_class):
+def extract_1st_features(edge_file, train_indices, test_indices, train_label, n_class, graph=None):
     """get the first order features"""
-    node_num = len(train_indices) + len(test_indices)
-
-    out_1st_degree_temp = edge_file.groupby('src_idx')['dst_idx'].agg(lambda x: len(x))
-    out_1st_degree = np.zeros(node_num)
-    for index in out_1st_degree_temp.index:
-        out_1st_degree[index] = out_1st_degree_temp[index]
-
-    in_1st_degree_temp = edge_file.groupby('dst_idx')['src_idx'].agg(lambda x: len(x))
-    in_1st_degree = np.zeros(node_num)
-    for index in in_1st_degree_temp.index:
-        in_1st_degree[index] = in_1st_degree_temp[index]
-
-    is_directed = False
-    for i in range(len(in_1st_degree)):
-        if in_1st_degree[i] != out_1st_degree[i]:
-            is_directed = True
-            break
-
-    in_1st_edge_weight_sum_temp = edge_file.groupby('dst_idx')['edge_weight'].agg(np.sum)
-    in_1st_edge_weight_sum = np.zeros(node_num)
-    for index in in_1st_edge_weight_sum_temp.index:
-        in_1st_edge_weight_sum[index] = in_1st_edge_weight_sum_temp[index]
-
-    # Proportion of labels of first-order neighbors
-    df = pd.merge(edge_file, train_label, left_on='src_idx', right_on='node_index', how='left')
-    df.rename(columns={'label': 'src_label'}, inplace=True)
-    df = pd.merge(df, train_label, left_on='dst_idx', right_on='node_index', how='left')
-    df.rename(columns={'label': 'dst_label'}, inplace=True)
-    df.fillna(-1, inplace=True)
-    df = df.astype(int)
-
-    in_1st_neighbor_label_features_temp = df.groupby('dst_idx')['src_label'].apply(calculate_label_percent, n_class)
-    in_1st_neighbor_label_features = pd.Series([np.zeros(2 * n_class + 2)] * node_num)
-    for index in in_1st_neighbor_label_features_temp.index:
-        in_1st_neighbor_label_features[index] = in_1st_neighbor_label_features_temp[index]
-    in_1st_neighbor_label_features = np.concatenate(in_1st_neighbor_label_features.values).reshape(-1,
-                                                                                                   2 * n_class + 2)
-
-    # add aggregator features
-    agg_in_1st_degree = agg_features(edge_file, in_1st_degree.reshape(-1, 1), 'in')
-    agg_in_1st_edge_weight_sum = agg_features(edge_file, in_1st_edge_weight_sum.reshape(-1, 1), 'in')
-
-    if is_directed:
-        out_1st_edge_weight_sum_temp = edge_file.groupby('src_idx')['edge_weight'].agg(np.sum)
-        out_1st_edge_weight_sum = np.zeros(node_num)
-        for index in out_1st_edge_weight_sum_temp.index:
-            out_1st_edge_weight_sum[index] = out_1st_edge_weight_sum_temp[index]
-
-        out_1st_neighbor_label_features_temp = df.groupby('src_idx')['dst_label'].apply(calculate_label_percent,
-                                                                                        n_class)
-        out_1st_neighbor_label_features = pd.Series([np.zeros(2 * n_class + 2)] * node_num)
-        for index in out_1st_neighbor_label_features_temp.index:
-            out_1st_neighbor_label_features[index] = out_1st_neighbor_label_features_temp[index]
-
-        out_1st_neighbor_label_features = np.concatenate(out_1st_neighbor_label_features.values).reshape(-1,
-                                                                                                         2 * n_class + 2)
-
-        agg_out_1st_degree = agg_features(edge_file, out_1st_degree.reshape(-1, 1), 'out')
-        agg_out_1st_edge_weight_sum = agg_features(edge_file, out_1st_edge_weight_sum.reshape(-1, 1), 'out')
-
-        return np.hstack((in_1st_degree.reshape(-1, 1), in_1st_edge_weight_sum.reshape(-1, 1),
-                          in_1st_neighbor_label_features, agg_in_1st_degree, agg_in_1st_edge_weight_sum,
-                          out_1st_degree.reshape(-1, 1), out_1st_edge_weight_sum.reshape(-1, 1),
-                          out_1st_neighbor_label_features, agg_out_1st_degree, agg_out_1st_edge_weight_sum))
-        # return  np.hstack((in_1st_degree.reshape(-1, 1),out_1st_degree.reshape(-1, 1)))
-
-    # return np.hstack((in_1st_degree.reshape(-1, 1), in_1st_edge_weight_sum.reshape(-1, 1),
-    #                 in_1st_neighbor_label_features, agg_in_1st_degree, agg_in_1st_edge_weight_sum))
-    return in_1st_degree.reshape(-1, 1)
-
-
-def extract_2nd_features(edge_file, train_indices, test_indices):
+    if graph is None:
+        graph = GraphFeatures(edge_file, len(train_indices) + len(test_indices))
+    return graph.first_order_features(train_label, n_class)
+
+
+def extract_2nd_features(edge_file, train_indices, test_indices, graph=None):
     """get the second order features"""
-    node_num = len(train_indices) + len(test_indices)
-    out_1st_degree_temp = edge_file.groupby('src_idx')['dst_idx'].agg(lambda x: len(x))
-    out_1st_degree = pd.Series(np.zeros(node_num))
-    for index in out_1st_degree_temp.index:
-        out_1st_degree[index] = out_1st_degree_temp[index]
-    in_1st_degree_temp = edge_file.groupby('dst_idx')['src_idx'].agg(lambda x: len(x))
-    in_1st_degree = pd.Series(np.zeros(node_num))
-    for index in in_1st_degree_temp.index:
-        in_1st_degree[index] = in_1st_degree_temp[index]
-
-    is_directed = False
-    for i in range(len(in_1st_degree)):
-        if in_1st_degree[i] != out_1st_degree[i]:
-            is_directed = True
-            break
-
-    in_1st_degree_df = in_1st_degree.to_frame(name='in_degree').reset_index().rename(columns={'index': 'node_index'})
-    df = pd.merge(edge_file, in_1st_degree_df, left_on='src_idx', right_on='node_index', how='left')
-    in_degree_2nd_temp = df.groupby('dst_idx')['in_degree'].agg(np.sum)
-    in_degree_2nd = np.zeros(node_num)
-    for index in in_degree_2nd_temp.index:
-        in_degree_2nd[index] = in_degree_2nd_temp[index]
-
-    # add aggregator features
-    agg_in_2nd_degree = agg_features(edge_file, in_degree_2nd.reshape(-1, 1), 'in')
-
-    if is_directed:
-        out_1st_degree_df = out_1st_degree.to_frame(name='out_degree').reset_index().rename(
-            columns={'index': 'node_index'})
-        df = pd.merge(edge_file, out_1st_degree_df, left_on='dst_idx', right_on='node_index', how='left')
-        out_degree_2nd_temp = df.groupby('src_idx')['out_degree'].agg(np.sum)
-        out_degree_2nd = np.zeros(node_num)
-
-        for index in out_degree_2nd_temp.index:
-            out_degree_2nd[index] = out_degree_2nd_temp[index]
-
-        agg_out_2nd_degree = agg_features(edge_file, out_degree_2nd.reshape(-1, 1), 'out')
-
-        return np.hstack((in_degree_2nd.reshape(-1, 1), out_degree_2nd.reshape(-1, 1)))
-        # return np.hstack(
-        #     (in_degree_2nd.reshape(-1, 1), agg_in_2nd_degree, out_degree_2nd.reshape(-1, 1), agg_out_2nd_degree))
-    return np.hstack((in_degree_2nd.reshape(-1, 1), agg_in_2nd_degree))
-    # return in_degree_2nd.reshape(-1, 1)
+    if graph is None:
+        graph = GraphFeatures(edge_file, len(train_indices) + len(test_indices))
+    return graph.second_order_features()
@@ -22,8 +22,6 @@ import numpy as np
 import pandas as pd
 import torch
 import torch.nn.functional as F
-import multiprocessing
-from multiprocessing import Pool
 from sklearn.ensemble import RandomForestClassifier
 from .featuresGraph import *
 from torch_geometric.data import Data
@@ -54,6 +52,7 @@ class AbnormalNodeDetect(object):
         self.targetAccuracy = self.config["targetAccuracy"]
         self.TrainTimes = self.config["TrainTimes"]
         self.is_train = self.config['is_train']
+        self.feature_workers = self.config.get('feature_workers', 1)
 
     def set_seed(self):
         """
@@ -83,31 +82,18 @@ class AbnormalNodeDetect(object):
         edge_file = data['edge_file']
         train_label = data['train_label']
         test_label = data['test_label']
-        p = Pool(multiprocessing.cpu_count() - 1)
-        res = []
-        res.append(
-            p.apply_async(extract_1st_features,
-                          args=(edge_file, train_indices, test_indices, train_label, n_class,)))
-        res.append(p.apply_async(extract_2nd_features,
-                                 args=(edge_file, train_indices, test_indices,)))
-        res.append(p.apply_async(origin_feature_agg,
-                                 args=(edge_file, train_indices, test_indices, fea_table,)))
-        p.close()
-        p.join()
-        res1 = []
-        for r in res:
-            res1.append(r.get())
-        X = np.hstack(res1)
-        train_feature = []
-        test_featuer = []
-        for i in train_indices:
-            train_feature.append(X[i])
-        for j in test_indices:
-            test_featuer.append(X[j])
-        train = pd.DataFrame(train_feature)
-        test = pd.DataFrame(test_featuer)
-        tr_label = train_label.drop("node_index", 1)
-        te_label = test_label.drop("node_index", 1)
+        graph = GraphFeatures(edge_file, len(train_indices) + len(test_indices), fea_table.values)
+        tasks = [('first_order_features', (train_label, n_class)), ('second_order_features', ())]
+        # the original feature columns are aggregated by blocks, so that they spread over the workers
+        step = max(1, fea_table.shape[1] // max(self.feature_workers, 1))
+        for in_or_out in (['in', 'out'] if graph.is_directed else ['in']):
+            for start in range(0, fea_table.shape[1], step):
+                tasks.append(('aggregate_node_features', (in_or_out, start, start + step)))
+        X = np.hstack(run_feature_tasks(graph, tasks, self.feature_workers))
+        train = pd.DataFrame(X[train_indices])
+        test = pd.DataFrame(X[test_indices])
+        tr_label = train_label.drop(columns="node_index")
+        te_label = test_label.drop(columns="node_index")
         return train, test, tr_label, te_label
 
     def RFClassifierTrain(self, train, train_label, test, test_label,
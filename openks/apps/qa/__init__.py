@@ -6,4 +6,5 @@ init
 """
 from .question_parser import *
 from .rule_parser import *
-from .answer_fetcher import *
\ No newline at end of file
+from .answer_fetcher import *
+from .gazetteer import *
\ No newline at end of file
@@ -5,10 +5,12 @@
 Answer fetch progam to receive structured question and get possible answers
 """
 import logging
+import numpy as np
 from sklearn.metrics.pairwise import euclidean_distances
 from typing import TypeVar
 from .question_parser import StrucQ
 from ...abstract.mtg import MTG
+from ...abstract.graph_index import get_graph_index
 
 logger = logging.getLogger(__name__)
 T = TypeVar('T')
@@ -58,18 +60,12 @@ class AnswerFetcher(object):
 					source_rel_col_index = 2
 					target_rel_col_index = 0
 
-		target_ids = []
-		for rel in graph.triples:
-			if rel[0][1] == relation_type:
-				if rel[0][source_rel_col_index] == entity_id:
-					target_ids.append(rel[0][target_rel_col_index])
-
-		target_items = []
-		for ent in graph.entities:
-			if ent[1] == target_type:
-				for tar_id in target_ids:
-					if ent[0] == tar_id:
-						target_items.append(ent)
+		# adjacency and entity lookups go through the index built once per graph
+		index = get_graph_index(graph)
+		direction = 'out' if source_rel_col_index == 0 else 'in'
+		target_ids = index.neighbors(entity_id, relation_type, direction)
+		target_rows = np.sort(index.entity_rows(target_ids, target_type))
+		target_items = [graph.entities[int(row)] for row in target_rows]
 		target_props = [item['properties'] for item in graph.schema if item['type'] == 'entity' and item['concept'] == target_type]
 		target_cols = [item['name'] for item in target_props[0]]
 		res = []
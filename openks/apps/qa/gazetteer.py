@@ -0,0 +1,126 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Entity name gazetteer shared by question parsers, backed by an Aho-Corasick automaton
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import weakref
+from typing import Callable, Dict, Iterable, List, Tuple
+import ahocorasick
+
+logger = logging.getLogger(__name__)
+
+
+class Gazetteer(object):
+	"""
+	Dictionary matcher over entity names and aliases.
+	Every name keeps the list of payloads (e.g. entity ids or types) added for it in insertion order.
+	The built automaton is picklable, so a gazetteer can be cached on disk with save/load or build_cached.
+	"""
+	def __init__(self, entries: Iterable[Tuple[str, object]] = ()) -> None:
+		self._payloads = {}
+		self.automaton = None
+		for name, payload in entries:
+			self.add(name, payload)
+
+	def add(self, name: str, payload) -> None:
+		if name in self._payloads:
+			if payload not in self._payloads[name]:
+				self._payloads[name].append(payload)
+		else:
+			self._payloads[name] = [payload]
+
+	def build(self) -> 'Gazetteer':
+		self.automaton = ahocorasick.Automaton()
+		for name, payloads in self._payloads.items():
+			self.automaton.add_word(name, (name, payloads))
+		self.automaton.make_automaton()
+		return self
+
+	def payloads(self, name: str) -> List:
+		return self._payloads.get(name, [])
+
+	def __len__(self) -> int:
+		return len(self._payloads)
+
+	def __contains__(self, name: str) -> bool:
+		return name in self._payloads
+
+	def find_all(self, text: str) -> List[Tuple[int, int, str, List]]:
+		""" every (start, end, name, payloads) occurrence in text, overlapping ones included """
+		if self.automaton is None:
+			self.build()
+		if not len(self._payloads):
+			return []
+		return [(end - len(name) + 1, end + 1, name, payloads) for end, (name, payloads) in self.automaton.iter(text)]
+
+	def longest_matches(self, text: str) -> List[Tuple[int, int, str, List]]:
+		"""
+		non-overlapping occurrences in text order, longer names win over the names they overlap with,
+		and among names of the same length the leftmost wins
+		"""
+		matches = sorted(self.find_all(text), key=lambda item: (item[0] - item[1], item[0]))
+		taken = [False] * len(text)
+		result = []
+		for start, end, name, payloads in matches:
+			if not any(taken[start:end]):
+				taken[start:end] = [True] * (end - start)
+				result.append((start, end, name, payloads))
+		result.sort(key=lambda item: item[0])
+		return result
+
+	def fingerprint(self) -> str:
+		""" digest of all names and payloads, used as the cache key """
+		digest = hashlib.sha1()
+		for name, payloads in self._payloads.items():
+			digest.update(repr((name, payloads)).encode('utf-8'))
+		return digest.hexdigest()
+
+	def save(self, path: str) -> None:
+		if self.automaton is None:
+			self.build()
+		with open(path, 'wb') as f:
+			pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+	@staticmethod
+	def load(path: str) -> 'Gazetteer':
+		with open(path, 'rb') as f:
+			return pickle.load(f)
+
+	@classmethod
+	def build_cached(cls, entries: Iterable[Tuple[str, object]], cache_dir: str = None, name: str = 'gazetteer') -> 'Gazetteer':
+		"""
+		collect the entries and reuse a previously built automaton from cache_dir when the entries did not change,
+		collecting is linear while building the automaton is the expensive part
+		"""
+		gazetteer = cls(entries)
+		if not cache_dir:
+			return gazetteer.build()
+		path = os.path.join(cache_dir, '{}-{}.pkl'.format(name, gazetteer.fingerprint()))
+		if os.path.exists(path):
+			try:
+				return cls.load(path)
+			except Exception as e:
+				logger.warn("Failed to load gazetteer cache {}: {}".format(path, e))
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+		gazetteer.build().save(path)
+		return gazetteer
+
+
+_graph_gazetteers = weakref.WeakKeyDictionary()
+_graph_lock = threading.Lock()
+
+
+def graph_gazetteer(graph, kind: str, builder: Callable[[], Gazetteer]) -> Gazetteer:
+	""" one gazetteer per (graph, kind), built on first use, so several parsers over one graph share it """
+	with _graph_lock:
+		cache = _graph_gazetteers.setdefault(graph, {})
+		if kind not in cache:
+			cache[kind] = builder()
+		return cache[kind]
@@ -8,38 +8,49 @@ import os
 import ast
 import re
 import copy
-import ahocorasick
 from .question_parser import QuestionParser, StrucQ
 from ...abstract.mtg import MTG
+from ...abstract.graph_index import get_graph_index
+from .gazetteer import Gazetteer, graph_gazetteer
 
 class RuleParserCom(QuestionParser):
 	"""
 	Rules for the domain of investor-company-patent dataset
 	"""
-	def __init__(self, graph: MTG) -> None:
+	def __init__(self, graph: MTG, gazetteer_cache: str = None) -> None:
 		super(RuleParserCom, self).__init__(graph)
 		self.question_type = {'entity': ['哪些', '哪家', '哪个', '哪几个', '谁'], 'quantity': ['多少', '几个', '几家']}
 		self.question_target = {'company': ['公司', '企业'], 'patent': ['专利', '知识产权'], 'investor': ['投资人', '投资机构']}
 		self.question_target_single = {'company': ['谁被.*投资', '谁申请了'], 'investor': ['谁投资了']}
 		self.question_rel = {'invests': ['投资了', '被.*投资', '.*的投资人', '.*的投资机构'], 'applies': ['申请了.*[专利|知识产权]', '拥有.*[专利|知识产权]', '.*的[专利|知识产权]']}
 		self.stop_words = ['信息', '信息技术', '智能']
+		# company names and aliases are compiled once per graph, gazetteer_cache keeps the automaton on disk
+		self.gazetteer = graph_gazetteer(
+			graph, 'company',
+			lambda: Gazetteer.build_cached(self.company_names(), gazetteer_cache, 'company')
+		)
 
-	def entity_extract(self) -> None:
-		entities = []
+	def company_names(self):
 		entity_type = 'company'
 		props = [item['properties'] for item in self.graph.schema if item['concept'] == entity_type][0]
 		index_alter_names = props.index({"name": "alter_names","range": "list"})
 		index_name = props.index({"name": "name","range": "str"})
 		index_id = 0
-		for item in self.graph.entities:
-			if item[1] == entity_type:
-				tmp = ast.literal_eval(item[2][index_alter_names])
-				tmp.append(item[2][index_name])
-				for name in tmp:
-					if len(name) >= 2 and name not in self.stop_words and self.struc_q.text.find(name) != -1:
-						entities.append({'id': item[index_id], 'name': name, 'type': entity_type})
-						self.struc_q.entities = entities
-						return None
+		for item in get_graph_index(self.graph).entities_of_type(entity_type):
+			tmp = ast.literal_eval(item[2][index_alter_names])
+			tmp.append(item[2][index_name])
+			for name in tmp:
+				if len(name) >= 2 and name not in self.stop_words:
+					yield name, item[index_id]
+
+	def entity_extract(self) -> None:
+		entity_type = 'company'
+		matches = self.gazetteer.longest_matches(self.struc_q.text)
+		if matches:
+			# single entity for now: the leftmost of the longest names, the first company holding that name
+			start, end, name, ids = matches[0]
+			self.struc_q.entities = [{'id': ids[0], 'name': name, 'type': entity_type}]
+		return None
 
 	def relation_extract(self) -> None:
 		relations = []
@@ -97,18 +108,20 @@ class RuleParserMedical(QuestionParser):
 	"""
 	copied and modified from https://github.com/liuhuanyong/QASystemOnMedicalKG
 	"""
-	def __init__(self, graph: MTG):
+	# entity type in graph and its word type in questions, in the order word types are listed for a word
+	word_types = [
+		('diseases', 'disease'),
+		('departments', 'department'),
+		('checks', 'check'),
+		('drugs', 'drug'),
+		('foods', 'food'),
+		('symptoms', 'symptom'),
+		('producers', 'producer')
+	]
+
+	def __init__(self, graph: MTG, gazetteer_cache: str = None):
 		super(RuleParserMedical, self).__init__(graph)
 		print('initializing model......')
-		# 加载特征词
-		self.disease_wds = [item[2][0] for item in self.graph.entities if item[1] == 'diseases']
-		self.department_wds= [item[2][0] for item in self.graph.entities if item[1] == 'departments']
-		self.check_wds= [item[2][0] for item in self.graph.entities if item[1] == 'checks']
-		self.drug_wds= [item[2][0] for item in self.graph.entities if item[1] == 'drugs']
-		self.food_wds= [item[2][0] for item in self.graph.entities if item[1] == 'foods']
-		self.producer_wds= [item[2][0] for item in self.graph.entities if item[1] == 'producers']
-		self.symptom_wds= [item[2][0] for item in self.graph.entities if item[1] == 'symptoms']
-		self.region_words = set(self.department_wds + self.disease_wds + self.check_wds + self.drug_wds + self.food_wds + self.producer_wds + self.symptom_wds)
 		self.deny_words = ['否', '非', '不', '无', '弗', '勿', '毋', '未', '没', '莫', '没有', '防止', '不再', '不会', '不能', '忌', '禁止', '防止', '难以', '忘记', '忽视', '放弃', '拒绝', '杜绝', '不是', '并未', '并无', '仍未', '难以出现', '切勿', '不要', '不可', '别', '管住', '注意', '小心', '少']
 		# 问句疑问词
 		self.symptom_qwds = ['症状', '表征', '现象', '症候', '表现']
@@ -124,43 +137,24 @@ class RuleParserMedical(QuestionParser):
 		self.check_qwds = ['检查', '检查项目', '查出', '检查', '测出', '试出']
 		self.belong_qwds = ['属于什么科', '属于', '什么科', '科室']
 		self.cure_qwds = ['治疗什么', '治啥', '治疗啥', '医治啥', '治愈啥', '主治啥', '主治什么', '有什么用', '有何用', '用处', '用途','有什么好处', '有什么益处', '有何益处', '用来', '用来做啥', '用来作甚', '需要', '要']
-		# 构造领域actree
-		self.actree = ahocorasick.Automaton()
-		for index, word in enumerate(list(self.region_words)):
-			self.actree.add_word(word, (index, word))
-		self.actree.make_automaton()
-		# 构建词典
-		self.wd_dict = dict()
-		for wd in self.region_words:
-			self.wd_dict[wd] = []
-			if wd in self.disease_wds:
-				self.wd_dict[wd].append('disease')
-			if wd in self.department_wds:
-				self.wd_dict[wd].append('department')
-			if wd in self.check_wds:
-				self.wd_dict[wd].append('check')
-			if wd in self.drug_wds:
-				self.wd_dict[wd].append('drug')
-			if wd in self.food_wds:
-				self.wd_dict[wd].append('food')
-			if wd in self.symptom_wds:
-				self.wd_dict[wd].append('symptom')
-			if wd in self.producer_wds:
-				self.wd_dict[wd].append('producer')
+		# 构造领域词典，每个词对应其全部词类型，同一图谱只构建一次
+		self.gazetteer = graph_gazetteer(
+			graph, 'medical',
+			lambda: Gazetteer.build_cached(self.region_words(), gazetteer_cache, 'medical')
+		)
 		print('model init finished ......')
 
+	def region_words(self):
+		index = get_graph_index(self.graph)
+		for entity_type, word_type in self.word_types:
+			for item in index.entities_of_type(entity_type):
+				yield item[2][0], word_type
+
 	def entity_extract(self):
-		region_wds = []
-		for i in self.actree.iter(self.struc_q.text):
-			wd = i[1][1]
-			region_wds.append(wd)
-		stop_wds = []
-		for wd1 in region_wds:
-			for wd2 in region_wds:
-				if wd1 in wd2 and wd1 != wd2:
-					stop_wds.append(wd1)
-		final_wds = [i for i in region_wds if i not in stop_wds]
-		final_dict = {i: self.wd_dict.get(i) for i in final_wds}
+		# 最长匹配，被更长的词覆盖的短词不再单独作为实体
+		final_dict = {}
+		for start, end, wd, types in self.gazetteer.longest_matches(self.struc_q.text):
+			final_dict[wd] = types
 		self.struc_q.entities = final_dict
 		return None
 
@@ -0,0 +1,57 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Import time benchmark, every import is measured in a fresh interpreter so nothing is cached between runs
+
+python -m openks.common.import_benchmark --module openks.models --max-seconds 2
+exits with a non-zero status when the median import time exceeds --max-seconds, so it can guard against regressions in CI
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import List
+
+_SCRIPT = 'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+
+
+def measure_import(module: str, repeat: int = 5) -> List[float]:
+	""" seconds taken by `import module` in each of repeat fresh interpreters """
+	times = []
+	for _ in range(repeat):
+		output = subprocess.run(
+			[sys.executable, '-c', _SCRIPT.format(module=module)],
+			stdout=subprocess.PIPE, check=True, universal_newlines=True
+		).stdout
+		times.append(float(output.strip().splitlines()[-1]))
+	return times
+
+
+def loaded_frameworks(module: str) -> List[str]:
+	""" heavy framework modules present in sys.modules after `import module` """
+	script = 'import sys; import {}; print(" ".join(sorted(sys.modules)))'.format(module)
+	output = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+	loaded = set(output.split())
+	return [name for name in ('torch', 'paddle', 'tensorflow', 'sklearn', 'transformers') if name in loaded]
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description='Measure the import time of a module in fresh interpreters.')
+	parser.add_argument('--module', default='openks.models')
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--max-seconds', type=float, default=None, help='fail when the median import time is larger')
+	args = parser.parse_args()
+
+	times = measure_import(args.module, args.repeat)
+	median = statistics.median(times)
+	print('import {}: median {:.3f}s, min {:.3f}s, max {:.3f}s over {} runs'.format(args.module, median, min(times), max(times), len(times)))
+	print('frameworks loaded: {}'.format(', '.join(loaded_frameworks(args.module)) or 'none'))
+	if args.max_seconds is not None and median > args.max_seconds:
+		print('import time {:.3f}s exceeds the limit of {:.3f}s'.format(median, args.max_seconds))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -5,11 +5,31 @@
 Any base class inherits this Register class gives its subclasses ability to be registered in a named registry with decoration
 """
 from collections import defaultdict
+import ast
+import importlib
+import importlib.util
 import logging
-from typing import Dict, List
+import os
+from typing import Callable, Dict, List
 
 logger = logging.getLogger(__name__)
 
+
+class LazyModule(object):
+	"""
+	Placeholder kept in the registry for a module that is only imported when it is first requested by get_module
+	"""
+	def __init__(self, module_path: str, attr: str) -> None:
+		self.module_path = module_path
+		self.attr = attr
+
+	@property
+	def __name__(self):
+		return '{}.{}'.format(self.module_path, self.attr)
+
+	def resolve(self) -> object:
+		return getattr(importlib.import_module(self.module_path), self.attr)
+
 class Register(object):
 	"""
 	usage: 
@@ -23,6 +43,10 @@ class Register(object):
 	Advantages of using registered way is:
 	1. For developers, make a standard format for developers to integrate new models or algorithms into the toolkit
 	2. For users, provide a simple way to easily access models and configure parameters for model training 
+
+	Modules can also be registered lazily with their module path, so that heavy frameworks are only imported
+	when one of their modules is requested:
+	BasicClass.register_lazy("sub-class", "platform", "package.module", "SubClass")
 	"""
 
 	_registry: Dict = defaultdict(dict)
@@ -30,8 +54,10 @@ class Register(object):
 	@classmethod
 	def register(cls: 'Register', name: str, platform: str):
 		def register_module(module: object):
-			if platform in cls._registry and name in cls._registry[platform]:
-				logger.error("Name conflicts. {} has already been registered as {}.".format(registry[platform][name].__name__, name))
+			registered = cls._registry[platform].get(name) if platform in cls._registry else None
+			# a lazy placeholder is replaced by the real module once the file it points to is imported
+			if registered is not None and not (isinstance(registered, LazyModule) and registered.module_path == module.__module__):
+				logger.error("Name conflicts. {} has already been registered as {}.".format(registered.__name__, name))
 				raise Exception
 			else:
 				if platform not in cls._registry:
@@ -42,11 +68,26 @@ class Register(object):
 				return module
 		return register_module
 
+	@classmethod
+	def register_lazy(cls: 'Register', name: str, platform: str, module_path: str, attr: str) -> None:
+		if name not in cls._registry[platform]:
+			cls._registry[platform][name] = LazyModule(module_path, attr)
+
 	@classmethod
 	def get_module(cls: 'Register', platform: str, name: str) -> object:
 		if platform in cls._registry:
 			if name in cls._registry[platform]:
-				return cls._registry[platform][name]
+				module = cls._registry[platform][name]
+				if isinstance(module, LazyModule):
+					try:
+						resolved = module.resolve()
+					except ImportError as e:
+						logger.error("Module {} registered as {} in platform {} cannot be imported: {}".format(module.__name__, name, platform, e))
+						raise
+					if isinstance(cls._registry[platform][name], LazyModule):
+						cls._registry[platform][name] = resolved
+					module = cls._registry[platform][name]
+				return module
 		else:
 			logger.error("Module not found. {} is not a registered name in platform {}.".format(name, platform))
 
@@ -58,3 +99,114 @@ class Register(object):
 			print("模型名称：" + str(list(cls._registry[plat].keys())))
 		print("-----------------------------------------------")
 
+
+def _star_exports(path: str, seen: set) -> tuple:
+	"""
+	Names a module file defines at top level, found by parsing it without importing it.
+	Relative star imports are followed into the files they point to. Returns (names, complete),
+	complete is False if the module may define names the parse cannot see, e.g. through a star
+	import from another package or a module level __getattr__.
+	"""
+	if path in seen:
+		return set(), True
+	seen.add(path)
+	try:
+		with open(path, 'rb') as f:
+			tree = ast.parse(f.read(), path)
+	except (OSError, SyntaxError, ValueError):
+		return set(), False
+	names, all_names, complete = set(), None, True
+	statements = list(tree.body)
+	while statements:
+		node = statements.pop()
+		if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+			names.add(node.name)
+		elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+			targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+			for target in targets:
+				for item in ast.walk(target):
+					if isinstance(item, ast.Name):
+						names.add(item.id)
+			if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '__all__' for t in node.targets):
+				try:
+					all_names = set(ast.literal_eval(node.value))
+				except ValueError:
+					complete = False
+		elif isinstance(node, ast.Import):
+			names.update(alias.asname or alias.name.split('.')[0] for alias in node.names)
+		elif isinstance(node, ast.ImportFrom):
+			if node.names[0].name != '*':
+				names.update(alias.asname or alias.name for alias in node.names)
+			elif node.level == 0:
+				complete = False
+			else:
+				directory = os.path.dirname(path)
+				for _ in range(node.level - 1):
+					directory = os.path.dirname(directory)
+				target = os.path.join(directory, *(node.module or '').split('.'))
+				for candidate in (target + '.py', os.path.join(target, '__init__.py')):
+					if os.path.isfile(candidate):
+						star_names, star_complete = _star_exports(candidate, seen)
+						names.update(name for name in star_names if not name.startswith('_'))
+						complete = complete and star_complete
+						break
+				else:
+					complete = False
+		else:
+			# names bound in if/try blocks at top level
+			for field in ('body', 'orelse', 'finalbody', 'handlers'):
+				statements.extend(getattr(node, field, None) or [])
+	if '__getattr__' in names:
+		complete = False
+	if all_names is not None:
+		names = all_names
+	return names, complete
+
+
+def lazy_exports(package: str, submodules: List[str]) -> Callable:
+	"""
+	Module level __getattr__ for a package which used to star-import its submodules:
+	a missing attribute is looked up in the submodules, importing them on demand.
+	The submodules are parsed once into a map from name to the submodules defining it, so only those are
+	imported, the last first as with star imports the last definition wins. Submodules the parse cannot
+	fully see through are searched after them.
+	Submodules whose dependencies are not installed, or which fail to import, are skipped.
+	"""
+	index = {}
+	opaque = []
+
+	def build_index() -> None:
+		package_dir = os.path.dirname(importlib.import_module(package).__file__)
+		names_index, opaque_submodules = {}, []
+		for submodule in submodules:
+			target = os.path.join(package_dir, *submodule.lstrip('.').split('.'))
+			path = target + '.py' if os.path.isfile(target + '.py') else os.path.join(target, '__init__.py')
+			names, complete = _star_exports(path, set())
+			for name in names:
+				names_index.setdefault(name, []).insert(0, submodule)
+			if not complete:
+				opaque_submodules.insert(0, submodule)
+		opaque.extend(opaque_submodules)
+		index.update(names_index)
+
+	def __getattr__(name: str) -> object:
+		# private names are not star-exported, and submodules are left to the import system
+		if name.startswith('_') or importlib.util.find_spec('{}.{}'.format(package, name)) is not None:
+			raise AttributeError("module {} has no attribute {}".format(package, name))
+		if not index and not opaque:
+			build_index()
+		package_module = importlib.import_module(package)
+		candidates = index.get(name, [])
+		for submodule in candidates + [item for item in opaque if item not in candidates]:
+			try:
+				module = importlib.import_module(submodule, package)
+			except Exception as e:
+				# missing dependencies, files which do not compile and registry conflicts alike
+				logger.debug("Skipped {}{} while looking up {}: {}".format(package, submodule, name, e))
+				continue
+			if hasattr(module, name):
+				value = getattr(module, name)
+				setattr(package_module, name, value)
+				return value
+		raise AttributeError("module {} has no attribute {}".format(package, name))
+	return __getattr__
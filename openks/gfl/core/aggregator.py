@@ -18,11 +18,13 @@ import torch
 import time
 import requests
 import logging
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from gfl.core.strategy import WorkModeStrategy
 from gfl.core.job_manager import JobManager
-from gfl.utils.utils import LoggerFactory
-from gfl.entity.runtime_config import WAITING_BROADCAST_AGGREGATED_JOB_ID_LIST, CONNECTED_TRAINER_LIST
+from gfl.utils.utils import LoggerFactory, ModelUtils
+from gfl.utils.compression import ParameterCodec
+from gfl.entity.runtime_config import CONNECTED_TRAINER_LIST
 
 LOCAL_AGGREGATE_FILE = os.path.join("tmp_aggregate_pars", "avg_pars")
 
@@ -78,74 +80,237 @@ class Aggregator(object):
         return last_num
 
 
+class RunningAverage(object):
+    """
+    RunningAverage folds model parameters into a weighted average one state_dict at a time,
+    only the running sum is held whatever the number of contributors
+
+    """
+
+    def __init__(self):
+        self.sum = None
+        self.integer_keys = set()
+        self.total_weight = 0
+        self.contributors = set()
+
+    def add(self, contributor, model_pars, weight=1):
+        """
+        Fold model_pars into the running sum, model_pars is consumed and may be modified in place
+        :param contributor:
+        :param model_pars:
+        :param weight:
+        :return: False if the parameters of contributor were already folded
+        """
+        if contributor in self.contributors:
+            return False
+        if self.sum is None:
+            self.sum = {}
+            for key, par in model_pars.items():
+                if not par.is_floating_point():
+                    # integer buffers (e.g. num_batches_tracked) are averaged as floats
+                    self.integer_keys.add(key)
+                    par = par.double()
+                self.sum[key] = par if weight == 1 else par.mul_(weight)
+        else:
+            for key, par in self.sum.items():
+                par.add_(model_pars[key].to(par.dtype), alpha=weight)
+        self.total_weight += weight
+        self.contributors.add(contributor)
+        return True
+
+    def average(self):
+        avg_model_par = {}
+        for key, par in self.sum.items():
+            avg_model_par[key] = torch.div(par, self.total_weight)
+            if key in self.integer_keys:
+                avg_model_par[key] = avg_model_par[key].to(torch.get_default_dtype())
+        return avg_model_par
+
+
 class FedAvgAggregator(Aggregator):
     """
     FedAvgAggregator is responsible for aggregating model parameters by using FedAvg Algorithm
 
+    Uploaded parameters are folded into the RunningAverage of their round as soon as they land, a round is
+    aggregated when every client of the job has contributed to it
+
+    With a compression strategy, aggregated parameters are broadcast as deltas against the former round
+
     """
 
-    def __init__(self, work_mode, job_path, base_model_path):
+    def __init__(self, work_mode, job_path, base_model_path, compression=None):
         super(FedAvgAggregator, self).__init__(work_mode, job_path, base_model_path)
+        self.codec = ParameterCodec(compression) if compression is not None else None
+        self.broadcast_executor_pool = ThreadPoolExecutor(5)
         self.fed_step = {}
+        self.rounds = {}
+        self.round_stats = {}
+        self.job_locks = {}
+        self.lock = threading.Lock()
         self.logger = LoggerFactory.getLogger("FedAvgAggregator", logging.INFO)
-    def aggregate(self):
+
+    def submit(self, job_id, client_id, fed_step, model_pars_path):
         """
+        Hand parameters uploaded by a client to the aggregate executor pool
+        :param job_id:
+        :param client_id:
+        :param fed_step:
+        :param model_pars_path:
+        :return: future of fold_model_pars
+        """
+        future = self.aggregate_executor_pool.submit(self.fold_model_pars, job_id, client_id, fed_step,
+                                                     model_pars_path)
+        # the communication server drops the future, errors of the fold and of the aggregation are logged here
+        future.add_done_callback(LoggerFactory.log_future_exception(
+            self.logger, "job: {} client: {} folding parameters of the {}th round".format(job_id, client_id, fed_step)))
+        return future
 
+    def aggregate(self):
+        """
+        Fold the latest parameters of every client which are not folded yet, i.e. written to the job
+        directories by standalone clients or uploaded before the server started
         :return:
         """
-
-        job_list = JobManager.get_job_list(self.job_path)
-        WAITING_BROADCAST_AGGREGATED_JOB_ID_LIST.clear()
-        for job in job_list:
-            job_model_pars, fed_step = self.load_model_pars(
-                os.path.join(self.base_model_path, "models_{}".format(job.get_job_id())),
-                self.fed_step.get(job.get_job_id()))
-            # print("fed_step: {}, self.fed_step: {}, job_model_pars: {}".format(fed_step, self.fed_step.get(job.get_job_id()), job_model_pars))
-            job_fed_step = 0 if self.fed_step.get(job.get_job_id()) is None else self.fed_step.get(job.get_job_id())
-            if job_fed_step != fed_step and job_model_pars is not None:
-                self.logger.info("Aggregating......")
-                self._exec(job_model_pars, self.base_model_path, job.get_job_id(), fed_step)
-                self.fed_step[job.get_job_id()] = fed_step
-                WAITING_BROADCAST_AGGREGATED_JOB_ID_LIST.append(job.get_job_id())
-                if job.get_epoch() <= self.fed_step[job.get_job_id()]:
-                    self._save_final_model_pars(job.get_job_id(), os.path.join(self.base_model_path,
-                                                                               "models_{}".format(job.get_job_id()),
-                                                                               "tmp_aggregate_pars"),
-                                                self.fed_step[job.get_job_id()])
-                if self.work_mode == WorkModeStrategy.WORKMODE_CLUSTER:
-                    self._broadcast(WAITING_BROADCAST_AGGREGATED_JOB_ID_LIST, CONNECTED_TRAINER_LIST,
-                                    self.base_model_path)
-
-
-    def _exec(self, job_model_pars, base_model_path, job_id, fed_step):
-        avg_model_par = job_model_pars[0]
-        for key in avg_model_par.keys():
-            for i in range(1, len(job_model_pars)):
-                avg_model_par[key] += job_model_pars[i][key]
-            avg_model_par[key] = torch.div(avg_model_par[key], len(job_model_pars))
+        for job in JobManager.get_job_list(self.job_path):
+            job_id = job.get_job_id()
+            job_model_dir = os.path.join(self.base_model_path, "models_{}".format(job_id))
+            if not os.path.exists(job_model_dir):
+                continue
+            for client_id in self._get_client_ids(job_id):
+                client_model_dir = os.path.join(job_model_dir, "models_{}".format(client_id))
+                files = os.listdir(client_model_dir)
+                if len(files) == 0:
+                    continue
+                fed_step = self._find_last_model_file_num(files)
+                if fed_step <= self.fed_step.get(job_id, 0) or self._is_folded(job_id, client_id, fed_step):
+                    continue
+                try:
+                    self.fold_model_pars(job_id, client_id, fed_step,
+                                         os.path.join(client_model_dir, "tmp_parameters_{}".format(fed_step)))
+                except Exception as e:
+                    # the client may still be writing the file, it is read again by the next scan
+                    self.logger.warning("job: {} client: {} parameters of the {}th round not readable yet: {}".format(
+                        job_id, client_id, fed_step, e))
+
+    def fold_model_pars(self, job_id, client_id, fed_step, model_pars_path):
+        """
+        Fold the parameters of a client into its round and aggregate the round if it was the last one missing
+        :param job_id:
+        :param client_id:
+        :param fed_step:
+        :param model_pars_path:
+        :return:
+        """
+        client_id, fed_step = str(client_id), int(fed_step)
+        if fed_step <= self.fed_step.get(job_id, 0):
+            return
+        load_start = time.time()
+        model_pars = torch.load(model_pars_path, map_location="cpu")
+        load_time = time.time() - load_start
+        with self._get_job_lock(job_id):
+            if fed_step <= self.fed_step.get(job_id, 0):
+                return
+            job_rounds = self.rounds.setdefault(job_id, {})
+            if fed_step not in job_rounds:
+                job_rounds[fed_step] = (RunningAverage(), {"first_update": load_start, "load_time": 0, "fold_time": 0})
+            job_round, stats = job_rounds[fed_step]
+            fold_start = time.time()
+            if not job_round.add(client_id, model_pars):
+                return
+            del model_pars
+            stats["load_time"] += load_time
+            stats["fold_time"] += time.time() - fold_start
+            stats["last_update"] = time.time()
+            if set(self._get_client_ids(job_id)) <= job_round.contributors:
+                self._finish_round(job_id, fed_step)
+
+    def get_round_stats(self, job_id):
+        return self.round_stats.get(job_id, [])
+
+    def _finish_round(self, job_id, fed_step):
+        job_round, stats = self.rounds[job_id].pop(fed_step)
+        for stale_fed_step in [step for step in self.rounds[job_id] if step < fed_step]:
+            del self.rounds[job_id][stale_fed_step]
+        self.logger.info("Aggregating......")
+        save_start = time.time()
+        avg_model_par = job_round.average()
+        aggregated_files = None
+        if self.codec is not None and self.work_mode == WorkModeStrategy.WORKMODE_CLUSTER:
+            base_model_pars = torch.load(ModelUtils.get_aggregate_pars_path(
+                self.base_model_path, job_id, self.fed_step.get(job_id, 0)), map_location="cpu")
+            send_aggregate_filename = "tmp_aggregate_{}_{}".format(job_id, fed_step)
+            aggregated_files = {send_aggregate_filename: (send_aggregate_filename,
+                                                          self.codec.encode(avg_model_par, base_model_pars))}
+            # clients only get the decoded parameters, keeping them as the aggregate takes the next deltas against
+            # what clients actually hold, so the error of this broadcast is sent again with the next one
+            avg_model_par = ParameterCodec.decode(aggregated_files[send_aggregate_filename][1], base_model_pars)
+        self._save_aggregate_pars(avg_model_par, self.base_model_path, job_id, fed_step)
+        self.fed_step[job_id] = fed_step
+        job = JobManager.get_job(self.job_path, job_id)
+        if job is not None and job.get_epoch() <= fed_step:
+            self._save_final_model_pars(job_id, os.path.join(self.base_model_path, "models_{}".format(job_id),
+                                                             "tmp_aggregate_pars"), fed_step)
+        broadcast_start = time.time()
+        if self.work_mode == WorkModeStrategy.WORKMODE_CLUSTER:
+            self._broadcast([job_id], CONNECTED_TRAINER_LIST, self.base_model_path, aggregated_files)
+        end = time.time()
+
+        stats.update({"fed_step": fed_step, "clients": len(job_round.contributors),
+                      "save_time": broadcast_start - save_start, "broadcast_time": end - broadcast_start,
+                      "round_time": end - stats["first_update"], "tail_time": end - stats["last_update"]})
+        self.round_stats.setdefault(job_id, []).append(stats)
+        self.logger.info("job: {} the {}th round of {} clients took {:.3f}s, {:.3f}s after the last update "
+                         "(load {:.3f}s, fold {:.3f}s, save {:.3f}s, broadcast {:.3f}s)".format(
+                            job_id, fed_step, stats["clients"], stats["round_time"], stats["tail_time"],
+                            stats["load_time"], stats["fold_time"], stats["save_time"], stats["broadcast_time"]))
+
+    def _save_aggregate_pars(self, avg_model_par, base_model_path, job_id, fed_step):
         tmp_aggregate_dir = os.path.join(base_model_path, "models_{}".format(job_id))
         tmp_aggregate_path = os.path.join(base_model_path, "models_{}".format(job_id),
                                           "{}_{}".format(LOCAL_AGGREGATE_FILE, fed_step))
-        if not os.path.exists(tmp_aggregate_dir):
-            os.makedirs(tmp_aggregate_dir)
-        torch.save(avg_model_par, tmp_aggregate_path)
+        # clients count the files of tmp_aggregate_pars, so the file is written beside it and moved in once complete
+        partial_path = os.path.join(tmp_aggregate_dir, "avg_pars_{}.part".format(fed_step))
+        if not os.path.exists(os.path.dirname(tmp_aggregate_path)):
+            os.makedirs(os.path.dirname(tmp_aggregate_path))
+        torch.save(avg_model_par, partial_path)
+        os.replace(partial_path, tmp_aggregate_path)
 
         self.logger.info("job: {} the {}th round parameters aggregated successfully!".format(job_id, fed_step))
 
-    def _broadcast(self, job_id_list, connected_client_list, base_model_path):
-        """
+    def _get_client_ids(self, job_id):
+        job_model_dir = os.path.join(self.base_model_path, "models_{}".format(job_id))
+        return [f[len("models_"):] for f in os.listdir(job_model_dir) if f.startswith("models_")]
 
+    def _get_job_lock(self, job_id):
+        with self.lock:
+            return self.job_locks.setdefault(job_id, threading.Lock())
+
+    def _is_folded(self, job_id, client_id, fed_step):
+        job_round = self.rounds.get(job_id, {}).get(fed_step)
+        return job_round is not None and client_id in job_round[0].contributors
+
+    def _broadcast(self, job_id_list, connected_client_list, base_model_path, aggregated_files=None):
+        """
+        Send the aggregated parameters to every connected client concurrently
         :param job_id_list:
         :param connected_client_list:
         :param base_model_path:
+        :param aggregated_files: encoded parameters, the aggregated files of job_id_list if None
         :return:
         """
-        aggregated_files = self._prepare_upload_aggregate_file(job_id_list, base_model_path)
+        if aggregated_files is None:
+            aggregated_files = self._prepare_upload_aggregate_file(job_id_list, base_model_path)
         self.logger.info("connected client list: {}".format(connected_client_list))
-        for client in connected_client_list:
+        futures = {}
+        for client in list(connected_client_list):
             client_url = "http://{}".format(client)
-            response = requests.post("/".join([client_url, "aggregatepars"]), data=None, files=aggregated_files)
-            # print(response)
+            futures[client] = self.broadcast_executor_pool.submit(requests.post, "/".join([client_url, "aggregatepars"]),
+                                                                  data=None, files=aggregated_files)
+        for client, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.warning("broadcast to {} failed: {}".format(client, e))
 
     def _prepare_upload_aggregate_file(self, job_id_list, base_model_path):
         """
@@ -160,7 +325,9 @@ class FedAvgAggregator(Aggregator):
             fed_step = self._find_last_model_file_num(os.listdir(tmp_aggregate_dir))
             send_aggregate_filename = "tmp_aggregate_{}_{}".format(job_id, fed_step)
             tmp_aggregate_path = os.path.join(tmp_aggregate_dir, "avg_pars_{}".format(fed_step))
-            aggregated_files[send_aggregate_filename] = (send_aggregate_filename, open(tmp_aggregate_path, "rb"))
+            # read once, the content is posted to several clients at the same time
+            with open(tmp_aggregate_path, "rb") as f:
+                aggregated_files[send_aggregate_filename] = (send_aggregate_filename, f.read())
         return aggregated_files
 
     def _save_final_model_pars(self, job_id, tmp_aggregate_dir, fed_step):
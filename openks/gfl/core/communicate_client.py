@@ -13,9 +13,11 @@
 # limitations under the License.
 
 import os, logging
+import torch
 from flask import Flask, request
 from werkzeug.serving import run_simple
-from gfl.utils.utils import return_data_decorator, LoggerFactory
+from gfl.utils.utils import ModelUtils, return_data_decorator, LoggerFactory
+from gfl.utils.compression import ParameterCodec
 
 app = Flask(__name__)
 
@@ -23,6 +25,13 @@ BASE_MODEL_PATH = os.path.join(os.path.abspath("."), "res", "models")
 
 logger = LoggerFactory.getLogger(__name__, logging.INFO)
 
+# listeners called with (job_id, fed_step) once received aggregated parameters are written
+aggregate_pars_listeners = []
+
+
+def add_aggregate_pars_listener(listener):
+    aggregate_pars_listeners.append(listener)
+
 
 @return_data_decorator
 @app.route("/", methods=['GET'])
@@ -38,13 +47,27 @@ def submit_aggregate_pars():
 
     for filename in recv_aggregate_files:
         job_id = filename.split("_")[-2]
+        fed_step = int(filename.split("_")[-1])
         tmp_aggregate_file = recv_aggregate_files[filename]
         job_base_model_dir = os.path.join(BASE_MODEL_PATH, "models_{}".format(job_id), "tmp_aggregate_pars")
-        latest_num = len(os.listdir(job_base_model_dir)) - 1
-        latest_tmp_aggretate_file_path = os.path.join(job_base_model_dir, "avg_pars_{}".format(latest_num))
-        with open(latest_tmp_aggretate_file_path, "wb") as f:
-            for line in tmp_aggregate_file.readlines():
-                f.write(line)
+        data = tmp_aggregate_file.read()
+        if ParameterCodec.is_encoded(data):
+            # delta against the latest aggregated parameters this client holds
+            base_num = max([int(f.split("_")[-1]) for f in os.listdir(job_base_model_dir)
+                            if int(f.split("_")[-1]) < fed_step])
+            base_model_pars = torch.load(ModelUtils.get_aggregate_pars_path(BASE_MODEL_PATH, job_id, base_num),
+                                         map_location="cpu")
+            # trainers count the files of tmp_aggregate_pars, the new file is moved in once complete
+            partial_path = os.path.join(BASE_MODEL_PATH, "models_{}".format(job_id), "avg_pars_{}.part".format(fed_step))
+            torch.save(ParameterCodec.decode(data, base_model_pars), partial_path)
+            os.replace(partial_path, os.path.join(job_base_model_dir, "avg_pars_{}".format(fed_step)))
+        else:
+            latest_num = len(os.listdir(job_base_model_dir)) - 1
+            latest_tmp_aggretate_file_path = os.path.join(job_base_model_dir, "avg_pars_{}".format(latest_num))
+            with open(latest_tmp_aggretate_file_path, "wb") as f:
+                f.write(data)
+        for listener in aggregate_pars_listeners:
+            listener(job_id, fed_step)
         logger.info("recv success")
     return "ok", 200
 
@@ -15,12 +15,14 @@
 
 import os
 import json
+import torch
 import logging
 from flask import Flask, send_from_directory, request
 from werkzeug.serving import run_simple
 from gfl.entity.runtime_config import CONNECTED_TRAINER_LIST
 from gfl.core.job_manager import JobManager
-from gfl.utils.utils import JobEncoder, return_data_decorator, LoggerFactory
+from gfl.utils.utils import JobEncoder, ModelUtils, return_data_decorator, LoggerFactory
+from gfl.utils.compression import ParameterCodec
 
 API_VERSION = "/api/v1"
 JOB_PATH = os.path.join(os.path.abspath("."), "res", "jobs_server")
@@ -30,6 +32,13 @@ logger = LoggerFactory.getLogger(__name__, logging.INFO)
 
 app = Flask(__name__)
 
+# listeners called with (job_id, client_id, fed_step, model_pars_path) once uploaded parameters are written
+model_pars_listeners = []
+
+
+def add_model_pars_listener(listener):
+    model_pars_listeners.append(listener)
+
 
 @app.route("/test/<name>")
 @return_data_decorator
@@ -95,9 +104,17 @@ def submit_model_parameter(client_id, job_id, fed_step):
         os.makedirs(model_pars_dir)
     model_pars_path = os.path.join(BASE_MODEL_PATH, "models_{}".format(job_id), "models_{}".format(client_id),
                                    "tmp_parameters_{}".format(fed_step))
-    with open(model_pars_path, "wb") as f:
-        for line in tmp_parameter_file.readlines():
-            f.write(line)
+    data = tmp_parameter_file.read()
+    if ParameterCodec.is_encoded(data):
+        # the client sent the delta against the parameters aggregated in the former round
+        base_model_pars = torch.load(ModelUtils.get_aggregate_pars_path(BASE_MODEL_PATH, job_id, int(fed_step) - 1),
+                                     map_location="cpu")
+        torch.save(ParameterCodec.decode(data, base_model_pars), model_pars_path)
+    else:
+        with open(model_pars_path, "wb") as f:
+            f.write(data)
+    for listener in model_pars_listeners:
+        listener(job_id, client_id, fed_step, model_pars_path)
 
     return 'submit_success', 200
 
@@ -25,6 +25,8 @@ from gfl.utils.utils import JobUtils, LoggerFactory
 from gfl.core.strategy import WorkModeStrategy, FederateStrategy
 
 lock = threading.RLock()
+# job file path -> ((mtime, size), job)
+job_cache = {}
 
 JOB_PATH = os.path.join(os.path.abspath("."), "res", "jobs_server")
 MODEL_PATH = os.path.join(os.path.abspath("."), "res", "models")
@@ -109,10 +111,26 @@ class JobManager(object):
 
     @staticmethod
     def get_job_list(job_path):
+        """
+        Jobs of job_path, a job file is unpickled again only when it was modified
+        :param job_path:
+        :return: job list
+        """
         job_list = []
-        for job_file in os.listdir(job_path):
-            job_file_path = os.path.join(job_path, job_file)
-            with open(job_file_path, "rb") as f:
-                job = pickle.load(f)
-                job_list.append(job)
+        with lock:
+            for entry in os.scandir(job_path):
+                stat = entry.stat()
+                cached = job_cache.get(entry.path)
+                if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+                    with open(entry.path, "rb") as f:
+                        cached = ((stat.st_mtime_ns, stat.st_size), pickle.load(f))
+                    job_cache[entry.path] = cached
+                job_list.append(cached[1])
         return job_list
+
+    @staticmethod
+    def get_job(job_path, job_id):
+        for job in JobManager.get_job_list(job_path):
+            if job.get_job_id() == job_id:
+                return job
+        return None
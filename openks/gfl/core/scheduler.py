@@ -0,0 +1,178 @@
+# Copyright (c) 2019 GalaxyLearning Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import logging
+import threading
+from enum import Enum
+from gfl.utils.utils import LoggerFactory
+
+
+class RoundState(Enum):
+    ROUND_IDLE = "idle"
+    ROUND_TRAINED = "trained"
+    ROUND_DONE = "done"
+
+
+class RoundScheduler(object):
+    """
+    RoundScheduler runs the rounds of several jobs, at most max_workers rounds at a time
+
+    A job is a function training one round if the aggregated parameters it waits for are there, it returns
+    a RoundState. Idle jobs are polled again after a backoff growing from min_backoff to max_backoff, notify wakes
+    them up as soon as new aggregated parameters are received
+
+    Rounds run on threads of the scheduler which are not daemons, so the process lives till its jobs are done even
+    if the main thread returned. A job failing max_failures rounds in a row is dropped
+    """
+
+    def __init__(self, max_workers=1, min_backoff=0.5, max_backoff=10, backoff_factor=2, max_failures=3):
+        self.max_workers = max_workers
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff_factor = backoff_factor
+        self.max_failures = max_failures
+        self.jobs = {}
+        self.stats = {}
+        self.running = 0
+        self.condition = threading.Condition()
+        self.dispatching = False
+        self.logger = LoggerFactory.getLogger("RoundScheduler", logging.INFO)
+
+    def schedule(self, job_id, train_round):
+        """
+        Run the rounds of a job till train_round returns RoundState.ROUND_DONE
+        :param job_id:
+        :param train_round:
+        :return:
+        """
+        with self.condition:
+            self.jobs[job_id] = {"train_round": train_round, "due": time.time(), "backoff": self.min_backoff,
+                                 "running": False, "notified": False, "failures": 0}
+            self.stats[job_id] = {"start": time.time(), "end": None, "polls": 0, "rounds": 0, "training_time": 0.0,
+                                  "polling_time": 0.0, "failed": False}
+            if not self.dispatching:
+                # not a daemon, the process lives till its jobs are done
+                threading.Thread(target=self._dispatch, name="round-scheduler").start()
+                self.dispatching = True
+            self.condition.notify_all()
+
+    def notify(self, job_id=None, fed_step=None):
+        """
+        Poll a job at once, all jobs if job_id is None
+        :param job_id:
+        :param fed_step: round of the received parameters
+        :return:
+        """
+        with self.condition:
+            for notified_job_id, job in self.jobs.items():
+                if job_id is None or notified_job_id == job_id:
+                    job["due"] = time.time()
+                    job["backoff"] = self.min_backoff
+                    # a round running now may have missed the parameters
+                    job["notified"] = True
+            self.condition.notify_all()
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block till a job is done
+        :param job_id:
+        :param timeout:
+        :return: whether the job is done
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: job_id not in self.jobs, timeout)
+
+    def get_stats(self, job_id):
+        """
+        Time spent training and waiting for the aggregated parameters by a job
+        :param job_id:
+        :return:
+        """
+        with self.condition:
+            stats = dict(self.stats[job_id])
+        elapsed = (stats["end"] or time.time()) - stats["start"]
+        stats["idle_time"] = max(0.0, elapsed - stats["training_time"])
+        stats["idle_ratio"] = stats["idle_time"] / elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def _dispatch(self):
+        with self.condition:
+            try:
+                while self.jobs:
+                    now = time.time()
+                    for job_id, job in self.jobs.items():
+                        if self.running >= self.max_workers:
+                            break
+                        if not job["running"] and job["due"] <= now:
+                            threading.Thread(target=self._run_round, args=(job_id, job),
+                                             name="round-{}".format(job_id)).start()
+                            job["running"] = True
+                            job["notified"] = False
+                            self.running += 1
+                    # sleep till the next poll, rounds finishing and notify wake the dispatcher up earlier
+                    due = [job["due"] for job in self.jobs.values() if not job["running"]]
+                    if self.running >= self.max_workers or not due:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(max(0, min(due) - now))
+            except Exception:
+                self.logger.exception("round dispatching failed, {} jobs left".format(len(self.jobs)))
+                raise
+            finally:
+                # the next schedule starts a new dispatcher
+                self.dispatching = False
+
+    def _run_round(self, job_id, job):
+        start = time.time()
+        error = False
+        try:
+            state = job["train_round"]()
+        except Exception:
+            self.logger.exception("job_{} round failed".format(job_id))
+            state = RoundState.ROUND_IDLE
+            error = True
+        duration = time.time() - start
+        with self.condition:
+            self.running -= 1
+            stats = self.stats[job_id]
+            stats["polls"] += 1
+            job["failures"] = job["failures"] + 1 if error else 0
+            if job["failures"] >= self.max_failures:
+                self.logger.error("job_{} dropped after {} failed rounds in a row".format(job_id, job["failures"]))
+                stats["failed"] = True
+                state = RoundState.ROUND_DONE
+            if state == RoundState.ROUND_TRAINED:
+                stats["rounds"] += 1
+                stats["training_time"] += duration
+            else:
+                stats["polling_time"] += duration
+            if state == RoundState.ROUND_DONE:
+                stats["end"] = time.time()
+                del self.jobs[job_id]
+                self.logger.info("job_{} done: {} rounds, training {:.3f}s, idle {:.3f}s, {} polls".format(
+                    job_id, stats["rounds"], stats["training_time"], stats["end"] - stats["start"] -
+                    stats["training_time"], stats["polls"]))
+            else:
+                if job["notified"]:
+                    job["due"] = time.time()
+                elif state == RoundState.ROUND_TRAINED:
+                    job["backoff"] = self.min_backoff
+                    job["due"] = time.time() + job["backoff"]
+                else:
+                    job["due"] = time.time() + job["backoff"]
+                    job["backoff"] = min(job["backoff"] * self.backoff_factor, self.max_backoff)
+                job["running"] = False
+            self.condition.notify_all()
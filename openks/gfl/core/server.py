@@ -39,17 +39,21 @@ class FLServer(object):
 class FLStandaloneServer(FLServer):
     """
     FLStandaloneServer is just responsible for running aggregator
+
+    Standalone clients write their parameters straight into the job directories, which are scanned every
+    scan_interval seconds, a scan only lists the directories and loads the parameters not folded yet
     """
-    def __init__(self, federate_strategy):
+    def __init__(self, federate_strategy, scan_interval=0.5):
         super(FLStandaloneServer, self).__init__()
         self.executor_pool = ThreadPoolExecutor(5)
+        self.scan_interval = scan_interval
         if federate_strategy == FederateStrategy.FED_AVG:
             self.aggregator = FedAvgAggregator(WorkModeStrategy.WORKMODE_STANDALONE, JOB_PATH, BASE_MODEL_PATH)
         else:
             pass
 
     def start(self):
-        t = CyclicTimer(5, self.aggregator.aggregate)
+        t = CyclicTimer(self.scan_interval, self.aggregator.aggregate)
         t.start()
         self.logger.info("Aggregator started")
 
@@ -57,12 +61,15 @@ class FLStandaloneServer(FLServer):
 class FLClusterServer(FLServer):
     """
     FLClusterServer is responsible for running aggregator and communication server
+
+    Uploaded parameters are handed to the aggregator by the communication server as soon as they are written
     """
-    def __init__(self, federate_strategy, ip, port, api_version):
+    def __init__(self, federate_strategy, ip, port, api_version, compression=None):
         super(FLClusterServer, self).__init__()
         self.executor_pool = ThreadPoolExecutor(5)
         if federate_strategy == FederateStrategy.FED_AVG:
-            self.aggregator = FedAvgAggregator(WorkModeStrategy.WORKMODE_CLUSTER, JOB_PATH, BASE_MODEL_PATH)
+            self.aggregator = FedAvgAggregator(WorkModeStrategy.WORKMODE_CLUSTER, JOB_PATH, BASE_MODEL_PATH,
+                                               compression)
         else:
             pass
         self.ip = ip
@@ -71,10 +78,12 @@ class FLClusterServer(FLServer):
         self.federate_strategy = federate_strategy
 
     def start(self):
-        self.executor_pool.submit(communicate_server.start_communicate_server, self.api_version, self.ip, self.port)
         if self.federate_strategy == FederateStrategy.FED_AVG:
-            t = CyclicTimer(5, self.aggregator.aggregate)
-            t.start()
+            communicate_server.add_model_pars_listener(self.aggregator.submit)
+            # parameters uploaded before the server started
+            self.executor_pool.submit(self.aggregator.aggregate).add_done_callback(
+                LoggerFactory.log_future_exception(self.logger, "Aggregating parameters uploaded before start"))
             self.logger.info("Aggregator started")
-        else:
-            pass
+        self.executor_pool.submit(communicate_server.start_communicate_server, self.api_version, self.ip,
+                                  self.port).add_done_callback(
+            LoggerFactory.log_future_exception(self.logger, "Communication server"))
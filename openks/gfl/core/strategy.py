@@ -50,6 +50,16 @@ class OptimizerStrategy(Enum):
     OPTIM_SGD = "SGD"
     OPTIM_ADAM = "Adam"
 
+class QuantizationStrategy(Enum):
+    QUANT_NONE = "none"
+    QUANT_FP16 = "fp16"
+    QUANT_INT8 = "int8"
+
+class FramingStrategy(Enum):
+    FRAME_NONE = "none"
+    FRAME_ZLIB = "zlib"
+    FRAME_ZSTD = "zstd"
+
 
 
 
@@ -116,6 +126,35 @@ class TrainStrategy(Strategy):
 
 
 
+class CompressionStrategy(Strategy):
+    """
+    CompressionStrategy describes the wire format of model parameters: deltas against the last aggregated round,
+    quantized, optionally top-k sparsified with error feedback, framed by zlib or zstd
+    """
+
+    def __init__(self, quantization=QuantizationStrategy.QUANT_FP16, topk_ratio=None,
+                 framing=FramingStrategy.FRAME_ZLIB, level=None):
+        super(CompressionStrategy, self).__init__()
+        if topk_ratio is not None and not 0 < topk_ratio <= 1:
+            raise GFLException("topk_ratio should be in (0, 1]")
+        self.quantization = quantization
+        self.topk_ratio = topk_ratio
+        self.framing = framing
+        self.level = level
+
+    def get_quantization(self):
+        return self.quantization
+
+    def get_topk_ratio(self):
+        return self.topk_ratio
+
+    def get_framing(self):
+        return self.framing
+
+    def get_level(self):
+        return self.level
+
+
 class TestStrategy(Strategy):
 
     def __init__(self):
@@ -25,7 +25,9 @@ import matplotlib.pyplot as plt
 from gfl.entity import runtime_config
 from gfl.exceptions.fl_expection import GFLException
 from gfl.core.strategy import OptimizerStrategy, LossStrategy, SchedulerStrategy
+from gfl.core.scheduler import RoundScheduler, RoundState
 from gfl.utils.utils import LoggerFactory
+from gfl.utils.compression import ParameterCodec
 
 JOB_PATH = os.path.join(os.path.abspath("."), "res", "jobs_client")
 LOCAL_MODEL_BASE_PATH = os.path.join(os.path.abspath("."), "res", "models")
@@ -43,6 +45,26 @@ class TrainStrategy(object):
         self.fed_step = {}
         self.job_iter_dict = {}
         self.job_path = JOB_PATH
+        self.codec = None
+        # error of the former uploads, sent again with the next ones
+        self.residual = {}
+
+    def train(self):
+        """
+        Train the job till it completes, blocking the calling thread, see RoundScheduler to run several jobs on
+        shared threads
+        :return:
+        """
+        scheduler = RoundScheduler()
+        scheduler.schedule(self.job.get_job_id(), self.train_round)
+        scheduler.wait(self.job.get_job_id())
+
+    def train_round(self):
+        """
+        Train one round if the aggregated parameters it needs are there
+        :return: RoundState
+        """
+        return RoundState.ROUND_DONE
 
     def _parse_optimizer(self, optimizer, model, lr):
         if optimizer == OptimizerStrategy.OPTIM_SGD.value:
@@ -130,9 +152,6 @@ class TrainNormalStrategy(TrainStrategy):
         self.model = model
         self.curve = curve
 
-    def train(self):
-        pass
-
     def _train(self, train_model, job_models_path, fed_step, local_epoch):
         """
         Traditional training method
@@ -225,11 +244,18 @@ class TrainNormalStrategy(TrainStrategy):
                 if chunk:
                     f.write(chunk)
 
-    def _prepare_upload_client_model_pars(self, job_id, client_id, fed_avg):
+    def _prepare_upload_client_model_pars(self, job_id, client_id, fed_avg, base_model_pars=None):
         job_init_model_pars_dir = os.path.join(os.path.abspath("."), LOCAL_MODEL_BASE_PATH,
                                                "models_{}".format(job_id), "models_{}".format(client_id))
         tmp_parameter_path = "tmp_parameters_{}".format(fed_avg)
 
+        if self.codec is not None:
+            model_pars = torch.load(os.path.join(job_init_model_pars_dir, tmp_parameter_path), map_location="cpu")
+            files = {
+                'tmp_parameter_file': (
+                    'tmp_parameter_file', self.codec.encode(model_pars, base_model_pars, self.residual))
+            }
+            return files
         files = {
             'tmp_parameter_file': (
                 'tmp_parameter_file', open(os.path.join(job_init_model_pars_dir, tmp_parameter_path), "rb"))
@@ -439,43 +465,44 @@ class TrainStandloneNormalStrategy(TrainNormalStrategy):
         super(TrainStandloneNormalStrategy, self).__init__(job, data, fed_step, client_id, local_epoch, model, curve)
         self.logger = LoggerFactory.getLogger("TrainStandloneNormalStrategy", logging.INFO)
 
-    def train(self):
-        while True:
-            self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(self.job.get_job_id()) is None else \
-                self.fed_step.get(self.job.get_job_id())
-            if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
-                    self.job.get_job_id()) == self.job.get_epoch():
-                self.logger.info("job_{} completed".format(self.job.get_job_id()))
-                if self.curve is True:
-                    self._draw_curve()
-                break
-            elif self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
-                    self.job.get_job_id()) > self.job.get_epoch():
-                self.logger.warning("job_{} has completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
-                break
-            aggregate_file, fed_step = self._find_latest_aggregate_model_pars(self.job.get_job_id())
-            if aggregate_file is not None and self.fed_step.get(self.job.get_job_id()) != fed_step:
-                if self.job.get_job_id() in runtime_config.EXEC_JOB_LIST:
-                    runtime_config.EXEC_JOB_LIST.remove(self.job.get_job_id())
-                self.fed_step[self.job.get_job_id()] = fed_step
-            if self.job.get_job_id() not in runtime_config.EXEC_JOB_LIST:
-                # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
-                if aggregate_file is not None:
-                    self.logger.info("load {} parameters".format(aggregate_file))
-                    new_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
-                    model_pars = torch.load(aggregate_file)
-                    new_model.load_state_dict(model_pars)
-                    self.model.set_model(new_model)
-                job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
-                self.logger.info("job_{} is training, Aggregator strategy: {}".format(self.job.get_job_id(),
-                                                                                      self.job.get_aggregate_strategy()))
-                runtime_config.EXEC_JOB_LIST.append(self.job.get_job_id())
-                self.acc, loss = self._train(self.model, job_models_path, self.fed_step.get(self.job.get_job_id()), self.local_epoch)
-                self.loss_list.append(loss)
-                self.accuracy_list.append(self.acc)
-                self.logger.info("job_{} {}th train accuracy: {}".format(self.job.get_job_id(),
-                                                                         self.fed_step.get(self.job.get_job_id()),
-                                                                         self.acc))
+    def train_round(self):
+        self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(self.job.get_job_id()) is None else \
+            self.fed_step.get(self.job.get_job_id())
+        if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
+                self.job.get_job_id()) == self.job.get_epoch():
+            self.logger.info("job_{} completed".format(self.job.get_job_id()))
+            if self.curve is True:
+                self._draw_curve()
+            return RoundState.ROUND_DONE
+        elif self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
+                self.job.get_job_id()) > self.job.get_epoch():
+            self.logger.warning("job_{} has completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
+            return RoundState.ROUND_DONE
+        aggregate_file, fed_step = self._find_latest_aggregate_model_pars(self.job.get_job_id())
+        if aggregate_file is not None and self.fed_step.get(self.job.get_job_id()) != fed_step:
+            if self.job.get_job_id() in runtime_config.EXEC_JOB_LIST:
+                runtime_config.EXEC_JOB_LIST.remove(self.job.get_job_id())
+            self.fed_step[self.job.get_job_id()] = fed_step
+        if self.job.get_job_id() in runtime_config.EXEC_JOB_LIST:
+            return RoundState.ROUND_IDLE
+        # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
+        if aggregate_file is not None:
+            self.logger.info("load {} parameters".format(aggregate_file))
+            new_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
+            model_pars = torch.load(aggregate_file)
+            new_model.load_state_dict(model_pars)
+            self.model.set_model(new_model)
+        job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
+        self.logger.info("job_{} is training, Aggregator strategy: {}".format(self.job.get_job_id(),
+                                                                              self.job.get_aggregate_strategy()))
+        runtime_config.EXEC_JOB_LIST.append(self.job.get_job_id())
+        self.acc, loss = self._train(self.model, job_models_path, self.fed_step.get(self.job.get_job_id()), self.local_epoch)
+        self.loss_list.append(loss)
+        self.accuracy_list.append(self.acc)
+        self.logger.info("job_{} {}th train accuracy: {}".format(self.job.get_job_id(),
+                                                                 self.fed_step.get(self.job.get_job_id()),
+                                                                 self.acc))
+        return RoundState.ROUND_TRAINED
 
 
 class TrainStandloneDistillationStrategy(TrainDistillationStrategy):
@@ -488,49 +515,49 @@ class TrainStandloneDistillationStrategy(TrainDistillationStrategy):
         self.train_model = self._load_job_model(job.get_job_id(), job.get_train_model_class_name())
         self.logger = LoggerFactory.getLogger("TrainStandloneDistillationStrategy", logging.INFO)
 
-    def train(self):
-        while True:
-            self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(
-                self.job.get_job_id()) is None else self.fed_step.get(self.job.get_job_id())
-            # print("test_iter_num: ", self.job_iter_dict[self.job.get_job_id()])
-            if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
-                    self.job.get_job_id()) >= self.job.get_epoch():
-                final_pars_path = os.path.join(self.job_model_path, "models_{}".format(self.client_id),
-                                               "tmp_parameters_{}".format(self.fed_step.get(self.job.get_job_id())))
-                if os.path.exists(final_pars_path):
-                    self._save_final_parameters(self.job.get_job_id(), final_pars_path)
-                    self.logger.info("job_{} completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
-                if self.curve is True:
-                    self._draw_curve()
-                break
-            aggregate_file, _ = self._find_latest_aggregate_model_pars(self.job.get_job_id())
-            other_model_pars, connected_clients_num = self._load_other_models_pars(self.job.get_job_id(),
-                                                                                   self.fed_step[self.job.get_job_id()])
-            # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
-            job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
-
+    def train_round(self):
+        self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(
+            self.job.get_job_id()) is None else self.fed_step.get(self.job.get_job_id())
+        # print("test_iter_num: ", self.job_iter_dict[self.job.get_job_id()])
+        if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
+                self.job.get_job_id()) >= self.job.get_epoch():
+            final_pars_path = os.path.join(self.job_model_path, "models_{}".format(self.client_id),
+                                           "tmp_parameters_{}".format(self.fed_step.get(self.job.get_job_id())))
+            if os.path.exists(final_pars_path):
+                self._save_final_parameters(self.job.get_job_id(), final_pars_path)
+                self.logger.info("job_{} completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
+            if self.curve is True:
+                self._draw_curve()
+            return RoundState.ROUND_DONE
+        aggregate_file, _ = self._find_latest_aggregate_model_pars(self.job.get_job_id())
+        other_model_pars, connected_clients_num = self._load_other_models_pars(self.job.get_job_id(),
+                                                                               self.fed_step[self.job.get_job_id()])
+        # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
+        job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
+
+        if other_model_pars is not None and connected_clients_num and self._calc_rate(len(other_model_pars),
+                                                                                      connected_clients_num) >= THRESHOLD:
             self.logger.info("job_{} is training, Aggregator strategy: {}, L2_dist: {}".format(self.job.get_job_id(),
                                                                                                self.job.get_aggregate_strategy(),
                                                                                                self.job.get_l2_dist()))
-            if other_model_pars is not None and connected_clients_num and self._calc_rate(len(other_model_pars),
-                                                                                          connected_clients_num) >= THRESHOLD:
-
-                self.logger.info("model distillating....")
-                self.fed_step[self.job.get_job_id()] = self.fed_step.get(self.job.get_job_id()) + 1
-                self.acc, loss = self._train_with_distillation(self.model, other_model_pars, self.local_epoch, job_models_path,
-                                                               self.job.get_l2_dist())
-                self.accuracy_list.append(self.acc)
-                self.loss_list.append(loss)
-                self.logger.info("model distillation success")
-            else:
-                init_model_pars_dir = os.path.join(LOCAL_MODEL_BASE_PATH, "models_{}".format(self.job.get_job_id()),
-                                                   "models_{}".format(self.client_id))
-                if not os.path.exists(os.path.join(init_model_pars_dir, "tmp_parameters_{}".format(1))):
-                    new_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
-                    model_pars = torch.load(aggregate_file)
-                    new_model.load_state_dict(model_pars)
-                    self.model.set_model(new_model)
-                    self._train(self.model, init_model_pars_dir, 1, self.local_epoch)
+            self.logger.info("model distillating....")
+            self.fed_step[self.job.get_job_id()] = self.fed_step.get(self.job.get_job_id()) + 1
+            self.acc, loss = self._train_with_distillation(self.model, other_model_pars, self.local_epoch, job_models_path,
+                                                           self.job.get_l2_dist())
+            self.accuracy_list.append(self.acc)
+            self.loss_list.append(loss)
+            self.logger.info("model distillation success")
+            return RoundState.ROUND_TRAINED
+        init_model_pars_dir = os.path.join(LOCAL_MODEL_BASE_PATH, "models_{}".format(self.job.get_job_id()),
+                                           "models_{}".format(self.client_id))
+        if not os.path.exists(os.path.join(init_model_pars_dir, "tmp_parameters_{}".format(1))):
+            new_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
+            model_pars = torch.load(aggregate_file)
+            new_model.load_state_dict(model_pars)
+            self.model.set_model(new_model)
+            self._train(self.model, init_model_pars_dir, 1, self.local_epoch)
+            return RoundState.ROUND_TRAINED
+        return RoundState.ROUND_IDLE
 
 
 class TrainMPCNormalStrategy(TrainNormalStrategy):
@@ -538,54 +565,58 @@ class TrainMPCNormalStrategy(TrainNormalStrategy):
     TrainMPCNormalStrategy is responsible for controlling the process of traditional training in cluster mode
     """
 
-    def __init__(self, job, data, fed_step, client_ip, client_port, server_url, client_id, local_epoch, model, curve):
+    def __init__(self, job, data, fed_step, client_ip, client_port, server_url, client_id, local_epoch, model, curve,
+                 compression=None):
         super(TrainMPCNormalStrategy, self).__init__(job, data, fed_step, client_id, local_epoch, model, curve)
+        if compression is not None:
+            self.codec = ParameterCodec(compression)
         self.server_url = server_url
         self.client_ip = client_ip
         self.client_port = client_port
         self.logger = LoggerFactory.getLogger("TrainMPCNormalStrategy", logging.INFO)
 
-    def train(self):
-        while True:
-            self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(self.job.get_job_id()) is None else \
-                self.fed_step.get(self.job.get_job_id())
-            # print("test_iter_num: ", self.job_iter_dict[self.job.get_job_id()])
-            if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
-                    self.job.get_job_id()) == self.job.get_epoch():
-                self.logger.info("job_{} completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
-                if self.curve is True:
-                    self._draw_curve()
-                break
-            elif self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
-                    self.job.get_job_id()) > self.job.get_epoch():
-                self.logger.warning("job_{} has completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
-                if self.curve is True:
-                    self._draw_curve()
-                break
-            self._prepare_job_model(self.job, self.server_url)
-            self._prepare_job_init_model_pars(self.job, self.server_url)
-            aggregate_file, fed_step = self._find_latest_aggregate_model_pars(self.job.get_job_id())
-            if aggregate_file is not None and self.fed_step.get(self.job.get_job_id()) != fed_step:
-                job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
-                # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
-                self.logger.info("load {} parameters".format(aggregate_file))
-                new_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
-                model_pars = torch.load(aggregate_file)
-                new_model.load_state_dict(model_pars)
-                self.model.set_model(new_model)
-                self.fed_step[self.job.get_job_id()] = fed_step
-                self.logger.info("job_{} is training, Aggregator strategy: {}".format(self.job.get_job_id(),
-                                                                                      self.job.get_aggregate_strategy()))
-                self.acc, loss = self._train(self.model, job_models_path, self.fed_step.get(self.job.get_job_id()), self.local_epoch)
-                self.loss_list.append(loss)
-                self.accuracy_list.append(self.acc)
-                files = self._prepare_upload_client_model_pars(self.job.get_job_id(), self.client_id,
-                                                               self.fed_step.get(self.job.get_job_id()))
-                response = requests.post("/".join(
-                    [self.server_url, "modelpars", "%s" % self.client_id, "%s" % self.job.get_job_id(),
-                     "%s" % self.fed_step[self.job.get_job_id()]]),
-                    data=None, files=files)
-                # print(response)
+    def train_round(self):
+        self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(self.job.get_job_id()) is None else \
+            self.fed_step.get(self.job.get_job_id())
+        # print("test_iter_num: ", self.job_iter_dict[self.job.get_job_id()])
+        if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
+                self.job.get_job_id()) == self.job.get_epoch():
+            self.logger.info("job_{} completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
+            if self.curve is True:
+                self._draw_curve()
+            return RoundState.ROUND_DONE
+        elif self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
+                self.job.get_job_id()) > self.job.get_epoch():
+            self.logger.warning("job_{} has completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
+            if self.curve is True:
+                self._draw_curve()
+            return RoundState.ROUND_DONE
+        self._prepare_job_model(self.job, self.server_url)
+        self._prepare_job_init_model_pars(self.job, self.server_url)
+        aggregate_file, fed_step = self._find_latest_aggregate_model_pars(self.job.get_job_id())
+        if aggregate_file is None or self.fed_step.get(self.job.get_job_id()) == fed_step:
+            return RoundState.ROUND_IDLE
+        job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
+        # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
+        self.logger.info("load {} parameters".format(aggregate_file))
+        new_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
+        model_pars = torch.load(aggregate_file)
+        new_model.load_state_dict(model_pars)
+        self.model.set_model(new_model)
+        self.fed_step[self.job.get_job_id()] = fed_step
+        self.logger.info("job_{} is training, Aggregator strategy: {}".format(self.job.get_job_id(),
+                                                                              self.job.get_aggregate_strategy()))
+        self.acc, loss = self._train(self.model, job_models_path, self.fed_step.get(self.job.get_job_id()), self.local_epoch)
+        self.loss_list.append(loss)
+        self.accuracy_list.append(self.acc)
+        files = self._prepare_upload_client_model_pars(self.job.get_job_id(), self.client_id,
+                                                       self.fed_step.get(self.job.get_job_id()), model_pars)
+        response = requests.post("/".join(
+            [self.server_url, "modelpars", "%s" % self.client_id, "%s" % self.job.get_job_id(),
+             "%s" % self.fed_step[self.job.get_job_id()]]),
+            data=None, files=files)
+        # print(response)
+        return RoundState.ROUND_TRAINED
 
 
 class TrainMPCDistillationStrategy(TrainDistillationStrategy):
@@ -600,66 +631,67 @@ class TrainMPCDistillationStrategy(TrainDistillationStrategy):
         self.server_url = server_url
         self.logger = LoggerFactory.getLogger("TrainMPCDistillationStrategy", logging.INFO)
 
-    def train(self):
-        while True:
-            if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
-                    self.job.get_job_id()) >= self.job.get_epoch():
-                final_pars_path = os.path.join(self.job_model_path, "models_{}".format(self.client_id),
-                                               "tmp_parameters_{}".format(self.fed_step.get(self.job.get_job_id()) + 1))
-                if os.path.exists(final_pars_path):
-                    self._save_final_parameters(self.job.get_job_id(), final_pars_path)
-                    self.logger.info("job_{} completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
-                if self.curve is True:
-                    self._draw_curve()
-                break
-            self._prepare_job_model(self.job)
-            self._prepare_job_init_model_pars(self.job, self.server_url)
-            job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
-            # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
-            response = requests.get("/".join([self.server_url, "otherclients", self.job.get_job_id()]))
-            connected_clients_id = response.json()['data']
-            for client_id in connected_clients_id:
-                self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(
-                    self.job.get_job_id()) is None else self.fed_step.get(self.job.get_job_id())
-                response = requests.get("/".join(
-                    [self.server_url, "otherparameters", '%s' % self.job.get_job_id(), '%s' % client_id,
-                     '%s' % (self.fed_step.get(self.job.get_job_id()) + 1)]))
-                parameter_path = os.path.join(job_models_path,
-                                              "tmp_parameters_{}".format(self.fed_step.get(self.job.get_job_id()) + 1))
-                if response.status_code == 202:
-                    self._write_bfile_to_local(response, parameter_path)
-            other_model_pars, _ = self._load_other_models_pars(self.job.get_job_id(),
-                                                               self.fed_step.get(self.job.get_job_id()))
-
+    def train_round(self):
+        if self.fed_step.get(self.job.get_job_id()) is not None and self.fed_step.get(
+                self.job.get_job_id()) >= self.job.get_epoch():
+            final_pars_path = os.path.join(self.job_model_path, "models_{}".format(self.client_id),
+                                           "tmp_parameters_{}".format(self.fed_step.get(self.job.get_job_id()) + 1))
+            if os.path.exists(final_pars_path):
+                self._save_final_parameters(self.job.get_job_id(), final_pars_path)
+                self.logger.info("job_{} completed, final accuracy: {}".format(self.job.get_job_id(), self.acc))
+            if self.curve is True:
+                self._draw_curve()
+            return RoundState.ROUND_DONE
+        self._prepare_job_model(self.job)
+        self._prepare_job_init_model_pars(self.job, self.server_url)
+        job_models_path = self._create_job_models_dir(self.client_id, self.job.get_job_id())
+        # job_model = self._load_job_model(self.job.get_job_id(), self.job.get_train_model_class_name())
+        response = requests.get("/".join([self.server_url, "otherclients", self.job.get_job_id()]))
+        connected_clients_id = response.json()['data']
+        for client_id in connected_clients_id:
+            self.fed_step[self.job.get_job_id()] = 0 if self.fed_step.get(
+                self.job.get_job_id()) is None else self.fed_step.get(self.job.get_job_id())
+            response = requests.get("/".join(
+                [self.server_url, "otherparameters", '%s' % self.job.get_job_id(), '%s' % client_id,
+                 '%s' % (self.fed_step.get(self.job.get_job_id()) + 1)]))
+            parameter_path = os.path.join(job_models_path,
+                                          "tmp_parameters_{}".format(self.fed_step.get(self.job.get_job_id()) + 1))
+            if response.status_code == 202:
+                self._write_bfile_to_local(response, parameter_path)
+        other_model_pars, _ = self._load_other_models_pars(self.job.get_job_id(),
+                                                           self.fed_step.get(self.job.get_job_id()))
+
+        if other_model_pars is not None and self._calc_rate(len(other_model_pars),
+                                                            len(connected_clients_id)) >= THRESHOLD:
             self.logger.info("job_{} is training, Aggregator strategy: {}, L2_dist: {}".format(self.job.get_job_id(),
                                                                                                self.job.get_aggregate_strategy(),
                                                                                                self.job.get_l2_dist()))
-            if other_model_pars is not None and self._calc_rate(len(other_model_pars),
-                                                                len(connected_clients_id)) >= THRESHOLD:
-
-                self.logger.info("model distillating....")
-                self.fed_step[self.job.get_job_id()] = self.fed_step.get(self.job.get_job_id()) + 1
-                self.acc, loss = self._train_with_distillation(self.model, other_model_pars, self.local_epoch,
-                                                               os.path.join(LOCAL_MODEL_BASE_PATH,
-                                                                            "models_{}".format(self.job.get_job_id()),
-                                                                            "models_{}".format(self.client_id)),
-                                                               self.job.get_l2_dist())
-                self.loss_list.append(loss)
-                self.accuracy_list.append(self.acc)
-                self.logger.info("model distillation success")
+            self.logger.info("model distillating....")
+            self.fed_step[self.job.get_job_id()] = self.fed_step.get(self.job.get_job_id()) + 1
+            self.acc, loss = self._train_with_distillation(self.model, other_model_pars, self.local_epoch,
+                                                           os.path.join(LOCAL_MODEL_BASE_PATH,
+                                                                        "models_{}".format(self.job.get_job_id()),
+                                                                        "models_{}".format(self.client_id)),
+                                                           self.job.get_l2_dist())
+            self.loss_list.append(loss)
+            self.accuracy_list.append(self.acc)
+            self.logger.info("model distillation success")
+            files = self._prepare_upload_client_model_pars(self.job.get_job_id(), self.client_id,
+                                                           self.fed_step.get(self.job.get_job_id()) + 1)
+            response = requests.post("/".join(
+                [self.server_url, "modelpars", "%s" % self.client_id, self.job.get_job_id(),
+                 "%s" % (self.fed_step.get(self.job.get_job_id()) + 1)]), data=None, files=files)
+            return RoundState.ROUND_TRAINED
+        else:
+            job_model_client_path = os.path.join(LOCAL_MODEL_BASE_PATH, "models_{}".format(self.job.get_job_id()),
+                                                 "models_{}".format(self.client_id))
+            if not os.path.exists(os.path.join(job_model_client_path, "tmp_parameters_{}".format(
+                    self.fed_step.get(self.job.get_job_id()) + 1))):
+                self._train(self.model, job_model_client_path, self.fed_step.get(self.job.get_job_id()) + 1, self.local_epoch)
                 files = self._prepare_upload_client_model_pars(self.job.get_job_id(), self.client_id,
                                                                self.fed_step.get(self.job.get_job_id()) + 1)
                 response = requests.post("/".join(
                     [self.server_url, "modelpars", "%s" % self.client_id, self.job.get_job_id(),
                      "%s" % (self.fed_step.get(self.job.get_job_id()) + 1)]), data=None, files=files)
-            else:
-                job_model_client_path = os.path.join(LOCAL_MODEL_BASE_PATH, "models_{}".format(self.job.get_job_id()),
-                                                     "models_{}".format(self.client_id))
-                if not os.path.exists(os.path.join(job_model_client_path, "tmp_parameters_{}".format(
-                        self.fed_step.get(self.job.get_job_id()) + 1))):
-                    self._train(self.model, job_model_client_path, self.fed_step.get(self.job.get_job_id()) + 1, self.local_epoch)
-                    files = self._prepare_upload_client_model_pars(self.job.get_job_id(), self.client_id,
-                                                                   self.fed_step.get(self.job.get_job_id()) + 1)
-                    response = requests.post("/".join(
-                        [self.server_url, "modelpars", "%s" % self.client_id, self.job.get_job_id(),
-                         "%s" % (self.fed_step.get(self.job.get_job_id()) + 1)]), data=None, files=files)
+                return RoundState.ROUND_TRAINED
+        return RoundState.ROUND_IDLE
@@ -18,6 +18,7 @@ import logging
 import threading
 from concurrent.futures import ThreadPoolExecutor
 from gfl.core import communicate_client
+from gfl.core.scheduler import RoundScheduler
 from gfl.exceptions.fl_expection import GFLException
 from gfl.utils.utils import JobUtils, LoggerFactory, ModelUtils
 from gfl.core.strategy import WorkModeStrategy, FederateStrategy
@@ -30,17 +31,23 @@ JOB_PATH = os.path.join(os.path.abspath("."), "res", "jobs_client")
 class TrainerController(object):
     """
     TrainerController is responsible for choosing a apprpriate train strategy for corresponding job
+
+    The rounds of all jobs are run by one RoundScheduler, at most concurrent_num at a time, a job waiting for
+    aggregated parameters holds no thread, it is polled with a backoff between min_backoff and max_backoff seconds
+    and woken up as soon as the parameters are received in cluster mode
     """
 
     def __init__(self, work_mode=WorkModeStrategy.WORKMODE_STANDALONE, models=None, data=None, client_id=0,
                  client_ip="",
-                 client_port=8081, server_url="", curve=False, local_epoch=5, concurrent_num=5):
+                 client_port=8081, server_url="", curve=False, local_epoch=5, concurrent_num=5, compression=None,
+                 min_backoff=0.5, max_backoff=10):
         self.work_mode = work_mode
         self.data = data
         self.client_id = str(client_id)
         self.local_epoch = local_epoch
         self.concurrent_num = concurrent_num
         self.trainer_executor_pool = ThreadPoolExecutor(self.concurrent_num)
+        self.scheduler = RoundScheduler(self.concurrent_num, min_backoff, max_backoff)
         self.job_path = JOB_PATH
         self.models = models
         self.fed_step = {}
@@ -49,6 +56,7 @@ class TrainerController(object):
         self.client_port = str(client_port)
         self.server_url = server_url
         self.curve = curve
+        self.compression = compression
         self.logger = LoggerFactory.getLogger("TrainerController", logging.INFO)
 
     def start(self):
@@ -59,6 +67,7 @@ class TrainerController(object):
                 "/".join([self.server_url, "register", self.client_ip, '%s' % self.client_port, '%s' % self.client_id]))
             response_json = response.json()
             if response_json['code'] == 200 or response_json['code'] == 201:
+                communicate_client.add_aggregate_pars_listener(self.scheduler.notify)
                 self.trainer_executor_pool.submit(communicate_client.start_communicate_client, self.client_ip,
                                                   self.client_port)
                 self._trainer_mpc_exec()
@@ -108,7 +117,7 @@ class TrainerController(object):
                     self.job_train_strategy[job.get_job_id()] = self.job_train_strategy[
                         job.get_job_id()] = TrainMPCNormalStrategy(job, self.data, self.fed_step, self.client_ip,
                                                                    self.client_port, self.server_url, self.client_id, self.local_epoch,
-                                                                   gfl_model, self.curve)
+                                                                   gfl_model, self.curve, self.compression)
                 else:
                     self.job_train_strategy[job.get_job_id()] = TrainMPCDistillationStrategy(job, self.data,
                                                                                              self.fed_step,
@@ -121,5 +130,13 @@ class TrainerController(object):
                 self.run(self.job_train_strategy.get(job.get_job_id()))
 
     def run(self, trainer):
-        trainer.train()
+        self.scheduler.schedule(trainer.job.get_job_id(), trainer.train_round)
+
+    def get_job_stats(self, job_id):
+        """
+        Training and idle time of a job, see RoundScheduler.get_stats
+        :param job_id:
+        :return:
+        """
+        return self.scheduler.get_stats(job_id)
 
@@ -0,0 +1,157 @@
+"""
+Bytes on the wire and round time of FedAvg with and without compressed parameter exchange
+
+Clients train the Net of mnist_demo or cifa10_demo on synthetic batches shaped like the demo data, every round
+their parameters are uploaded and the aggregated parameters broadcast through ParameterCodec exactly as the
+cluster mode does, the round time is estimated for the given bandwidth of the server link.
+
+    python benchmark_compression.py --model mnist --clients 10 --rounds 5 --bandwidth 100
+"""
+
+import os
+import time
+import argparse
+import importlib.util
+import torch
+import torch.nn.functional as F
+from gfl.core.aggregator import RunningAverage
+from gfl.core.strategy import CompressionStrategy, QuantizationStrategy, FramingStrategy
+from gfl.utils.compression import ParameterCodec
+
+DEMOS = {
+    "mnist": ("mnist_demo", (1, 28, 28)),
+    "cifar10": ("cifa10_demo", (3, 32, 32)),
+}
+
+
+def load_net(demo):
+    spec = importlib.util.spec_from_file_location(
+        "{}_fl_model".format(demo), os.path.join(os.path.dirname(os.path.abspath(__file__)), demo, "fl_model.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Net
+
+
+def local_train(net, model_pars, input_shape, local_steps, batch_size, seed):
+    model = net()
+    model.load_state_dict(model_pars)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    generator = torch.Generator().manual_seed(seed)
+    for _ in range(local_steps):
+        data = torch.randn((batch_size,) + input_shape, generator=generator)
+        label = torch.randint(0, 10, (batch_size,), generator=generator)
+        optimizer.zero_grad()
+        F.cross_entropy(model(data), label).backward()
+        optimizer.step()
+    return model.state_dict()
+
+
+def serialized_size(model_pars):
+    path = "benchmark_compression.tmp"
+    torch.save(model_pars, path)
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
+
+
+def run(net, input_shape, args, codec=None):
+    """
+    FedAvg rounds, with the exchange of parameters encoded by codec if not None
+    :return: final parameters and stats
+    """
+    torch.manual_seed(args.seed)
+    global_pars = net().state_dict()
+    raw_size = serialized_size(global_pars)
+    residuals = [{} for _ in range(args.clients)]
+    stats = {"upload": 0, "broadcast": 0, "encode": 0.0, "decode": 0.0, "train": 0.0}
+    for fed_step in range(args.rounds):
+        running_average = RunningAverage()
+        upload_sizes = []
+        for client in range(args.clients):
+            start = time.time()
+            model_pars = local_train(net, global_pars, input_shape, args.local_steps, args.batch_size,
+                                     args.seed + fed_step * args.clients + client)
+            stats["train"] += time.time() - start
+            if codec is None:
+                upload_sizes.append(raw_size)
+            else:
+                start = time.time()
+                data = codec.encode(model_pars, global_pars, residuals[client])
+                stats["encode"] += time.time() - start
+                start = time.time()
+                model_pars = ParameterCodec.decode(data, global_pars)
+                stats["decode"] += time.time() - start
+                upload_sizes.append(len(data))
+            running_average.add(client, model_pars)
+        avg_pars = running_average.average()
+        if codec is None:
+            broadcast_size = raw_size
+        else:
+            data = codec.encode(avg_pars, global_pars)
+            broadcast_size = len(data)
+            avg_pars = ParameterCodec.decode(data, global_pars)
+        global_pars = avg_pars
+        stats["upload"] += sum(upload_sizes)
+        stats["broadcast"] += broadcast_size * args.clients
+    stats["upload_per_client"] = stats["upload"] / (args.clients * args.rounds)
+    stats["broadcast_per_client"] = stats["broadcast"] / (args.clients * args.rounds)
+    return global_pars, stats
+
+
+def round_time(stats, args, concurrent):
+    """
+    seconds spent on the wire per round, the server link is the bottleneck, a sequential broadcast also waits
+    for one request latency per client
+    """
+    bytes_per_second = args.bandwidth * 1e6 / 8
+    upload = stats["upload_per_client"] * args.clients / bytes_per_second
+    broadcast = stats["broadcast_per_client"] * args.clients / bytes_per_second
+    latency = args.latency / 1000 * (1 if concurrent else args.clients)
+    return upload + broadcast + latency
+
+
+def drift(model_pars, reference_pars):
+    diff = sum(((model_pars[k].double() - reference_pars[k].double()) ** 2).sum().item()
+               for k in reference_pars if reference_pars[k].is_floating_point())
+    norm = sum((reference_pars[k].double() ** 2).sum().item()
+               for k in reference_pars if reference_pars[k].is_floating_point())
+    return (diff / norm) ** 0.5
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=sorted(DEMOS), default="mnist")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--local_steps", type=int, default=5)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--bandwidth", type=float, default=100, help="Mbit/s of the server link")
+    parser.add_argument("--latency", type=float, default=20, help="ms per request")
+    parser.add_argument("--topk_ratio", type=float, default=0.1)
+    parser.add_argument("--framing", choices=[f.value for f in FramingStrategy], default="zlib")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    demo, input_shape = DEMOS[args.model]
+    net = load_net(demo)
+    framing = FramingStrategy(args.framing)
+    settings = [
+        ("raw", None),
+        ("fp16", CompressionStrategy(QuantizationStrategy.QUANT_FP16, framing=framing)),
+        ("int8", CompressionStrategy(QuantizationStrategy.QUANT_INT8, framing=framing)),
+        ("int8+top{}".format(args.topk_ratio),
+         CompressionStrategy(QuantizationStrategy.QUANT_INT8, args.topk_ratio, framing=framing)),
+    ]
+    reference_pars = None
+    print("{:<16}{:>14}{:>14}{:>10}{:>12}{:>12}{:>14}{:>14}{:>10}".format(
+        "setting", "upload B", "broadcast B", "ratio", "encode s", "decode s", "round s seq", "round s conc",
+        "drift"))
+    for name, compression in settings:
+        codec = ParameterCodec(compression) if compression is not None else None
+        model_pars, stats = run(net, input_shape, args, codec)
+        if reference_pars is None:
+            reference_pars, raw_stats = model_pars, stats
+        ratio = (raw_stats["upload"] + raw_stats["broadcast"]) / (stats["upload"] + stats["broadcast"])
+        print("{:<16}{:>14.0f}{:>14.0f}{:>10.1f}{:>12.3f}{:>12.3f}{:>14.3f}{:>14.3f}{:>10.2e}".format(
+            name, stats["upload_per_client"], stats["broadcast_per_client"], ratio, stats["encode"], stats["decode"],
+            round_time(stats, args, False), round_time(stats, args, True), drift(model_pars, reference_pars)))
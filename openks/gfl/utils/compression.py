@@ -0,0 +1,155 @@
+# Copyright (c) 2019 GalaxyLearning Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import zlib
+import pickle
+import torch
+from gfl.exceptions.fl_expection import GFLException
+from gfl.core.strategy import QuantizationStrategy, FramingStrategy
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"GFLP"
+FRAMING_IDS = {FramingStrategy.FRAME_NONE: 0, FramingStrategy.FRAME_ZLIB: 1, FramingStrategy.FRAME_ZSTD: 2}
+
+
+class ParameterCodec(object):
+    """
+    ParameterCodec encodes model parameters according to a CompressionStrategy, encoded parameters are
+    self-describing so that decode needs nothing but the parameters the receiver already holds
+    """
+
+    def __init__(self, compression_strategy):
+        self.quantization = compression_strategy.get_quantization()
+        self.topk_ratio = compression_strategy.get_topk_ratio()
+        self.framing = compression_strategy.get_framing()
+        self.level = compression_strategy.get_level()
+        if self.framing == FramingStrategy.FRAME_ZSTD and zstandard is None:
+            raise GFLException("zstd framing needs the zstandard package")
+
+    def encode(self, model_pars, base_model_pars=None, residual=None):
+        """
+        Encode model parameters
+        :param model_pars: state_dict to send
+        :param base_model_pars: state_dict held by the receiver, floating point parameters are sent as deltas against it
+        :param residual: error left by the former encodings of the sender, added to the parameters sent and updated
+        in place (error feedback)
+        :return: bytes
+        """
+        entries = {}
+        for key, par in model_pars.items():
+            par = par.detach().cpu()
+            if not par.is_floating_point():
+                entries[key] = {"dtype": par.dtype, "shape": tuple(par.shape), "raw": par.numpy()}
+                continue
+            work_dtype = torch.float64 if par.dtype == torch.float64 else torch.float32
+            value = par.to(work_dtype).reshape(-1)
+            is_delta = base_model_pars is not None and key in base_model_pars
+            if is_delta:
+                value = value - base_model_pars[key].detach().cpu().to(work_dtype).reshape(-1)
+            if residual is not None and key in residual:
+                value = value + residual[key]
+            entry = {"dtype": par.dtype, "shape": tuple(par.shape), "delta": is_delta}
+            sent = value
+            if self.topk_ratio is not None and self.topk_ratio < 1 and value.numel() > 0:
+                k = max(1, int(math.ceil(value.numel() * self.topk_ratio)))
+                indices = torch.topk(value.abs(), k, sorted=False).indices
+                entry["indices"] = indices.to(torch.int32).numpy()
+                sent = value[indices]
+            entry.update(self._quantize(sent))
+            if residual is not None:
+                error = value.clone()
+                if "indices" in entry:
+                    error[indices] -= self._dequantize(entry, work_dtype)
+                else:
+                    error -= self._dequantize(entry, work_dtype)
+                residual[key] = error
+            entries[key] = entry
+        payload = pickle.dumps(entries, protocol=4)
+        return MAGIC + bytes([FRAMING_IDS[self.framing]]) + self._compress(payload)
+
+    @staticmethod
+    def decode(data, base_model_pars=None):
+        """
+        Decode parameters encoded by encode
+        :param data: bytes
+        :param base_model_pars: state_dict the deltas were taken against
+        :return: state_dict
+        """
+        if not ParameterCodec.is_encoded(data):
+            raise GFLException("data are not encoded model parameters")
+        entries = pickle.loads(ParameterCodec._decompress(data[len(MAGIC)], data[len(MAGIC) + 1:]))
+        model_pars = {}
+        for key, entry in entries.items():
+            if "raw" in entry:
+                model_pars[key] = torch.from_numpy(entry["raw"]).reshape(entry["shape"])
+                continue
+            work_dtype = torch.float64 if entry["dtype"] == torch.float64 else torch.float32
+            sent = ParameterCodec._dequantize(entry, work_dtype)
+            if "indices" in entry:
+                value = torch.zeros(int(torch.Size(entry["shape"]).numel()), dtype=work_dtype)
+                value[torch.from_numpy(entry["indices"]).long()] = sent
+            else:
+                value = sent
+            value = value.reshape(entry["shape"])
+            if entry["delta"]:
+                if base_model_pars is None or key not in base_model_pars:
+                    raise GFLException("base parameters of {} are needed to decode its delta".format(key))
+                value = value + base_model_pars[key].detach().cpu().to(work_dtype)
+            model_pars[key] = value.to(entry["dtype"])
+        return model_pars
+
+    @staticmethod
+    def is_encoded(data):
+        return data[:len(MAGIC)] == MAGIC
+
+    def _quantize(self, value):
+        if self.quantization == QuantizationStrategy.QUANT_FP16:
+            return {"quantization": "fp16", "values": value.half().numpy()}
+        if self.quantization == QuantizationStrategy.QUANT_INT8:
+            # symmetric per tensor scale
+            scale = value.abs().max().item() / 127 if value.numel() > 0 else 0
+            scale = scale if scale > 0 else 1.0
+            values = torch.clamp(torch.round(value / scale), -127, 127).to(torch.int8)
+            return {"quantization": "int8", "values": values.numpy(), "scale": scale}
+        return {"quantization": "none", "values": value.numpy()}
+
+    @staticmethod
+    def _dequantize(entry, work_dtype):
+        values = torch.from_numpy(entry["values"]).to(work_dtype)
+        if entry["quantization"] == "int8":
+            values = values * entry["scale"]
+        return values
+
+    def _compress(self, payload):
+        if self.framing == FramingStrategy.FRAME_ZLIB:
+            return zlib.compress(payload, 6 if self.level is None else self.level)
+        if self.framing == FramingStrategy.FRAME_ZSTD:
+            return zstandard.ZstdCompressor(level=3 if self.level is None else self.level).compress(payload)
+        return payload
+
+    @staticmethod
+    def _decompress(framing_id, payload):
+        if framing_id == FRAMING_IDS[FramingStrategy.FRAME_ZLIB]:
+            return zlib.decompress(payload)
+        if framing_id == FRAMING_IDS[FramingStrategy.FRAME_ZSTD]:
+            if zstandard is None:
+                raise GFLException("zstd framed parameters need the zstandard package")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        return payload
@@ -111,6 +111,21 @@ class ModelUtils(object):
                 return model
         return None
 
+    @staticmethod
+    def get_aggregate_pars_path(base_model_path, job_id, fed_step):
+        """
+        Path of the parameters aggregated in the fed_step-th round, the initial parameters for round 0
+        :param base_model_path:
+        :param job_id:
+        :param fed_step:
+        :return:
+        """
+        job_model_dir = os.path.join(base_model_path, "models_{}".format(job_id))
+        aggregate_pars_path = os.path.join(job_model_dir, "tmp_aggregate_pars", "avg_pars_{}".format(fed_step))
+        if fed_step == 0 and not os.path.exists(aggregate_pars_path):
+            return os.path.join(job_model_dir, "init_model_pars_{}".format(job_id))
+        return aggregate_pars_path
+
 
 class JobEncoder(json.JSONEncoder):
 
@@ -172,6 +187,22 @@ class LoggerFactory(object):
         logger.addHandler(console_handler)
         return logger
 
+    @staticmethod
+    def log_future_exception(logger, description):
+        """
+        Done callback of a future nobody waits for, logs the exception it raised with its traceback
+        :param logger:
+        :param description: what the future was doing
+        :return:
+        """
+        def callback(future):
+            if future.cancelled():
+                return
+            e = future.exception()
+            if e is not None:
+                logger.error("{} failed: {}".format(description, e), exc_info=(type(e), e, e.__traceback__))
+        return callback
+
 
 class CyclicTimer(threading.Timer):
     def run(self):
@@ -5,6 +5,8 @@
 init
 """
 from .loader import *
+from .row_sources import *
+from .neo4j_export import *
 from .graph_loader import *
 
 from .graph_loader_notkg import *
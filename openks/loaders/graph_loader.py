@@ -8,9 +8,12 @@ import os
 import json
 from zipfile import ZipFile
 import logging
-from py2neo import Graph,Node
 from .loader import Loader, LoaderConfig, SourceType, FileType
 from ..abstract.mtg import MTG
+from ..abstract.mmd import MMD
+from ..abstract.columnar_mtg import ColumnarMTG
+from ..abstract.snapshot import save_snapshot, load_snapshot, read_snapshot_meta
+from .neo4j_export import Neo4jBulkExporter, write_admin_csv, admin_import_command
 import pdb
 
 logger = logging.getLogger(__name__)
@@ -25,12 +28,57 @@ class GraphLoader(Loader):
 	def __init__(
 		self, 
 		config: LoaderConfig, 
-		graph_name: str = ''
+		graph_name: str = '',
+		columnar: bool = False,
+		snapshot_dir: str = None
 		) -> None:
-		super(GraphLoader, self).__init__(config)
-		self.graph = self._load_data()
+		# build an array-backed ColumnarMTG instead of tuple lists, only for the OpenKS graph format,
+		# always done for streaming configs
+		self.columnar = columnar
+		# a binary MTG snapshot is written here after parsing and memory-mapped on later runs over unchanged sources,
+		# the graph is still a tuple based MTG then unless it is columnar
+		self.snapshot_dir = snapshot_dir
+		signature = self._source_signature(config) if snapshot_dir else None
+		if snapshot_dir and self._snapshot_matches(signature):
+			self.config = config
+			self.dataset = MMD(name=config.data_name)
+			self.graph = load_snapshot(snapshot_dir, mmap=True)
+			if not (self.columnar or config.streaming):
+				# same type as a parsed graph, tuple lists callers may mutate
+				self.graph = self.graph.to_mtg()
+			logger.info("Loaded graph from snapshot {}.".format(snapshot_dir))
+		else:
+			super(GraphLoader, self).__init__(config)
+			self.graph = self._load_data()
+			if snapshot_dir and self.graph is not None and self.config.file_type == FileType.OPENKS:
+				save_snapshot(self.graph, snapshot_dir, extra={'source': signature})
 		self.graph.name = graph_name if graph_name else config.data_name
 
+	@staticmethod
+	def _source_signature(config: LoaderConfig) -> list:
+		""" name, size and modification time of every source file, used to detect stale snapshots """
+		uris = config.source_uris
+		if isinstance(uris, str) and os.path.isdir(uris):
+			paths = [os.path.join(uris, name) for name in sorted(os.listdir(uris))]
+		else:
+			paths = [uris] if isinstance(uris, str) else list(uris)
+		signature = []
+		for path in paths:
+			if os.path.isfile(path):
+				stat = os.stat(path)
+				signature.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+		return signature
+
+	def _snapshot_matches(self, signature: list) -> bool:
+		if not os.path.exists(os.path.join(self.snapshot_dir, 'meta.json')):
+			return False
+		try:
+			meta = read_snapshot_meta(self.snapshot_dir)
+		except ValueError as e:
+			logger.warn("Ignored snapshot {}: {}".format(self.snapshot_dir, e))
+			return False
+		return meta['extra'].get('source') == signature
+
 	def _load_data(self) -> MTG:
 		""" 
 		transform MMD from _read_data method to MTG. 
@@ -239,16 +287,20 @@ class GraphLoader(Loader):
 			if os.path.exists(self.config.source_uris + '/schema.json'):
 				with open(self.config.source_uris + '/schema.json', 'r') as f:
 					schema = json.load(f)
-				for entity in self.dataset.bodies[0]:
-					if len(entity) == 2:
-						entities.append((int(entity[0]), entity[1], tuple([])))
-					else:
-						entities.append((int(entity[0]), entity[1], tuple(entity[2:])))
-				for relation in self.dataset.bodies[1]:
-					if len(relation) == 3:
-						relations.append(((int(relation[0]), relation[1], int(relation[2])), tuple([])))
-					else:
-						relations.append(((int(relation[0]), relation[1], int(relation[2])), tuple(relation[3:])))
+				entities = (
+					(int(entity[0]), entity[1], tuple(entity[2:]))
+					for entity in self.dataset.bodies[0]
+				)
+				relations = (
+					((int(relation[0]), relation[1], int(relation[2])), tuple(relation[3:]))
+					for relation in self.dataset.bodies[1]
+				)
+				if self.columnar or self.config.streaming:
+					# rows are converted into columns chunk by chunk without building the tuple lists,
+					# streamed bodies always go there so the full table is never held as Python tuples
+					return ColumnarMTG(schema=schema, entities=entities, triples=relations, chunk_size=self.config.chunk_size)
+				entities = list(entities)
+				relations = list(relations)
 
 			else:
 				logger.warn("A schema JSON file must exists!")
@@ -259,7 +311,11 @@ class GraphLoader(Loader):
 		mtg.triples = relations
 		return mtg
 
-	def graph2neo(self, graph: MTG, graph_db, clean=True):
+	def graph2neo(self, graph: MTG, graph_db, clean=True, batch_size: int = 5000):
+		"""
+		import graph into Neo4j in batches of batch_size nodes or edges, see Neo4jBulkExporter
+		graph_db: py2neo Graph, or any object with the same run/begin/commit methods
+		"""
 		create = True
 		if len(graph_db.nodes) > 0:
 			if clean:
@@ -269,39 +325,14 @@ class GraphLoader(Loader):
 				create = False
 				logger.info("Graph contains nodes and edges and no new nodes will be imported.")
 		if create:
-			# create neo4j nodes
-			count = 0
-			for item in graph.entities:
-				props = [struct['properties'] for struct in graph.schema if struct['type'] == 'entity' and struct['concept'] == item[1]]
-				prop_names = [prop['name'] for prop in props[0]]
-				prop_names.append('gid')
-				prop_values = list(item[2])
-				prop_values.append(item[0])
-				prop_dict = dict(zip(prop_names, prop_values))
-				node = Node(item[1], **prop_dict)
-				graph_db.create(node)
-				count += 1
-				if count % 1000 == 0:
-					logger.info("Already imported nodes %d, total nodes %d" % (count, len(graph.entities)))
-			# create neo4j edges
-			start_node = ''
-			end_node = ''
-			count = 0
-			for item in graph.triples:
-				p = item[0][0]
-				q = item[0][2]
-				rel_type = item[0][1]
-				rel_name = item[1][0] if item[1] else rel_type
-				for struct in graph.schema:
-					if struct['concept'] == item[0][1] and struct['type'] == 'relation':
-						start_node = struct['members'][0]
-						end_node = struct['members'][1]
-				query = "match(p:%s),(q:%s) where p.gid=%d and q.gid=%d create (p)-[rel:%s{name:'%s'}]->(q)" % (start_node, end_node, p, q, rel_type, rel_name)
-				try:
-					graph_db.run(query)
-					count += 1
-					if count % 1000 == 0:
-						logger.info("Already imported edges %d, total edges %d, current relation type %s" % (count, len(graph.triples), rel_type))
-				except Exception as e:
-					print(e)
+			Neo4jBulkExporter(graph_db, batch_size=batch_size).export(graph)
 		return None
+
+	def graph2csv(self, graph: MTG, out_dir: str, database: str = 'neo4j') -> list:
+		"""
+		write graph as neo4j-admin import CSV files into out_dir for offline bulk loading,
+		return the neo4j-admin command importing them into an empty database
+		"""
+		command = admin_import_command(write_admin_csv(graph, out_dir), database)
+		logger.info("Wrote neo4j-admin import files to {}, import with: {}".format(out_dir, ' '.join(command)))
+		return command
@@ -12,7 +12,10 @@ from io import TextIOWrapper
 import json
 import logging
 import os
+from functools import partial
 from ..abstract.mmd import MMD
+from ..abstract.chunked import ChunkedReader
+from .row_sources import new_spill_path, zip_csv_rows, csv_rows, delimited_rows
 
 logger = logging.getLogger(__name__)
 
@@ -58,7 +61,10 @@ class LoaderConfig(object):
 		file_type: FileType = FileType.CSV,
 		source_uris: List = [], 
 		data_name: str = '',
-		graph_db = None
+		graph_db = None,
+		streaming: bool = False,
+		chunk_size: int = 10000,
+		spill_dir: str = None
 		) -> None:
 		self._source_type = source_type
 		self._file_type = file_type
@@ -66,6 +72,10 @@ class LoaderConfig(object):
 		self._source_uri = source_uris
 		self._data_name = data_name
 		self._graph_db = graph_db
+		# streaming mode keeps MMD bodies as lazy ChunkedReader objects instead of lists of rows
+		self._streaming = streaming
+		self._chunk_size = chunk_size
+		self._spill_dir = spill_dir
 
 	@property
 	def source_type(self):
@@ -107,6 +117,30 @@ class LoaderConfig(object):
 	def graph_db(self, graph_db: str):
 		self._graph_db = graph_db
 
+	@property
+	def streaming(self):
+		return self._streaming
+
+	@streaming.setter
+	def streaming(self, streaming: bool):
+		self._streaming = streaming
+
+	@property
+	def chunk_size(self):
+		return self._chunk_size
+
+	@chunk_size.setter
+	def chunk_size(self, chunk_size: int):
+		self._chunk_size = chunk_size
+
+	@property
+	def spill_dir(self):
+		return self._spill_dir
+
+	@spill_dir.setter
+	def spill_dir(self, spill_dir: str):
+		self._spill_dir = spill_dir
+
 
 loader_config = LoaderConfig()
 mmd = MMD()
@@ -137,7 +171,9 @@ class Loader(object):
 		    support *.csv and *labels.csv files either in a zip file or directly in a folder """
 		headers = []
 		bodies = []
-		if self.config.file_type == FileType.CSV:
+		if self.config.streaming and self.config.file_type in [FileType.CSV, FileType.OPENKS]:
+			headers, bodies = self._read_files_streaming()
+		elif self.config.file_type == FileType.CSV:
 			if self.config.source_uris.endswith('.zip'):
 				with ZipFile(self.config.source_uris) as zf:
 					for item in zf.namelist():
@@ -229,6 +265,47 @@ class Loader(object):
 		mmd.bodies = bodies
 		return mmd
 
+	def _chunked_reader(self, opener, name: str) -> ChunkedReader:
+		return ChunkedReader(
+			opener,
+			chunk_size=self.config.chunk_size,
+			spill_path=new_spill_path(self.config.spill_dir, name)
+		)
+
+	def _read_files_streaming(self):
+		""" Same layouts as _read_files for CSV and OPENKS file types, 
+		    but only headers are read eagerly and each body is a lazy ChunkedReader """
+		headers = []
+		bodies = []
+		uris = self.config.source_uris
+		if self.config.file_type == FileType.CSV:
+			if uris.endswith('.zip'):
+				with ZipFile(uris) as zf:
+					for item in zf.namelist():
+						if item.endswith('.csv'):
+							with TextIOWrapper(zf.open(item, 'r'), 'utf-8') as infile:
+								headers.append(next(csv.reader(infile)))
+							name = os.path.splitext(os.path.basename(item))[0]
+							bodies.append(self._chunked_reader(partial(zip_csv_rows, uris, item), name))
+			elif uris.endswith('.csv'):
+				# a single CSV file
+				with open(uris, newline='', encoding='utf-8') as infile:
+					headers.append(next(csv.reader(infile)))
+				name = os.path.splitext(os.path.basename(uris))[0]
+				bodies.append(self._chunked_reader(partial(csv_rows, uris), name))
+		elif self.config.file_type == FileType.OPENKS:
+			if os.path.exists(uris + '/entities') and os.path.exists(uris + '/triples'):
+				files, delimiter = ['entities', 'triples'], '\t'
+			elif os.path.exists(uris + '/train') and os.path.exists(uris + '/valid'):
+				files, delimiter = ['train', 'valid'], '@@'
+			else:
+				logger.warn('Only allows loading with entities and triples for now!')
+				raise IOError
+			for file in files:
+				headers.append([file])
+				bodies.append(self._chunked_reader(partial(delimited_rows, uris + '/' + file, delimiter), file))
+		return headers, bodies
+
 	def _read_neo4j(self, graph_db) -> MMD:
 		headers = []
 		bodies = []
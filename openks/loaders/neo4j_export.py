@@ -0,0 +1,200 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Bulk export of MTG into Neo4j, either online through batched parameterized Cypher or offline as neo4j-admin import CSVs
+"""
+import csv
+import logging
+import os
+from typing import Dict, List, Tuple
+from ..abstract.mtg import MTG
+
+logger = logging.getLogger(__name__)
+
+
+def _quote(name: str) -> str:
+	""" labels and relationship types cannot be query parameters, they are escaped as identifiers instead """
+	return '`' + str(name).replace('`', '``') + '`'
+
+
+class GraphSchemaLookup(object):
+	"""
+	Schema information needed for export, built once from graph.schema instead of scanning it per entity or triple
+	"""
+	def __init__(self, schema: List) -> None:
+		self.entity_props = {}
+		self.relation_members = {}
+		for struct in schema:
+			if struct['type'] == 'entity':
+				# the first definition of a concept wins, as in the former per-entity scan
+				self.entity_props.setdefault(struct['concept'], [prop['name'] for prop in struct.get('properties', [])])
+			elif struct['type'] == 'relation':
+				# the last definition of a relation wins, as in the former per-triple scan
+				self.relation_members[struct['concept']] = (struct['members'][0], struct['members'][1])
+
+	def node_properties(self, entity: Tuple) -> Dict:
+		props = dict(zip(self.entity_props.get(entity[1], []), entity[2]))
+		props['gid'] = entity[0]
+		return props
+
+	def members(self, relation: str) -> Tuple[str, str]:
+		if relation not in self.relation_members:
+			raise KeyError("Relation {} is not defined in the graph schema.".format(relation))
+		return self.relation_members[relation]
+
+
+class Neo4jBulkExporter(object):
+	"""
+	Writes an MTG into Neo4j with UNWIND batches:
+	nodes are grouped by label and edges by (relation, start label, end label),
+	each batch of batch_size rows is sent as one parameterized query inside its own explicit transaction,
+	and a gid index is created for every label before any edge is matched.
+
+	graph_db only needs run(query, parameters) and either begin() (py2neo Graph)
+	or begin_transaction() (neo4j driver Session), so a mock object is enough for testing.
+	"""
+	def __init__(self, graph_db, batch_size: int = 5000, log_every: int = 100000) -> None:
+		self.graph_db = graph_db
+		self.batch_size = batch_size
+		self.log_every = log_every
+
+	def _begin(self):
+		if hasattr(self.graph_db, 'begin_transaction'):
+			return self.graph_db.begin_transaction()
+		return self.graph_db.begin()
+
+	def _commit(self, tx) -> None:
+		# py2neo 2021 commits through the graph, older py2neo and the neo4j driver through the transaction
+		if hasattr(self.graph_db, 'commit'):
+			self.graph_db.commit(tx)
+		else:
+			tx.commit()
+
+	def _rollback(self, tx) -> None:
+		if hasattr(self.graph_db, 'rollback'):
+			self.graph_db.rollback(tx)
+		else:
+			tx.rollback()
+
+	def run_batch(self, query: str, rows: List[Dict]) -> None:
+		tx = self._begin()
+		try:
+			tx.run(query, {'rows': rows})
+		except Exception:
+			self._rollback(tx)
+			raise
+		self._commit(tx)
+
+	def create_indexes(self, labels) -> None:
+		for label in labels:
+			try:
+				self.graph_db.run("CREATE INDEX IF NOT EXISTS FOR (n:%s) ON (n.gid)" % _quote(label))
+			except Exception:
+				# Neo4j before 4.0 only knows the old index syntax
+				self.graph_db.run("CREATE INDEX ON :%s(gid)" % _quote(label))
+		try:
+			self.graph_db.run("CALL db.awaitIndexes()")
+		except Exception as e:
+			logger.warn("Could not wait for indexes to come online: {}".format(e))
+
+	@staticmethod
+	def node_query(label: str) -> str:
+		return "UNWIND $rows AS row CREATE (n:%s) SET n = row" % _quote(label)
+
+	@staticmethod
+	def edge_query(rel_type: str, start_label: str, end_label: str) -> str:
+		return (
+			"UNWIND $rows AS row "
+			"MATCH (p:%s {gid: row.p}), (q:%s {gid: row.q}) "
+			"CREATE (p)-[rel:%s {name: row.name}]->(q)"
+		) % (_quote(start_label), _quote(end_label), _quote(rel_type))
+
+	def export_nodes(self, graph: MTG, lookup: GraphSchemaLookup) -> int:
+		pending = {}
+		count = 0
+		for entity in graph.entities:
+			rows = pending.setdefault(entity[1], [])
+			rows.append(lookup.node_properties(entity))
+			if len(rows) >= self.batch_size:
+				self.run_batch(self.node_query(entity[1]), rows)
+				pending[entity[1]] = []
+			count += 1
+			if count % self.log_every == 0:
+				logger.info("Already imported nodes %d, total nodes %d" % (count, graph.get_entity_num()))
+		for label, rows in pending.items():
+			if rows:
+				self.run_batch(self.node_query(label), rows)
+		return count
+
+	def export_edges(self, graph: MTG, lookup: GraphSchemaLookup) -> int:
+		pending = {}
+		count = 0
+		for (head, rel_type, tail), attrs in graph.triples:
+			key = (rel_type,) + lookup.members(rel_type)
+			rows = pending.setdefault(key, [])
+			rows.append({'p': head, 'q': tail, 'name': attrs[0] if attrs else rel_type})
+			if len(rows) >= self.batch_size:
+				self.run_batch(self.edge_query(*key), rows)
+				pending[key] = []
+			count += 1
+			if count % self.log_every == 0:
+				logger.info("Already imported edges %d, total edges %d, current relation type %s" % (count, graph.get_triple_num(), rel_type))
+		for key, rows in pending.items():
+			if rows:
+				self.run_batch(self.edge_query(*key), rows)
+		return count
+
+	def export(self, graph: MTG) -> Tuple[int, int]:
+		""" return the number of exported nodes and edges """
+		lookup = GraphSchemaLookup(graph.schema)
+		labels = set(lookup.entity_props) | set(member for members in lookup.relation_members.values() for member in members)
+		self.create_indexes(sorted(labels))
+		nodes = self.export_nodes(graph, lookup)
+		edges = self.export_edges(graph, lookup)
+		logger.info("Imported %d nodes and %d edges." % (nodes, edges))
+		return nodes, edges
+
+
+def write_admin_csv(graph: MTG, out_dir: str) -> Dict[str, List[str]]:
+	"""
+	write neo4j-admin import files, one nodes CSV per label and one relationships CSV per relation type.
+	gid is the node id, so the import has to use --id-type=INTEGER.
+	return the written files as {'nodes': [...], 'relationships': [...]}
+	"""
+	lookup = GraphSchemaLookup(graph.schema)
+	if not os.path.exists(out_dir):
+		os.makedirs(out_dir)
+	files, writers = {}, {}
+	paths = {'nodes': [], 'relationships': []}
+
+	def writer_of(kind: str, name: str, header: List[str]):
+		if (kind, name) not in writers:
+			path = os.path.join(out_dir, '{}_{}.csv'.format(kind, name))
+			files[(kind, name)] = open(path, 'w', newline='', encoding='utf-8')
+			writers[(kind, name)] = csv.writer(files[(kind, name)])
+			writers[(kind, name)].writerow(header)
+			paths[kind].append(path)
+		return writers[(kind, name)]
+
+	try:
+		for gid, label, attrs in graph.entities:
+			props = lookup.entity_props.get(label, [])
+			row = [gid] + [attrs[i] if i < len(attrs) else '' for i in range(len(props))] + [label]
+			writer_of('nodes', label, ['gid:ID'] + props + [':LABEL']).writerow(row)
+		for (head, rel_type, tail), attrs in graph.triples:
+			writer_of('relationships', rel_type, [':START_ID', ':END_ID', 'name', ':TYPE']).writerow(
+				[head, tail, attrs[0] if attrs else rel_type, rel_type]
+			)
+	finally:
+		for f in files.values():
+			f.close()
+	return paths
+
+
+def admin_import_command(paths: Dict[str, List[str]], database: str = 'neo4j') -> List[str]:
+	""" neo4j-admin (4.x) arguments importing the files of write_admin_csv into an empty database """
+	command = ['neo4j-admin', 'import', '--database={}'.format(database), '--id-type=INTEGER']
+	command += ['--nodes={}'.format(path) for path in paths['nodes']]
+	command += ['--relationships={}'.format(path) for path in paths['relationships']]
+	return command
@@ -0,0 +1,49 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University.
+# All Rights Reserved.
+
+"""
+Row sources over local files, used by the streaming mode of Loader
+"""
+import csv
+import os
+import tempfile
+from zipfile import ZipFile
+from io import TextIOWrapper
+from typing import Iterator, List
+
+
+def new_spill_path(spill_dir: str, name: str) -> str:
+	""" a fresh spill file in spill_dir, or None when spilling is disabled """
+	if not spill_dir:
+		return None
+	if not os.path.exists(spill_dir):
+		os.makedirs(spill_dir)
+	fd, path = tempfile.mkstemp(prefix=name + '-', suffix='.chunks', dir=spill_dir)
+	os.close(fd)
+	return path
+
+
+def zip_csv_rows(zip_path: str, item: str) -> Iterator[List]:
+	""" rows of a csv file inside a zip file, without the header line """
+	with ZipFile(zip_path) as zf:
+		with TextIOWrapper(zf.open(item, 'r'), 'utf-8') as infile:
+			csv_reader = csv.reader(infile)
+			next(csv_reader, None)
+			for row in csv_reader:
+				yield row
+
+
+def csv_rows(path: str) -> Iterator[List]:
+	""" rows of a local csv file, without the header line """
+	with open(path, newline='', encoding='utf-8') as infile:
+		csv_reader = csv.reader(infile)
+		next(csv_reader, None)
+		for row in csv_reader:
+			yield row
+
+
+def delimited_rows(path: str, delimiter: str = '\t') -> Iterator[tuple]:
+	""" stripped fields of each line of a delimited text file, as used by the OpenKS graph format """
+	with open(path, 'r') as load_f:
+		for line in load_f:
+			yield tuple([item.strip() for item in line.split(delimiter)])
@@ -2,19 +2,136 @@
 # All Rights Reserved.
 
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 import numpy as np
 import onnx
 import onnxruntime as ort
 
 
+class _MicroBatcher(object):
+    """
+    Coalesces concurrent predict_batch calls on one model into a single session run.
+    Requests are collected until max_batch_size rows are queued or max_wait_ms has passed since the first one,
+    inputs are concatenated along the first axis and the outputs are split back per request.
+    """
+
+    def __init__(self, loader, model_name, max_batch_size, max_wait_ms):
+        self.loader = loader
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        # models exported with a fixed first dimension cannot be concatenated and are run per request
+        shapes = loader.get_model_shape(model_name)
+        self.batchable = all(not shape or not isinstance(shape[0], int) for shape in shapes)
+        self.thread = threading.Thread(target=self._loop, name='onnx-batcher-' + model_name, daemon=True)
+        self.thread.start()
+
+    def submit(self, model_input):
+        rows = len(next(iter(model_input.values())))
+        future = Future()
+        self.requests.put((model_input, rows, future))
+        return future
+
+    def close(self):
+        self.requests.put(None)
+
+    def _collect(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = first[1]
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self.requests.put(None)
+                break
+            batch.append(request)
+            rows += request[1]
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                session = self.loader.get_session(self.model_name)
+                if self.batchable and len(batch) > 1:
+                    names = list(batch[0][0].keys())
+                    merged = {name: np.concatenate([request[0][name] for request in batch], axis=0) for name in names}
+                    outputs = session.run(None, merged)
+                    offsets = np.cumsum([request[1] for request in batch])[:-1]
+                    parts = [np.split(output, offsets) for output in outputs]
+                    for index, request in enumerate(batch):
+                        request[2].set_result([part[index] for part in parts])
+                else:
+                    for request in batch:
+                        request[2].set_result(session.run(None, request[0]))
+            except Exception as e:
+                for request in batch:
+                    if not request[2].done():
+                        request[2].set_exception(e)
+
+
 class ModelLoader(object):
+    """
+    Loads ONNX models from the market directory.
+    Inference sessions are kept in an LRU pool of at most max_sessions models, created with the configured
+    intra/inter-op thread counts, and model IO metadata is parsed once per model file.
+    predict_batch coalesces concurrent small requests on the same model into one session run.
+    """
 
-    def __init__(self, market_path='openks/market/trained_models'):
+    def __init__(self, market_path='openks/market/trained_models', max_sessions=4,
+                 intra_op_num_threads=None, inter_op_num_threads=None, max_batch_size=64, max_wait_ms=5):
         self.market_path = market_path
+        self.max_sessions = max_sessions
+        self.intra_op_num_threads = intra_op_num_threads
+        self.inter_op_num_threads = inter_op_num_threads
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._sessions = OrderedDict()
+        self._metadata = {}
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+    def _model_path(self, model_name):
+        return os.path.join(self.market_path, model_name)
+
+    def get_session(self, model_name):
+        with self._lock:
+            if model_name in self._sessions:
+                self._sessions.move_to_end(model_name)
+                return self._sessions[model_name]
+        options = ort.SessionOptions()
+        if self.intra_op_num_threads:
+            options.intra_op_num_threads = self.intra_op_num_threads
+        if self.inter_op_num_threads:
+            options.inter_op_num_threads = self.inter_op_num_threads
+        # created outside the lock, loading a large model should not block requests on other models
+        session = ort.InferenceSession(self._model_path(model_name), sess_options=options)
+        with self._lock:
+            session = self._sessions.setdefault(model_name, session)
+            self._sessions.move_to_end(model_name)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
 
     def check_model(self, model_name):
         # Load the ONNX model
-        model = onnx.load(os.path.join(self.market_path, model_name))
+        model = onnx.load(self._model_path(model_name))
 
         # Check that the model is well formed
         onnx.checker.check_model(model)
@@ -24,13 +141,39 @@ class ModelLoader(object):
 
 
     def use_model(self, model_name, model_input):
-        ort_session = ort.InferenceSession(os.path.join(self.market_path, model_name))
+        ort_session = self.get_session(model_name)
         outputs = ort_session.run(
             None,
             model_input,
         )
         return outputs[0]
 
+    def predict_batch(self, model_name, model_input):
+        """
+        Same result as use_model, but requests arriving from several threads within max_wait_ms
+        are stacked along the first axis and served by a single run call
+        """
+        with self._lock:
+            batcher = self._batchers.get(model_name)
+        if batcher is None:
+            batcher = _MicroBatcher(self, model_name, self.max_batch_size, self.max_wait_ms)
+            with self._lock:
+                if model_name in self._batchers:
+                    batcher.close()
+                    batcher = self._batchers[model_name]
+                else:
+                    self._batchers[model_name] = batcher
+        return batcher.submit(model_input).result()[0]
+
+    def close(self):
+        """ stop the batching threads and release all sessions """
+        with self._lock:
+            for batcher in self._batchers.values():
+                batcher.close()
+            self._batchers.clear()
+            self._sessions.clear()
+            self._metadata.clear()
+
     def list_models(self):
         print('Trained models in market:')
         for item in os.listdir(self.market_path):
@@ -38,8 +181,21 @@ class ModelLoader(object):
                 print(item)
         print('-------------------------------')
 
-    def get_model_shape(self, model_name):
-        model = onnx.load(os.path.join(self.market_path, model_name))
+    def _get_metadata(self, model_name):
+        path = self._model_path(model_name)
+        mtime = os.path.getmtime(path)
+        # one entry per model, replaced when the file is rewritten, so reloads do not grow the cache
+        with self._lock:
+            cached = self._metadata.get(model_name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        metadata = self._parse_metadata(onnx.load(path))
+        with self._lock:
+            self._metadata[model_name] = (mtime, metadata)
+        return metadata
+
+    @staticmethod
+    def _parse_metadata(model):
         model_shape = []
         for input in model.graph.input:
             shape = []
@@ -55,15 +211,15 @@ class ModelLoader(object):
             else:
                 print ("Unknown shape")
             model_shape.append(shape)
-        return model_shape
-
-    def get_model_io_names(self, model_name):
-        model = onnx.load(os.path.join(self.market_path, model_name))
         input_all = [node.name for node in model.graph.input]
         input_initializer =  [node.name for node in model.graph.initializer]
         input_names = list(set(input_all)  - set(input_initializer))
         output_names =[node.name for node in model.graph.output]
-        return input_names, output_names
-
+        return {'shape': model_shape, 'input_names': input_names, 'output_names': output_names}
 
+    def get_model_shape(self, model_name):
+        return [list(shape) for shape in self._get_metadata(model_name)['shape']]
 
+    def get_model_io_names(self, model_name):
+        metadata = self._get_metadata(model_name)
+        return list(metadata['input_names']), list(metadata['output_names'])
@@ -3,9 +3,70 @@
 
 """
 init
+
+Framework packages (paddle, tensorflow, mllib, pytorch) are imported lazily:
+models are registered below by module path and imported on OpenKSModel.get_module,
+other names are looked up in the framework packages on first access.
 """
+from ..common.register import lazy_exports
 from .model import *
-from .paddle import *
-from .tensorflow import *
-from .mllib import *
-from .pytorch import *
+
+# (name, platform, module, class) of the registered models
+_LAZY_MODELS = [
+	('KGLearn', 'Paddle', '.paddle.kg_learn', 'KGLearnPaddle'),
+	('KELearn', 'Paddle', '.paddle.ke_learn', 'KELearnPaddle'),
+	('TransE', 'Paddle', '.paddle.kg_modules.TransE', 'TransE'),
+	('TransR', 'Paddle', '.paddle.kg_modules.TransR', 'TransR'),
+	('GCN', 'Paddle', '.paddle.kg_modules.GCN', 'GCN'),
+	('entity-extract', 'Paddle', '.paddle.ke_modules.entity_extract', 'EntityExtract'),
+	('Ner', 'Paddle', '.paddle.ner', 'NerPaddle'),
+	('Relation_Extraction', 'Paddle', '.paddle.relation_extraction', 'Relation_ExtractionPaddle'),
+	('HypernymDiscovery', 'Paddle', '.paddle.hypernym_discovery', 'HypernymDiscoveryPaddle'),
+	('HypernymExtract', 'Paddle', '.paddle.hypernym_extract', 'HypernymExtractPaddle'),
+	('Event_Extraction', 'Paddle', '.paddle.event_extraction', 'Event_ExtractionPaddle'),
+	('Causality_Extraction', 'Paddle', '.paddle.causality_extraction', 'Causality_ExtractionPaddle'),
+
+	('KELearn', 'TensorFlow', '.tensorflow.ke_learn', 'KELearnTorch'),
+	('recommendation', 'TensorFlow', '.tensorflow.rec_learn', 'RecTF'),
+	('industry-entity-extract', 'TensorFlow', '.tensorflow.ke_modules.industry_entity_extract', 'IndustryEntityExtract'),
+	('GCNRec', 'TensorFlow', '.tensorflow.rec_modules.gcn_rec', 'GCNRec'),
+
+	('KELearn', 'MLLib', '.mllib.ke_learn', 'KELearnMLLib'),
+	('keyphrase-rake', 'MLLib', '.mllib.ke_modules.keyphrase_extract', 'Rake'),
+	('keyphrase-rake-topic', 'MLLib', '.mllib.ke_modules.keyphrase_extract', 'TopicRake'),
+
+	('KGLearn', 'PyTorch', '.pytorch.kg_learn', 'KGLearnTorch'),
+	('KGLearn_Dy', 'PyTorch', '.pytorch.kg_learn', 'KGLearn_DyTorch'),
+	('KGLearn_GCN', 'PyTorch', '.pytorch.kg_learn', 'KGLearn_GCNTorch'),
+	('KELearn', 'PyTorch', '.pytorch.ke_learn', 'KELearnTorch'),
+	('KGC1Learn', 'PyTorch', '.pytorch.kgc1_learn', 'KGC1LearnTorch'),
+	('KGC2Learn', 'PyTorch', '.pytorch.kgc2_learn', 'KGC2LearnTorch'),
+	('TransE', 'PyTorch', '.pytorch.kg_modules.TransE', 'TransE'),
+	('TransH', 'PyTorch', '.pytorch.kg_modules.TransH', 'TransH'),
+	('TransR', 'PyTorch', '.pytorch.kg_modules.TransR', 'TransR'),
+	('RotatE', 'PyTorch', '.pytorch.kg_modules.RotatE', 'RotatE'),
+	('UnsupervisedGCN', 'PyTorch', '.pytorch.kg_modules.gcn', 'UnsupervisedGCN'),
+	('GraphEncoder', 'PyTorch', '.pytorch.kg_modules.graph_encoder', 'GraphEncoder'),
+	('TransE-dist', 'PyTorch', '.pytorch.kg_modules.TransE_dist', 'TransE'),
+	('AttInter', 'PyTorch', '.pytorch.kg_modules.attn_interaction', 'AttInter'),
+	('entity-extract', 'PyTorch', '.pytorch.ke_modules.entity_extract', 'EntityExtract'),
+	('question-embedding', 'PyTorch', '.pytorch.ke_modules.question_embedding', 'QuestionEmbedding'),
+	('KGC1', 'PyTorch', '.pytorch.kgc1_modules.KGC1', 'KGC1'),
+	('KGC2', 'PyTorch', '.pytorch.kgc2_modules.KGC2', 'KGC2'),
+	('KGLearn-dist', 'PyTorch', '.pytorch.kg_learn_dist', 'KGLearnTorch'),
+	('3DJCG', 'PyTorch', '.pytorch.threedjcg_learn', 'VisionLanguage3DJCGTorch'),
+	('3DGQA', 'PyTorch', '.pytorch.threedgqa_learn', 'VisionLanguage3DGQATorch'),
+	('3DVG', 'PyTorch', '.pytorch.threedvg_learn', 'VisualGrounding3DVGTorch'),
+	('VisualRelation', 'PyTorch', '.pytorch.visual_relation_learn', 'VisualRelationTorch'),
+	('HOI', 'PyTorch', '.pytorch.hoi_learn', 'VisualRelationTorch'),
+	('STVGBert', 'PyTorch', '.pytorch.stvgbert_learn', 'VisualRelationTorch'),
+	('openie', 'PyTorch', '.pytorch.mimo_learn', 'openie_learn'),
+	('HGTExpertRec', 'PyTorch', '.pytorch.hgt_expert_rec', 'HGTExpertRec'),
+	('Person_Relation', 'PyTorch', '.pytorch.person_relation_learn', 'VisualRelationTorch'),
+]
+
+for _name, _platform, _module, _attr in _LAZY_MODELS:
+	OpenKSModel.register_lazy(_name, _platform, __name__ + _module, _attr)
+
+# torch_model goes last so that its base classes are found without importing the whole pytorch package
+__getattr__ = lazy_exports(__name__, ['.paddle', '.tensorflow', '.mllib', '.pytorch', '.torch_model'])
@@ -3,6 +3,14 @@
 
 """
 init
+
+submodules are imported on first access of one of their names, see openks.common.register.lazy_exports
 """
-from .ke_learn import *
-from .ke_modules import *
\ No newline at end of file
+from ...common.register import lazy_exports
+
+_SUBMODULES = [
+	'.ke_learn',
+	'.ke_modules',
+]
+
+__getattr__ = lazy_exports(__name__, _SUBMODULES)
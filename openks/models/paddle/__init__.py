@@ -3,18 +3,25 @@
 
 """
 init
+
+submodules are imported on first access of one of their names, see openks.common.register.lazy_exports
 """
-from .kg_learn import *
-from .ke_learn import *
-from .kg_modules import *
-from .ke_modules import *
+from ...common.register import lazy_exports
+
+_SUBMODULES = [
+	'.kg_learn',
+	'.ke_learn',
+	'.kg_modules',
+	'.ke_modules',
 
-from .ner import *
-from .relation_extraction import *
+	'.ner',
+	'.relation_extraction',
 
-from .hypernym_discovery import *
-from .hypernym_extract import *
+	'.hypernym_discovery',
+	'.hypernym_extract',
 
-from .event_extraction import *
-from .causality_extraction import *
+	'.event_extraction',
+	'.causality_extraction',
+]
 
+__getattr__ = lazy_exports(__name__, _SUBMODULES)
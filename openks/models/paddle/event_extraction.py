@@ -8,6 +8,8 @@ import os
 import json
 import warnings
 import random
+import queue
+import threading
 from functools import partial
 
 import numpy as np
@@ -116,25 +118,6 @@ def data_dealer(path, task_type):
             assert False, "wrong task type"
     return text_list, label_ids_list, segment_list
 
-def predict_data_dealer(path, data_type):
-    corpus = [json.loads(line.strip()) for line in open(path, 'r', encoding='utf-8').readlines()]
-    text_list = []
-    segment_list = []
-    for item in corpus:
-        text = item['text']
-        if data_type == 'trigger':
-            segment_ids = [0] * len(text)
-            text_list.append(text)
-            segment_list.append(segment_ids)
-        elif data_type == 'argument':
-            for event in item['event_list']:
-                segment_ids = [0] * len(text)
-                for l in range(event['trigger_start_index'], event['trigger_start_index'] + len(event['trigger'])):
-                    segment_ids[l] = 1
-                text_list.append(text)
-                segment_list.append(segment_ids)
-    return text_list, segment_list
-
 def pred2formot(pred, sent):
     temp_list = []
     temp = [None, -1, -1, None]
@@ -286,9 +269,8 @@ def do_train(args, task_type):
         paddle.save(model.state_dict(), '{}/{}.final.pdparams'.format(args.checkpoints, task_type))
 
 
-def do_predict(args, task_type):
-    paddle.set_device(args.device)
-    tokenizer = ErnieTokenizer.from_pretrained("ernie-1.0")
+def load_predict_model(args, task_type):
+    """load the trigger or argument model of a checkpoint for prediction"""
     trigger_dict, role_dict = schema_loader(args.tag_path)
     if task_type == 'trigger':
         label_map = trigger_dict
@@ -296,92 +278,191 @@ def do_predict(args, task_type):
     elif task_type == 'argument':
         label_map = role_dict
         pretrained_model_path = args.init_argument_ckpt
+    else:
+        assert False, "wrong task type"
     model = ErnieForTokenClassification.from_pretrained("ernie-1.0", num_classes=len(label_map))
     id2label = {val: key for key, val in label_map.items()}
-    no_entity_label = "O"
-    ignore_label = len(label_map)
-
-    print("============start predict==========")
     if not pretrained_model_path or not os.path.isfile(pretrained_model_path):
         raise Exception("init checkpoints {} not exist".format(pretrained_model_path))
     else:
         state_dict = paddle.load(pretrained_model_path)
         model.set_dict(state_dict)
         print("Loaded parameters from %s" % pretrained_model_path)
+    model.eval()
+    return model, id2label
 
-    # load data from predict file
-    if task_type == 'trigger':
-        pred_data = args.predict_data
-    elif task_type == 'argument':
-        pred_data = args.predict_temp_save_path
-    else:
-        assert False, "wrong task type"
-    sentences, segments = predict_data_dealer(pred_data, task_type)
-    encoded_inputs_list = []
-    for sent, segment in zip(sentences, segments):
-        input_ids, token_type_ids, seq_len = convert_example_to_feature([list(sent), [], segment], tokenizer,
-                    max_seq_len=args.max_seq_len, is_test=True)
-        encoded_inputs_list.append((input_ids, token_type_ids, seq_len))
 
+def read_jsonl(path, batch_size):
+    """lines of a json lines file, parsed and grouped into lists of batch_size"""
+    batch = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+@paddle.no_grad()
+def predict_labels(model, tokenizer, id2label, sentences, segments, max_seq_len, batch_size):
+    """predicted label of every character of the sentences, segments mark the trigger of argument examples"""
     batchify_fn = lambda samples, fn=Tuple(
         Pad(axis=0, pad_val=tokenizer.vocab[tokenizer.pad_token], dtype='int32'), # input_ids
         Pad(axis=0, pad_val=tokenizer.vocab[tokenizer.pad_token], dtype='int32'), # token_type_ids
         Stack(dtype='int64') # sequence lens
     ): fn(samples)
-    # Seperates data into some batches.
-    batch_encoded_inputs = [encoded_inputs_list[i: i + args.batch_size]
-                            for i in range(0, len(encoded_inputs_list), args.batch_size)]
     results = []
-    model.eval()
-    for batch in batch_encoded_inputs:
+    for start in range(0, len(sentences), batch_size):
+        batch = [convert_example_to_feature([list(sent), [], segment], tokenizer, max_seq_len=max_seq_len, is_test=True)
+                 for sent, segment in zip(sentences[start: start + batch_size], segments[start: start + batch_size])]
         input_ids, token_type_ids, seq_lens = batchify_fn(batch)
-        input_ids = paddle.to_tensor(input_ids)
-        token_type_ids = paddle.to_tensor(token_type_ids)
-        logits = model(input_ids, token_type_ids)
-        probs = F.softmax(logits, axis=-1)
-        probs_ids = paddle.argmax(probs, -1).numpy()
-        probs = probs.numpy()
-        for p_list, p_ids, seq_len in zip(probs.tolist(), probs_ids.tolist(), seq_lens.tolist()):
-            prob_one = [p_list[index][pid] for index, pid in enumerate(p_ids[1: seq_len - 1])]
-            label_one = [id2label[pid] for pid in p_ids[1: seq_len - 1]]
-            results.append({"probs": prob_one, "labels": label_one})
-    assert len(results) == len(sentences)
-    print("============start write==========")
-    write_data = []
+        logits = model(paddle.to_tensor(input_ids), paddle.to_tensor(token_type_ids))
+        # softmax keeps the order of the logits
+        probs_ids = paddle.argmax(logits, -1).numpy()
+        for p_ids, seq_len in zip(probs_ids.tolist(), seq_lens.tolist()):
+            results.append([id2label[pid] for pid in p_ids[1: seq_len - 1]])
+    return results
+
+
+def predict_triggers(model, tokenizer, id2label, items, args):
+    """predict the events of items read from the predict data, their arguments are left empty"""
+    sentences = [item['text'] for item in items]
+    labels_list = predict_labels(model, tokenizer, id2label, sentences, [[0] * len(sent) for sent in sentences],
+                                 args.max_seq_len, args.batch_size)
+    trigger_items = []
+    for sent, labels in zip(sentences, labels_list):
+        temp = {'text': sent, 'event_list': []}
+        for item in pred2formot(labels, sent):
+            trigger = {"event_type": item[0], "trigger": item[3], "trigger_start_index": item[1], "arguments": []}
+            temp['event_list'].append(trigger)
+        trigger_items.append(temp)
+    return trigger_items
+
+
+def predict_arguments(model, tokenizer, id2label, items, args):
+    """fill in the arguments of the events of items in place, one argument example per event"""
+    events, sentences, segments = [], [], []
+    for item in items:
+        text = item['text']
+        for event in item['event_list']:
+            segment_ids = [0] * len(text)
+            for l in range(event['trigger_start_index'], event['trigger_start_index'] + len(event['trigger'])):
+                segment_ids[l] = 1
+            events.append(event)
+            sentences.append(text)
+            segments.append(segment_ids)
+    labels_list = predict_labels(model, tokenizer, id2label, sentences, segments, args.max_seq_len, args.batch_size)
+    # every example belongs to the event it was built from, no need to match texts
+    for event, sent, labels in zip(events, sentences, labels_list):
+        for argument_item in pred2formot(labels, sent):
+            argument = {"role": argument_item[0], "argument": argument_item[3], "argument_start_index": argument_item[1]}
+            event['arguments'].append(argument)
+    return len(events)
+
+
+def write_jsonl(outfile, items):
+    for item in items:
+        outfile.write(json.dumps(item, ensure_ascii=False) + "\n")
+    outfile.flush()
+
+
+def do_predict(args, task_type):
+    """run one model over a file, triggers of args.predict_data or arguments of args.predict_temp_save_path"""
+    paddle.set_device(args.device)
+    tokenizer = ErnieTokenizer.from_pretrained("ernie-1.0")
+    model, id2label = load_predict_model(args, task_type)
+
+    print("============start predict==========")
+    count, event_count = 0, 0
     if task_type == 'trigger':
-        for sent, ret in zip(sentences, results):
-            temp = {'text':sent, 'event_list': []}
-            event_list = pred2formot(ret['labels'], sent)
-            for item in event_list:
-                trigger = {"event_type": item[0], "trigger": item[3], "trigger_start_index": item[1], "arguments":[]}
-                temp['event_list'].append(trigger)
-            write_data.append(temp)
-        write_data = [json.dumps(sent, ensure_ascii=False) for sent in write_data]
-        with open(args.predict_temp_save_path, "w") as outfile:
-            [outfile.write(d + "\n") for d in write_data]
-        print("save data {} to {}".format(len(sentences), args.predict_temp_save_path))
+        with open(args.predict_temp_save_path, "w", encoding='utf-8') as outfile:
+            for items in read_jsonl(args.predict_data, args.batch_size):
+                write_jsonl(outfile, predict_triggers(model, tokenizer, id2label, items, args))
+                count += len(items)
+        print("save data {} to {}".format(count, args.predict_temp_save_path))
     elif task_type == 'argument':
-        trigger_data = [json.loads(line.strip()) for line in open(args.predict_temp_save_path, 'r', encoding='utf-8').readlines()]
-        count = 0
-        for item in trigger_data:
-            for sent, ret, segment in zip(sentences, results, segments):
-                if item['text'] == sent:
-                    count += 1
-                    for event in item['event_list']:
-                        if segment[event['trigger_start_index']] == 1 and segment[event['trigger_start_index'] + len(event['trigger']) - 1] == 1:
-                            arguments_list = pred2formot(ret['labels'], sent)
-                            for argument_item in arguments_list:
-                                argument = {"role": argument_item[0], "argument": argument_item[3], "argument_start_index": argument_item[1]}
-                                event['arguments'].append(argument)
-            write_data.append(item)
-        write_data = [json.dumps(sent, ensure_ascii=False) for sent in write_data]
-        with open(args.predict_save_path, "w") as outfile:
-            [outfile.write(d + "\n") for d in write_data]
-        print("save data {} to {}".format(len(sentences), args.predict_save_path))
-        print(count)
+        with open(args.predict_save_path, "w", encoding='utf-8') as outfile:
+            for items in read_jsonl(args.predict_temp_save_path, args.batch_size):
+                event_count += predict_arguments(model, tokenizer, id2label, items, args)
+                write_jsonl(outfile, items)
+                count += len(items)
+        print("save data {} to {}".format(count, args.predict_save_path))
+        print(event_count)
     else:
         assert False, "wrong task type"
 
+
+def do_predict_pipeline(args, concurrent=True, prefetch=4):
+    """
+    predict triggers then arguments of args.predict_data in one pass, batch by batch
+
+    The events of a batch are written to args.predict_save_path, and to args.predict_temp_save_path without
+    arguments, as soon as its arguments are predicted. With concurrent, the triggers of the next batches are
+    predicted in a thread while the arguments of the former batch are, at most prefetch batches ahead.
+    """
+    paddle.set_device(args.device)
+    tokenizer = ErnieTokenizer.from_pretrained("ernie-1.0")
+    trigger_model, trigger_id2label = load_predict_model(args, 'trigger')
+    argument_model, argument_id2label = load_predict_model(args, 'argument')
+
+    def trigger_batches():
+        for items in read_jsonl(args.predict_data, args.batch_size):
+            yield predict_triggers(trigger_model, tokenizer, trigger_id2label, items, args)
+
+    def prefetched(batches):
+        done = object()
+        batch_queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def produce():
+            # the device is a setting of the thread
+            paddle.set_device(args.device)
+            try:
+                for batch in batches:
+                    if stop.is_set():
+                        return
+                    batch_queue.put(batch)
+            except Exception as e:
+                batch_queue.put(e)
+            batch_queue.put(done)
+
+        thread = threading.Thread(target=produce, name="trigger-predict", daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batch_queue.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            # unblock the producer so that it sees stop
+            while thread.is_alive():
+                try:
+                    batch_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    print("============start predict==========")
+    batches = prefetched(trigger_batches()) if concurrent else trigger_batches()
+    count, event_count = 0, 0
+    with open(args.predict_temp_save_path, "w", encoding='utf-8') as temp_file, \
+            open(args.predict_save_path, "w", encoding='utf-8') as outfile:
+        for items in batches:
+            temp_file.write("".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items))
+            event_count += predict_arguments(argument_model, tokenizer, argument_id2label, items, args)
+            write_jsonl(outfile, items)
+            count += len(items)
+    print("save data {} to {}".format(count, args.predict_save_path))
+    print(event_count)
+
+
 @Event_ExtractionModel.register("Event_Extraction","Paddle")
 class Event_ExtractionPaddle(Event_ExtractionModel):
     '''Base class for event extract trainer'''
@@ -396,5 +477,4 @@ class Event_ExtractionPaddle(Event_ExtractionModel):
         do_train(self.args, task_type='argument')
 
     def pred(self):
-        do_predict(self.args, task_type='trigger')
-        do_predict(self.args, task_type='argument')
+        do_predict_pipeline(self.args)
@@ -11,6 +11,9 @@ import re
 from tqdm import tqdm
 import sys
 import io
+import shutil
+import hashlib
+import multiprocessing
 
 import collections
 from typing import Optional, List, Union, Dict
@@ -295,12 +298,12 @@ InputFeature = collections.namedtuple("InputFeature", [
 ])
 
 
-def parse_label(spo_list, label_map, tokens, tokenizer):
-    # 2 tags for each predicate + I tag + O tag
-    num_labels = 2 * (len(label_map.keys()) - 2) + 2
+def parse_label_indices(spo_list, label_map, tokens, tokenizer):
+    """
+    (token index, tag) of every "B"/"I" tag of the entities of spo_list, and the "O" tag of tokens without one
+    """
     seq_len = len(tokens)
-    # initialize tag
-    labels = [[0] * num_labels for i in range(seq_len)]
+    label_indices = []
     #  find all entities and tag them with corresponding "B"/"I" labels
     for spo in spo_list:
         for spo_object in spo['object'].keys():
@@ -330,33 +333,33 @@ def parse_label(spo_list, label_map, tokens, tokenizer):
                 for index in range(seq_len - subject_tokens_len + 1):
                     if tokens[index:index +
                               subject_tokens_len] == subject_tokens:
-                        labels[index][label_subject] = 1
+                        label_indices.append((index, label_subject))
                         for i in range(subject_tokens_len - 1):
-                            labels[index + i + 1][1] = 1
+                            label_indices.append((index + i + 1, 1))
                         forbidden_index = index
                         break
 
                 for index in range(seq_len - object_tokens_len + 1):
                     if tokens[index:index + object_tokens_len] == object_tokens:
                         if forbidden_index is None:
-                            labels[index][label_object] = 1
+                            label_indices.append((index, label_object))
                             for i in range(object_tokens_len - 1):
-                                labels[index + i + 1][1] = 1
+                                label_indices.append((index + i + 1, 1))
                             break
                         # check if labeled already
                         elif index < forbidden_index or index >= forbidden_index + len(
                                 subject_tokens):
-                            labels[index][label_object] = 1
+                            label_indices.append((index, label_object))
                             for i in range(object_tokens_len - 1):
-                                labels[index + i + 1][1] = 1
+                                label_indices.append((index + i + 1, 1))
                             break
 
             else:
                 for index in range(seq_len - object_tokens_len + 1):
                     if tokens[index:index + object_tokens_len] == object_tokens:
-                        labels[index][label_object] = 1
+                        label_indices.append((index, label_object))
                         for i in range(object_tokens_len - 1):
-                            labels[index + i + 1][1] = 1
+                            label_indices.append((index + i + 1, 1))
                         forbidden_index = index
                         break
 
@@ -364,32 +367,53 @@ def parse_label(spo_list, label_map, tokens, tokenizer):
                     if tokens[index:index +
                               subject_tokens_len] == subject_tokens:
                         if forbidden_index is None:
-                            labels[index][label_subject] = 1
+                            label_indices.append((index, label_subject))
                             for i in range(subject_tokens_len - 1):
-                                labels[index + i + 1][1] = 1
+                                label_indices.append((index + i + 1, 1))
                             break
                         elif index < forbidden_index or index >= forbidden_index + len(
                                 object_tokens):
-                            labels[index][label_subject] = 1
+                            label_indices.append((index, label_subject))
                             for i in range(subject_tokens_len - 1):
-                                labels[index + i + 1][1] = 1
+                                label_indices.append((index + i + 1, 1))
                             break
 
     # if token wasn't assigned as any "B"/"I" tag, give it an "O" tag for outside
-    for i in range(seq_len):
-        if labels[i] == [0] * num_labels:
-            labels[i][0] = 1
+    tagged = set(index for index, _ in label_indices)
+    label_indices.extend((index, 0) for index in range(seq_len) if index not in tagged)
+    return np.array(label_indices, dtype=np.int32).reshape(-1, 2)
+
 
+def densify_labels(label_indices, seq_len, num_labels, dtype=np.int64):
+    """
+    seq_len x num_labels multi-hot labels of (token index, tag) pairs, rows after the last tagged one are
+    padding and get the "O" tag
+    """
+    labels = np.zeros((seq_len, num_labels), dtype=dtype)
+    labels[label_indices[:, 0], label_indices[:, 1]] = 1
+    labels[label_indices[:, 0].max() + 1 if len(label_indices) else 0:, 0] = 1
     return labels
 
 
+def parse_label(spo_list, label_map, tokens, tokenizer):
+    # 2 tags for each predicate + I tag + O tag
+    num_labels = 2 * (len(label_map.keys()) - 2) + 2
+    label_indices = parse_label_indices(spo_list, label_map, tokens, tokenizer)
+    return densify_labels(label_indices, len(tokens), num_labels).tolist()
+
+
 def convert_example_to_feature(
         example,
         tokenizer: BertTokenizer,
         chineseandpunctuationextractor: ChineseAndPunctuationExtractor,
         label_map,
         max_length: Optional[int]=512,
-        pad_to_max_length: Optional[bool]=None):
+        pad_to_max_length: Optional[bool]=None,
+        sparse_labels: bool=False):
+    """
+    with sparse_labels, labels are the (token index, tag) pairs of the "B"/"I" tags instead of the
+    max_length x num_labels multi-hot array, see densify_labels
+    """
     spo_list = example['spo_list'] if "spo_list" in example.keys() else None
     text_raw = example['text']
 
@@ -428,27 +452,27 @@ def convert_example_to_feature(
     seq_len = len(tokens)
     # 2 tags for each predicate + I tag + O tag
     num_labels = 2 * (len(label_map.keys()) - 2) + 2
-    # initialize tag
-    labels = [[0] * num_labels for i in range(seq_len)]
+    label_indices = np.zeros((0, 2), dtype=np.int32)
     if spo_list is not None:
-        labels = parse_label(spo_list, label_map, tokens, tokenizer)
+        label_indices = parse_label_indices(spo_list, label_map, tokens, tokenizer)
 
     # add [CLS] and [SEP] token, they are tagged into "O" for outside
     if seq_len > max_length - 2:
         tokens = tokens[0:(max_length - 2)]
-        labels = labels[0:(max_length - 2)]
+        label_indices = label_indices[label_indices[:, 0] < max_length - 2]
         tok_to_orig_start_index = tok_to_orig_start_index[0:(max_length - 2)]
         tok_to_orig_end_index = tok_to_orig_end_index[0:(max_length - 2)]
     tokens = ["[CLS]"] + tokens + ["[SEP]"]
-    # "O" tag for [PAD], [CLS], [SEP] token
-    outside_label = [[1] + [0] * (num_labels - 1)]
+    # token indexes after [CLS], "O" tag for [CLS], [SEP] token, [PAD] tokens get it in densify_labels
+    label_indices = np.concatenate([
+        [[0, 0]], label_indices + np.array([1, 0], dtype=np.int32),
+        [[len(tokens) - 1, 0]]
+    ]).astype(np.int32)
 
-    labels = outside_label + labels + outside_label
     tok_to_orig_start_index = [-1] + tok_to_orig_start_index + [-1]
     tok_to_orig_end_index = [-1] + tok_to_orig_end_index + [-1]
     if seq_len < max_length:
         tokens = tokens + ["[PAD]"] * (max_length - seq_len - 2)
-        labels = labels + outside_label * (max_length - len(labels))
         tok_to_orig_start_index = tok_to_orig_start_index + [-1] * (
             max_length - len(tok_to_orig_start_index))
         tok_to_orig_end_index = tok_to_orig_end_index + [-1] * (
@@ -461,12 +485,116 @@ def convert_example_to_feature(
         seq_len=np.array(seq_len),
         tok_to_orig_start_index=np.array(tok_to_orig_start_index),
         tok_to_orig_end_index=np.array(tok_to_orig_end_index),
-        labels=np.array(labels), )
+        labels=label_indices if sparse_labels else densify_labels(label_indices, len(tokens), num_labels), )
+
+
+class RaggedArray(object):
+    """
+    rows of different lengths stored back to back, the i-th row is values[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_rows(cls, rows, dtype=None):
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(row) for row in rows])
+        if len(rows):
+            values = np.concatenate([np.asarray(row) for row in rows])
+        else:
+            values = np.zeros(0)
+        return cls(values if dtype is None else values.astype(dtype), offsets)
+
+    @classmethod
+    def concatenate(cls, arrays):
+        values = np.concatenate([array.values for array in arrays])
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for array in arrays:
+            offsets.append(array.offsets[1:] + offsets[-1][-1])
+        return cls(values, np.concatenate(offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        return self.values[self.offsets[item]:self.offsets[item + 1]]
+
+
+# set in every preprocessing process by _init_featurize_worker
+_featurize_args = None
+
+
+def _init_featurize_worker(tokenizer, label_map, max_length):
+    global _featurize_args
+    _featurize_args = (tokenizer, ChineseAndPunctuationExtractor(), label_map, max_length)
+
+
+def _featurize_lines(lines):
+    """
+    features of a chunk of lines of a DuIE file, without padding and with sparse labels
+    """
+    tokenizer, chineseandpunctuationextractor, label_map, max_length = _featurize_args
+    input_ids, seq_lens, tok_to_orig_start_index, tok_to_orig_end_index, labels = (
+        [] for _ in range(5))
+    for line in lines:
+        input_feature = convert_example_to_feature(
+            json.loads(line), tokenizer, chineseandpunctuationextractor,
+            label_map, max_length, sparse_labels=True)
+        # [CLS] tokens [SEP]
+        length = int(input_feature.seq_len) + 2
+        input_ids.append(input_feature.input_ids[:length])
+        seq_lens.append(input_feature.seq_len)
+        tok_to_orig_start_index.append(input_feature.tok_to_orig_start_index[:length])
+        tok_to_orig_end_index.append(input_feature.tok_to_orig_end_index[:length])
+        labels.append(input_feature.labels)
+    return (RaggedArray.from_rows(input_ids, np.int32),
+            np.array(seq_lens, dtype=np.int32),
+            RaggedArray.from_rows(tok_to_orig_start_index, np.int32),
+            RaggedArray.from_rows(tok_to_orig_end_index, np.int32),
+            RaggedArray.from_rows(labels, np.int32))
+
+
+def _line_chunks(file_path, chunk_size):
+    with open(file_path, "r", encoding="utf-8") as fp:
+        chunk = []
+        for line in fp:
+            if not line.strip():
+                continue
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _features_cache_key(file_path, tokenizer, label_map, max_length):
+    """
+    digest of the data file and of everything its features depend on
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(block)
+    vocab = getattr(tokenizer, "vocab", {})
+    vocab = getattr(vocab, "token_to_idx", vocab)
+    basic_tokenizer = getattr(tokenizer, "basic_tokenizer", tokenizer)
+    digest.update(json.dumps([
+        type(tokenizer).__name__, sorted(dict(vocab).items()),
+        getattr(basic_tokenizer, "do_lower_case", None), label_map, max_length
+    ], ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
 
 #数据集
 class DuIEDataset(paddle.io.Dataset):
     """
     Dataset of DuIE.
+
+    Built by from_file, the features are RaggedArray rows without padding and the labels are sparse
+    (token index, tag) pairs, rows are padded to max_length here and labels densified by DataCollator
     """
 
     def __init__(
@@ -475,7 +603,10 @@ class DuIEDataset(paddle.io.Dataset):
             seq_lens: List[Union[List[int], np.ndarray]],
             tok_to_orig_start_index: List[Union[List[int], np.ndarray]],
             tok_to_orig_end_index: List[Union[List[int], np.ndarray]],
-            labels: List[Union[List[int], np.ndarray, List[str], List[Dict]]]):
+            labels: List[Union[List[int], np.ndarray, List[str], List[Dict]]],
+            max_length: Optional[int]=None,
+            num_labels: Optional[int]=None,
+            pad_token_id: int=0):
         super(DuIEDataset, self).__init__()
 
         self.input_ids = input_ids
@@ -483,6 +614,11 @@ class DuIEDataset(paddle.io.Dataset):
         self.tok_to_orig_start_index = tok_to_orig_start_index
         self.tok_to_orig_end_index = tok_to_orig_end_index
         self.labels = labels
+        # rows are padded to max_length if set
+        self.max_length = max_length
+        # labels are (token index, tag) pairs if set
+        self.num_labels = num_labels
+        self.pad_token_id = pad_token_id
 
     def __len__(self):
         if isinstance(self.input_ids, np.ndarray):
@@ -490,24 +626,79 @@ class DuIEDataset(paddle.io.Dataset):
         else:
             return len(self.input_ids)
 
+    def _pad(self, row, value):
+        # rows are stored as int32, batches keep the int64 ids of the dense features
+        row = np.array(row, dtype=np.int64)
+        if self.max_length is None or len(row) >= self.max_length:
+            return row
+        return np.concatenate([row, np.full(self.max_length - len(row), value, dtype=row.dtype)])
+
     def __getitem__(self, item):
-        return {
-            "input_ids": np.array(self.input_ids[item]),
-            "seq_lens": np.array(self.seq_lens[item]),
+        example = {
+            "input_ids": self._pad(self.input_ids[item], self.pad_token_id),
+            "seq_lens": np.array(self.seq_lens[item], dtype=np.int64),
             "tok_to_orig_start_index":
-            np.array(self.tok_to_orig_start_index[item]),
-            "tok_to_orig_end_index": np.array(self.tok_to_orig_end_index[item]),
-            # If model inputs is generated in `collate_fn`, delete the data type casting.
-            "labels": np.array(
-                self.labels[item], dtype=np.float32),
+            self._pad(self.tok_to_orig_start_index[item], -1),
+            "tok_to_orig_end_index": self._pad(self.tok_to_orig_end_index[item], -1),
         }
+        if self.num_labels is not None:
+            example["label_indices"] = np.array(self.labels[item])
+        else:
+            # If model inputs is generated in `collate_fn`, delete the data type casting.
+            example["labels"] = np.array(self.labels[item], dtype=np.float32)
+        return example
+
+    def save(self, path):
+        """
+        write the features into path, meta.json is written last and marks a complete cache
+        """
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'offsets.npy'), self.input_ids.offsets)
+        np.save(os.path.join(tmp_path, 'input_ids.npy'), self.input_ids.values)
+        np.save(os.path.join(tmp_path, 'seq_lens.npy'), self.seq_lens)
+        np.save(os.path.join(tmp_path, 'tok_to_orig_start_index.npy'), self.tok_to_orig_start_index.values)
+        np.save(os.path.join(tmp_path, 'tok_to_orig_end_index.npy'), self.tok_to_orig_end_index.values)
+        np.save(os.path.join(tmp_path, 'label_offsets.npy'), self.labels.offsets)
+        np.save(os.path.join(tmp_path, 'label_indices.npy'), self.labels.values)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as fp:
+            json.dump({'max_length': self.max_length, 'num_labels': self.num_labels,
+                       'pad_token_id': self.pad_token_id}, fp)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        read features written by save, memory-mapped so DataLoader workers share the pages
+        """
+        with open(os.path.join(path, 'meta.json'), 'r') as fp:
+            meta = json.load(fp)
+        load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        offsets = load('offsets')
+        return cls(RaggedArray(load('input_ids'), offsets), load('seq_lens'),
+                   RaggedArray(load('tok_to_orig_start_index'), offsets),
+                   RaggedArray(load('tok_to_orig_end_index'), offsets),
+                   RaggedArray(load('label_indices'), load('label_offsets')),
+                   meta['max_length'], meta['num_labels'], meta['pad_token_id'])
 
     @classmethod
     def from_file(cls,
                   file_path: Union[str, os.PathLike],
                   tokenizer: BertTokenizer,
                   max_length: Optional[int]=512,
-                  pad_to_max_length: Optional[bool]=None):
+                  pad_to_max_length: Optional[bool]=None,
+                  cache_dir: Optional[str]=None,
+                  num_workers: int=1,
+                  chunk_size: int=1000):
+        """
+        :param cache_dir: the features are loaded from, or saved to, cache_dir if set, under a key of the file
+            content, the tokenizer, the label map and max_length
+        :param num_workers: number of processes preprocessing chunks of chunk_size examples
+        """
         assert os.path.exists(file_path) and os.path.isfile(
             file_path), f"{file_path} dose not exists or is not a file."
         label_map_path = os.path.join(
@@ -517,37 +708,55 @@ class DuIEDataset(paddle.io.Dataset):
         ), f"{label_map_path} dose not exists or is not a file."
         with open(label_map_path, 'r', encoding='utf8') as fp:
             label_map = json.load(fp)
-        chineseandpunctuationextractor = ChineseAndPunctuationExtractor()
 
-        input_ids, seq_lens, tok_to_orig_start_index, tok_to_orig_end_index, labels = (
-            [] for _ in range(5))
+        if cache_dir:
+            cache_path = os.path.join(cache_dir, _features_cache_key(file_path, tokenizer, label_map, max_length))
+            if os.path.exists(os.path.join(cache_path, 'meta.json')):
+                logger.info("Loading preprocessed data of %s from %s" % (file_path, cache_path))
+                return cls.load(cache_path)
+
         dataset_scale = sum(1 for line in open(
-            file_path, 'r', encoding="UTF-8"))
+            file_path, 'r', encoding="UTF-8") if line.strip())
         logger.info("Preprocessing data, loaded from %s" % file_path)
-        with open(file_path, "r", encoding="utf-8") as fp:
-            lines = fp.readlines()
-            for line in tqdm(lines):
-                example = json.loads(line)
-                input_feature = convert_example_to_feature(
-                    example, tokenizer, chineseandpunctuationextractor,
-                    label_map, max_length, pad_to_max_length)
-                input_ids.append(input_feature.input_ids)
-                seq_lens.append(input_feature.seq_len)
-                tok_to_orig_start_index.append(
-                    input_feature.tok_to_orig_start_index)
-                tok_to_orig_end_index.append(
-                    input_feature.tok_to_orig_end_index)
-                labels.append(input_feature.labels)
-
-        return cls(input_ids, seq_lens, tok_to_orig_start_index,
-                   tok_to_orig_end_index, labels)
+        chunks = _line_chunks(file_path, chunk_size)
+        total = math.ceil(dataset_scale / chunk_size)
+        if num_workers > 1:
+            with multiprocessing.Pool(num_workers, _init_featurize_worker,
+                                      (tokenizer, label_map, max_length)) as pool:
+                # imap keeps the order of the examples
+                parts = list(tqdm(pool.imap(_featurize_lines, chunks), total=total))
+        else:
+            _init_featurize_worker(tokenizer, label_map, max_length)
+            parts = [_featurize_lines(chunk) for chunk in tqdm(chunks, total=total)]
+        if not parts:
+            parts = [(RaggedArray.from_rows([], np.int32), np.zeros(0, dtype=np.int32),
+                      RaggedArray.from_rows([], np.int32), RaggedArray.from_rows([], np.int32),
+                      RaggedArray(np.zeros((0, 2), dtype=np.int32), np.zeros(1, dtype=np.int64)))]
+
+        num_labels = 2 * (len(label_map.keys()) - 2) + 2
+        dataset = cls(RaggedArray.concatenate([part[0] for part in parts]),
+                      np.concatenate([part[1] for part in parts]),
+                      RaggedArray.concatenate([part[2] for part in parts]),
+                      RaggedArray.concatenate([part[3] for part in parts]),
+                      RaggedArray.concatenate([part[4] for part in parts]),
+                      max_length, num_labels, tokenizer.convert_tokens_to_ids(["[PAD]"])[0])
+        # the tok_to_orig index arrays share the offsets of input_ids
+        dataset.tok_to_orig_start_index.offsets = dataset.input_ids.offsets
+        dataset.tok_to_orig_end_index.offsets = dataset.input_ids.offsets
+        if cache_dir:
+            dataset.save(cache_path)
+            return cls.load(cache_path)
+        return dataset
 
 
 @dataclass
 class DataCollator:
     """
     Collator for DuIE.
+
+    num_labels is needed to densify the (token index, tag) labels of DuIEDataset.from_file
     """
+    num_labels: Optional[int] = None
 
     def __call__(self, examples: List[Dict[str, Union[list, np.ndarray]]]):
         batched_input_ids = np.stack([x['input_ids'] for x in examples])
@@ -556,7 +765,15 @@ class DataCollator:
             [x['tok_to_orig_start_index'] for x in examples])
         tok_to_orig_end_index = np.stack(
             [x['tok_to_orig_end_index'] for x in examples])
-        labels = np.stack([x['labels'] for x in examples])
+        if 'label_indices' in examples[0]:
+            if self.num_labels is None:
+                raise ValueError("DataCollator needs num_labels to densify sparse labels")
+            labels = np.stack([
+                densify_labels(x['label_indices'], batched_input_ids.shape[1], self.num_labels, np.float32)
+                for x in examples
+            ])
+        else:
+            labels = np.stack([x['labels'] for x in examples])
 
         return (batched_input_ids, seq_lens, tok_to_orig_start_index,
                 tok_to_orig_end_index, labels)
@@ -675,12 +892,14 @@ class Relation_ExtractionPaddle(Relation_ExtractionModel):
         criterion = BCELossForDuIE()
 
         # Loads dataset.
+        cache_dir = getattr(args, "cache_dir", None)
+        preprocess_workers = getattr(args, "preprocess_workers", 1)
         train_dataset = DuIEDataset.from_file(
             os.path.join(args.data_path, 'train_data.json'), tokenizer,
-            args.max_seq_length, True)
+            args.max_seq_length, True, cache_dir, preprocess_workers)
         train_batch_sampler = paddle.io.DistributedBatchSampler(
             train_dataset, batch_size=args.batch_size, shuffle=True, drop_last=True)
-        collator = DataCollator()
+        collator = DataCollator(num_classes)
         train_data_loader = DataLoader(
             dataset=train_dataset,
             batch_sampler=train_batch_sampler,
@@ -689,7 +908,7 @@ class Relation_ExtractionPaddle(Relation_ExtractionModel):
         
         eval_file_path = os.path.join(args.data_path, 'dev_data.json')
         test_dataset = DuIEDataset.from_file(eval_file_path, tokenizer,
-                                            args.max_seq_length, True)
+                                            args.max_seq_length, True, cache_dir, preprocess_workers)
         test_batch_sampler = paddle.io.BatchSampler(
             test_dataset, batch_size=args.batch_size, shuffle=False, drop_last=True)
         test_data_loader = DataLoader(
@@ -3,39 +3,37 @@
 
 """
 init
-"""
-
-from .kg_learn import *
-from .ke_learn import *
-from .kgc1_learn import *
-from .kgc2_learn import *
-from .kg_modules import *
-from .ke_modules import *
-from .kgc1_modules import *
-from .kgc2_modules import *
-from .kg_learn_dist import *
-
-
-from .kg_learn_dist import *
-
-# from .visual_entity_learn import *
-from .threedjcg_learn import *
-from .threedgqa_learn import *
-from .threedvg_learn import *
-from .visual_relation_learn import *
-from .hoi_learn import *
-from .stvgbert_learn import *
-from .transreid_ums_learn import *
 
-
-# from .gen_modules import *
-from .kg_learn_dist import *
-from .ke_relext import *
-
-
-from .mimo_modules import *
-from .mimo_learn import *
-
-from .dataloader import *
-from .hgt_expert_rec import HGTExpertRec
-from .person_relation_learn import *
+submodules are imported on first access of one of their names, see openks.common.register.lazy_exports
+"""
+from ...common.register import lazy_exports
+
+_SUBMODULES = [
+	'.kg_learn',
+	'.ke_learn',
+	'.kgc1_learn',
+	'.kgc2_learn',
+	'.kg_modules',
+	'.ke_modules',
+	'.kgc1_modules',
+	'.kgc2_modules',
+	'.kg_learn_dist',
+
+	# '.visual_entity_learn',
+	'.threedjcg_learn',
+	'.threedgqa_learn',
+	'.threedvg_learn',
+	'.visual_relation_learn',
+	'.hoi_learn',
+	'.stvgbert_learn',
+
+	# '.gen_modules',
+	'.ke_relext',
+	'.mimo_modules',
+	'.mimo_learn',
+	'.dataloader',
+	'.hgt_expert_rec',
+	'.person_relation_learn',
+]
+
+__getattr__ = lazy_exports(__name__, _SUBMODULES)
@@ -6,6 +6,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import logging
+
 import numpy as np
 import torch
 
@@ -162,6 +164,268 @@ class TestDataset(Dataset):
         mode = data[0][3]
         return positive_sample, negative_sample, filter_bias, mode
     
+class TrueTripleIndex(object):
+    '''
+    CSR index of the known entities of partial triples, built once with numpy.
+    In 'tail-batch' mode the keys are (head, relation) and the values the true tails,
+    in 'head-batch' mode the keys are (relation, tail) and the values the true heads.
+    '''
+    def __init__(self, triples, nrelation, mode):
+        triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        if len(triples):
+            nrelation = max(nrelation, int(triples[:, 1].max()) + 1)
+        self.nrelation = nrelation
+        self.mode = mode
+        key = self.encode(triples)
+        value = triples[:, 0] if mode == 'head-batch' else triples[:, 2]
+        order = np.lexsort((value, key))
+        key, value = key[order], value[order]
+        keep = np.ones(len(key), dtype=bool)
+        keep[1:] = (key[1:] != key[:-1]) | (value[1:] != value[:-1])
+        key, value = key[keep], value[keep]
+        self.keys, starts = np.unique(key, return_index=True)
+        self.indptr = np.append(starts, len(key)).astype(np.int64)
+        self.indices = value
+        # sorted (key, entity) pairs flattened into one integer each, for vectorized membership tests
+        self.nentity = int(value.max()) + 1 if len(value) else 1
+        self.members = key * self.nentity + value
+
+    def encode(self, triples):
+        '''
+        Key of the partial triple in every row of an [n, 3] id array
+        '''
+        if self.mode == 'head-batch':
+            return triples[:, 2] * self.nrelation + triples[:, 1]
+        elif self.mode == 'tail-batch':
+            return triples[:, 0] * self.nrelation + triples[:, 1]
+        else:
+            raise ValueError('negative batch mode %s not supported' % self.mode)
+
+    def ranges(self, triples):
+        '''
+        Start and end offsets into indices of the known entities for every row of an [n, 3] id array
+        '''
+        keys = self.encode(np.asarray(triples, dtype=np.int64).reshape(-1, 3))
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, max(len(self.keys) - 1, 0))
+        found = (self.keys[pos] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        starts = np.where(found, self.indptr[pos], 0)
+        ends = np.where(found, self.indptr[np.minimum(pos + 1, len(self.indptr) - 1)], 0)
+        return starts, ends
+
+    def lookup(self, triples):
+        '''
+        Sparse (row, entity) coordinates of all known entities for a batch of triples
+        '''
+        starts, ends = self.ranges(triples)
+        counts = ends - starts
+        rows = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        return rows, self.indices[offsets]
+
+
+    def contains(self, keys, entities):
+        '''
+        Whether each (key, entity) pair is a known triple, keys is [n] and entities is [n, m]
+        '''
+        known = entities < self.nentity
+        members = keys[:, None] * self.nentity + np.minimum(entities, self.nentity - 1)
+        pos = np.searchsorted(self.members, members)
+        pos = np.minimum(pos, max(len(self.members) - 1, 0))
+        if not len(self.members):
+            return np.zeros(entities.shape, dtype=bool)
+        return known & (self.members[pos] == members)
+
+
+class BloomFilter(object):
+    '''
+    Vectorized Bloom filter over non-negative int64 values, a compact alternative to the exact
+    TrueTripleIndex membership test for very large graphs. False positives only reject valid negatives.
+    '''
+    def __init__(self, values, error_rate=0.01):
+        values = np.asarray(values, dtype=np.int64)
+        n = max(len(values), 1)
+        self.nbits = int(np.ceil(-n * np.log(error_rate) / (np.log(2) ** 2))) + 1
+        self.nhash = max(1, int(round(self.nbits / n * np.log(2))))
+        self.bits = np.zeros((self.nbits + 7) // 8, dtype=np.uint8)
+        for position in self._positions(values):
+            np.bitwise_or.at(self.bits, position >> 3, (1 << (position & 7)).astype(np.uint8))
+
+    def _positions(self, values):
+        # double hashing from two multiplicative hashes, uint64 arithmetic wraps around on purpose
+        with np.errstate(over='ignore'):
+            x = values.astype(np.uint64)
+            h1 = (x * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(17)
+            h2 = ((x ^ (x >> np.uint64(31))) * np.uint64(0xBF58476D1CE4E5B9)) | np.uint64(1)
+            for i in range(self.nhash):
+                yield ((h1 + np.uint64(i) * h2) % np.uint64(self.nbits)).astype(np.int64)
+
+    def __contains__(self, value):
+        return bool(self.contains(np.asarray([value]))[0])
+
+    def contains(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        result = np.ones(values.shape, dtype=bool)
+        for position in self._positions(values):
+            result &= (self.bits[position >> 3] >> (position & 7)) & 1 == 1
+        return result
+
+
+class BatchNegativeSampler(object):
+    '''
+    Collate-free replacement for a DataLoader over TrainDataset.
+    Each batch draws the whole [batch_size, negative_sample_size] negative matrix at once and rejects
+    false negatives against a sorted TrueTripleIndex (or a BloomFilter with negative_filter='bloom').
+    Subsampling weights are precomputed as an array. Iterating the sampler yields one shuffled epoch of
+    (positive_sample, negative_sample, subsampling_weight, mode) batches, like the DataLoader did,
+    so it plugs into BidirectionalOneShotIterator directly.
+    '''
+    def __init__(self, triples, nentity, nrelation, negative_sample_size, mode, batch_size,
+                 shuffle=True, seed=None, negative_filter='index', start=4):
+        if mode not in ['head-batch', 'tail-batch']:
+            raise ValueError('Training batch mode %s not supported' % mode)
+        self.triples = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        self.nentity = nentity
+        self.nrelation = nrelation
+        self.negative_sample_size = negative_sample_size
+        self.mode = mode
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.RandomState(seed)
+        self.index = TrueTripleIndex(self.triples, nrelation, mode)
+        self.keys = self.index.encode(self.triples)
+        if negative_filter == 'bloom':
+            self.bloom = BloomFilter(self.index.members)
+        elif negative_filter == 'index':
+            self.bloom = None
+        else:
+            raise ValueError('negative filter %s not supported' % negative_filter)
+        self.subsampling_weight = torch.from_numpy(self.subsampling_weights(self.triples, start)).float()
+
+    @staticmethod
+    def subsampling_weights(triples, start=4):
+        '''
+        Same weights as TrainDataset.count_frequency, 1 / sqrt(count(head, relation) + count(tail, -relation-1))
+        '''
+        weight = np.zeros(len(triples), dtype=np.float64)
+        for entity, relation in [(triples[:, 0], triples[:, 1]), (triples[:, 2], -triples[:, 1] - 1)]:
+            _, inverse, counts = np.unique(np.stack([entity, relation], axis=1), axis=0, return_inverse=True, return_counts=True)
+            weight += counts[inverse.reshape(-1)] + start - 1
+        return np.sqrt(1 / weight)
+
+    def __len__(self):
+        return (len(self.triples) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        order = self.rng.permutation(len(self.triples)) if self.shuffle else np.arange(len(self.triples))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            positive_sample = torch.from_numpy(self.triples[batch])
+            negative_sample = torch.from_numpy(self.sample(self.keys[batch]))
+            yield positive_sample, negative_sample, self.subsampling_weight[batch], self.mode
+
+    def is_known(self, keys, entities):
+        if self.bloom is not None:
+            known = entities < self.index.nentity
+            return known & self.bloom.contains(keys[:, None] * self.index.nentity + entities)
+        return self.index.contains(keys, entities)
+
+    def sample(self, keys):
+        '''
+        Draw negative_sample_size corrupted entities for every key, redrawing only the rows
+        which did not get enough valid candidates in one round
+        '''
+        size = self.negative_sample_size
+        negative = np.empty((len(keys), size), dtype=np.int64)
+        pending = np.arange(len(keys))
+        while len(pending):
+            candidates = self.rng.randint(self.nentity, size=(len(pending), size * 2))
+            valid = ~self.is_known(keys[pending], candidates)
+            # stable sort moves valid candidates to the front and keeps their random order
+            order = np.argsort(~valid, axis=1, kind='stable')[:, :size]
+            negative[pending] = np.take_along_axis(candidates, order, axis=1)
+            pending = pending[valid.sum(axis=1) < size]
+        return negative
+
+
+class FilteredRankingEvaluator(object):
+    '''
+    Batched filtered link prediction evaluation (MRR, MR, HITS@k).
+    Known true triples are looked up once per batch from a TrueTripleIndex and applied as a sparse mask,
+    and the rank of the positive entity is the number of unfiltered candidates scoring strictly higher plus one,
+    so no full sort is needed. Candidate entities can be scored in chunks to bound memory.
+    '''
+    def __init__(self, all_true_triples, nentity, nrelation, hits=(1, 3, 10), entity_chunk_size=None):
+        self.nentity = nentity
+        self.hits = hits
+        self.entity_chunk_size = entity_chunk_size or nentity
+        self.index = {
+            mode: TrueTripleIndex(all_true_triples, nrelation, mode)
+            for mode in ['head-batch', 'tail-batch']
+        }
+
+    def rank(self, score_fn, positive_sample, mode):
+        '''
+        Filtered ranks of a batch of positive triples.
+        score_fn(positive_sample, candidates, mode) returns the [batch, n_candidates] scores of replacing
+        the head or tail of each positive triple with the candidate entities.
+        '''
+        device = positive_sample.device
+        batch_size = positive_sample.size(0)
+        if mode == 'head-batch':
+            positive_arg = positive_sample[:, 0]
+        elif mode == 'tail-batch':
+            positive_arg = positive_sample[:, 2]
+        else:
+            raise ValueError('mode %s not supported' % mode)
+
+        positive_score = score_fn(positive_sample, positive_arg.unsqueeze(1), mode)
+        rows, cols = self.index[mode].lookup(positive_sample.cpu().numpy())
+        rows = torch.from_numpy(rows).to(device)
+        cols = torch.from_numpy(cols).to(device)
+        batch_index = torch.arange(batch_size, device=device)
+
+        higher = torch.zeros(batch_size, dtype=torch.long, device=device)
+        for start in range(0, self.nentity, self.entity_chunk_size):
+            end = min(start + self.entity_chunk_size, self.nentity)
+            # repeated rather than expanded, score functions flatten the candidates with view(-1)
+            candidates = torch.arange(start, end, device=device).repeat(batch_size, 1)
+            score = score_fn(positive_sample, candidates, mode)
+            filtered = torch.zeros(batch_size, end - start, dtype=torch.bool, device=device)
+            in_chunk = (cols >= start) & (cols < end)
+            filtered[rows[in_chunk], cols[in_chunk] - start] = True
+            # the positive itself never counts, even if its recomputed score differs in the last bits
+            in_chunk = (positive_arg >= start) & (positive_arg < end)
+            filtered[batch_index[in_chunk], positive_arg[in_chunk] - start] = True
+            higher += ((score > positive_score) & ~filtered).sum(dim=1)
+        return (higher + 1).float()
+
+    def evaluate(self, score_fn, triples, batch_size, device, log_steps=None):
+        '''
+        Average filtered metrics over head and tail prediction for all triples.
+        '''
+        triples = torch.as_tensor(np.asarray(triples, dtype=np.int64).reshape(-1, 3))
+        totals = {'MRR': 0., 'MR': 0.}
+        totals.update({'HITS@%d' % k: 0. for k in self.hits})
+        totals = {metric: torch.zeros((), dtype=torch.float64, device=device) for metric in totals}
+        count = 0
+        step = 0
+        total_steps = 2 * ((len(triples) + batch_size - 1) // batch_size)
+        for mode in ['head-batch', 'tail-batch']:
+            for start in range(0, len(triples), batch_size):
+                positive_sample = triples[start:start + batch_size].to(device)
+                ranking = self.rank(score_fn, positive_sample, mode).double()
+                totals['MRR'] += (1.0 / ranking).sum()
+                totals['MR'] += ranking.sum()
+                for k in self.hits:
+                    totals['HITS@%d' % k] += (ranking <= k).sum()
+                count += ranking.size(0)
+                if log_steps and step % log_steps == 0:
+                    logging.info('Evaluating the model... (%d/%d)' % (step, total_steps))
+                step += 1
+        return {metric: (value / max(count, 1)).item() for metric, value in totals.items()}
+
+
 class BidirectionalOneShotIterator(object):
     def __init__(self, dataloader_head, dataloader_tail):
         self.iterator_head = self.one_shot_iterator(dataloader_head)
@@ -13,9 +13,11 @@ from torch.optim import optimizer
 import numpy as np
 from sklearn.model_selection import train_test_split
 from ..model import KGLearnModel, TorchDataset
+from ...abstract.chunked import iter_chunks
+from ...abstract.columnar_mtg import ColumnarMTG
 from .kg_modules import NCESoftmaxLossNS
 
-from .dataloader import TrainDataset, TestDataset
+from .dataloader import TrainDataset, TestDataset, FilteredRankingEvaluator, BatchNegativeSampler
 from .dataloader import BidirectionalOneShotIterator
 import json
 
@@ -62,21 +64,37 @@ class KGLearnTorch(KGLearnModel):
 		self.args = args
 		self.model = model
 
+	def encode_triples(self, triples, rel2id):
+		"""map MTG triples to an [n, 3] id array chunk by chunk, works for lists and lazy chunked readers"""
+		chunk_size = self.args.get('chunk_size', 100000)
+		chunks = [np.zeros((0, 3), dtype=np.int64)]
+		for chunk in iter_chunks(triples, chunk_size):
+			chunks.append(np.array([(triple[0][0], rel2id[triple[0][1]], triple[0][2]) for triple in chunk], dtype=np.int64).reshape(-1, 3))
+		return np.concatenate(chunks)
+
 	def triples_reader(self, ratio=0.05):
 		"""read from triple data files to id triples"""
 		rel2id = self.graph.relation_to_id()
-		train_valid_triples, test_triples = train_test_split(self.graph.triples, test_size=ratio, random_state=self.args['random_seed'])
-		train_triples, valid_triples = train_test_split(train_valid_triples, test_size=ratio, random_state=self.args['random_seed'])
-		train_triples = [(triple[0][0], rel2id[triple[0][1]], triple[0][2]) for triple in train_triples]
-		valid_triples = [(triple[0][0], rel2id[triple[0][1]], triple[0][2]) for triple in valid_triples]
-		test_triples = [(triple[0][0], rel2id[triple[0][1]], triple[0][2]) for triple in test_triples]
+		if isinstance(self.graph, ColumnarMTG):
+			# relation codes of the columnar backend already follow relation_to_id
+			id_triples = self.graph.triple_array
+		else:
+			id_triples = self.encode_triples(self.graph.triples, rel2id)
+		# splitting row indices gives the same partition as splitting the triples themselves
+		train_valid_index, test_index = train_test_split(np.arange(len(id_triples)), test_size=ratio, random_state=self.args['random_seed'])
+		train_index, valid_index = train_test_split(train_valid_index, test_size=ratio, random_state=self.args['random_seed'])
+		train_triples = [tuple(triple) for triple in id_triples[train_index].tolist()]
+		valid_triples = [tuple(triple) for triple in id_triples[valid_index].tolist()]
+		test_triples = [tuple(triple) for triple in id_triples[test_index].tolist()]
 		return train_triples, valid_triples, test_triples
 
 	def triples_reader_v2(self):
 		"""read from triple data files to id triples"""
 		rel2id = self.graph.relation_to_id()
-		train_triples = self.graph.triples
-		train_triples = [(triple[0][0], rel2id[triple[0][1]], triple[0][2]) for triple in train_triples]
+		if isinstance(self.graph, ColumnarMTG):
+			train_triples = [tuple(triple) for triple in self.graph.triple_array.tolist()]
+		else:
+			train_triples = [tuple(triple) for triple in self.encode_triples(self.graph.triples, rel2id).tolist()]
 
 		with open(os.path.join(self.args['data_dir'], 'entities')) as fin:
 			entity2id = dict()
@@ -191,21 +209,36 @@ class KGLearnTorch(KGLearnModel):
 
 		model = model.to(device)
 
-		train_dataloader_head = data.DataLoader(
-			TrainDataset(train_triples, nentity, nrelation, self.args['negative_sample_size'], 'head-batch'),
-			batch_size=self.args['batch_size'],
-			shuffle=True,
-			num_workers=max(1, self.args['cpu_num'] // 2),
-			collate_fn=TrainDataset.collate_fn
-		)
+		if self.args.get('batch_sampler', True):
+			# whole batches of negatives are drawn with numpy in the main process, no DataLoader workers needed
+			train_dataloader_head = BatchNegativeSampler(
+				train_triples, nentity, nrelation, self.args['negative_sample_size'], 'head-batch',
+				batch_size=self.args['batch_size'],
+				seed=self.args['random_seed'],
+				negative_filter=self.args.get('negative_filter', 'index')
+			)
+			train_dataloader_tail = BatchNegativeSampler(
+				train_triples, nentity, nrelation, self.args['negative_sample_size'], 'tail-batch',
+				batch_size=self.args['batch_size'],
+				seed=self.args['random_seed'] + 1,
+				negative_filter=self.args.get('negative_filter', 'index')
+			)
+		else:
+			train_dataloader_head = data.DataLoader(
+				TrainDataset(train_triples, nentity, nrelation, self.args['negative_sample_size'], 'head-batch'),
+				batch_size=self.args['batch_size'],
+				shuffle=True,
+				num_workers=max(1, self.args['cpu_num'] // 2),
+				collate_fn=TrainDataset.collate_fn
+			)
 
-		train_dataloader_tail = data.DataLoader(
-			TrainDataset(train_triples, nentity, nrelation, self.args['negative_sample_size'], 'tail-batch'),
-			batch_size=self.args['batch_size'],
-			shuffle=True,
-			num_workers=max(1, self.args['cpu_num'] // 2),
-			collate_fn=TrainDataset.collate_fn
-		)
+			train_dataloader_tail = data.DataLoader(
+				TrainDataset(train_triples, nentity, nrelation, self.args['negative_sample_size'], 'tail-batch'),
+				batch_size=self.args['batch_size'],
+				shuffle=True,
+				num_workers=max(1, self.args['cpu_num'] // 2),
+				collate_fn=TrainDataset.collate_fn
+			)
 
 		train_iterator = BidirectionalOneShotIterator(train_dataloader_head, train_dataloader_tail)
 
@@ -481,87 +514,32 @@ class KGLearnTorch(KGLearnModel):
 
 		model.eval()
 
-		# Otherwise use standard (filtered) MRR, MR, HITS@1, HITS@3, and HITS@10 metrics
-		# Prepare dataloader for evaluation
-		test_dataloader_head = data.DataLoader(
-			TestDataset(
-				test_triples,
-				all_true_triples,
-				args['nentity'],
-				args['nrelation'],
-				'head-batch'
-			),
-			batch_size=args['test_batch_size'],
-			num_workers=max(1, args['cpu_num'] // 2),
-			collate_fn=TestDataset.collate_fn
-		)
-
-		test_dataloader_tail = data.DataLoader(
-			TestDataset(
-				test_triples,
+		# Use standard (filtered) MRR, MR, HITS@1, HITS@3, and HITS@10 metrics
+		# The filter index over all true triples is built once and reused by later evaluations
+		evaluator = getattr(self, '_evaluator', None)
+		if evaluator is None or self._evaluator_triples is not all_true_triples:
+			evaluator = FilteredRankingEvaluator(
 				all_true_triples,
 				args['nentity'],
 				args['nrelation'],
-				'tail-batch'
-			),
-			batch_size=args['test_batch_size'],
-			num_workers=max(1, args['cpu_num'] // 2),
-			collate_fn=TestDataset.collate_fn
-		)
-
-		test_dataset_list = [test_dataloader_head, test_dataloader_tail]
+				entity_chunk_size=args.get('eval_entity_chunk_size')
+			)
+			self._evaluator = evaluator
+			self._evaluator_triples = all_true_triples
 
-		logs = []
+		device = torch.device('cuda') if args['gpu'] else torch.device('cpu')
 
-		step = 0
-		total_steps = sum([len(dataset) for dataset in test_dataset_list])
+		def score_fn(positive_sample, candidates, mode):
+			return self.forward(model, (positive_sample, candidates), mode)
 
 		with torch.no_grad():
-			for test_dataset in test_dataset_list:
-				for positive_sample, negative_sample, filter_bias, mode in test_dataset:
-					if args['gpu']:
-						positive_sample = positive_sample.cuda()
-						negative_sample = negative_sample.cuda()
-						filter_bias = filter_bias.cuda()
-
-					batch_size = positive_sample.size(0)
-
-					score = self.forward(model, (positive_sample, negative_sample), mode)
-					score += filter_bias
-
-					# Explicitly sort all the entities to ensure that there is no test exposure bias
-					argsort = torch.argsort(score, dim=1, descending=True)
-
-					if mode == 'head-batch':
-						positive_arg = positive_sample[:, 0]
-					elif mode == 'tail-batch':
-						positive_arg = positive_sample[:, 2]
-					else:
-						raise ValueError('mode %s not supported' % mode)
-
-					for i in range(batch_size):
-						# Notice that argsort is not ranking
-						ranking = (argsort[i, :] == positive_arg[i]).nonzero()
-						assert ranking.size(0) == 1
-
-						# ranking + 1 is the true ranking used in evaluation metrics
-						ranking = 1 + ranking.item()
-						logs.append({
-							'MRR': 1.0 / ranking,
-							'MR': float(ranking),
-							'HITS@1': 1.0 if ranking <= 1 else 0.0,
-							'HITS@3': 1.0 if ranking <= 3 else 0.0,
-							'HITS@10': 1.0 if ranking <= 10 else 0.0,
-						})
-
-					if step % args['test_log_steps'] == 0:
-						logging.info('Evaluating the model... (%d/%d)' % (step, total_steps))
-
-					step += 1
-
-		metrics = {}
-		for metric in logs[0].keys():
-			metrics[metric] = sum([log[metric] for log in logs]) / len(logs)
+			metrics = evaluator.evaluate(
+				score_fn,
+				test_triples,
+				args['test_batch_size'],
+				device,
+				log_steps=args['test_log_steps']
+			)
 
 		return metrics
 
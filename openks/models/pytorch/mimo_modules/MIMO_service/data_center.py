@@ -72,22 +72,23 @@ class DataCenter(object):
 				ID2Tag[int(_id)] = tag
 		return tag2ID, ID2Tag
 
-	def WPC_Data_Transform(self, text):
-		SENTENCEs = self.EVAL_SENTENCEs
-		POSTAGs = self.EVAL_POSTAGs
-		CAPs = self.EVAL_CAPs
-		OUTs = self.EVAL_OUTs
-		instance_list = self.instance_EVAL
-
-		del SENTENCEs[:]
-		del POSTAGs[:]
-		del CAPs[:]
-		del OUTs[:]
-		del instance_list[:]
-
-		for indx, sentence in enumerate(splitSentence(text)):
+	def sentence_instances(self, text, sent_splitter=None, tagger=None):
+		"""split, tokenize and POS tag text into the inputs of run_mimo, the EVAL lists are left untouched so concurrent requests can be built at once
+		sent_splitter: preloaded punkt sentence tokenizer, loaded again by splitSentence if None
+		tagger: preloaded nltk PerceptronTagger, nltk.pos_tag if None
+		"""
+		sentences = sent_splitter.tokenize(text) if sent_splitter is not None else splitSentence(text)
+		tag = tagger.tag if tagger is not None else nltk.pos_tag
+
+		SENTENCEs = []
+		POSTAGs = []
+		CAPs = []
+		OUTs = []
+		instance_list = []
+
+		for indx, sentence in enumerate(sentences):
 			words = nltk.word_tokenize(sentence)
-			postags = [x[1] for x in nltk.pos_tag(words)]
+			postags = [x[1] for x in tag(words)]
 			caps = ['O']*len(words)
 
 			SENTENCEs.append([x.lower() for x in words])
@@ -104,6 +105,17 @@ class DataCenter(object):
 
 			instance_list.append(instance)
 
+		return SENTENCEs, POSTAGs, CAPs, OUTs, instance_list
+
+	def WPC_Data_Transform(self, text):
+		SENTENCEs, POSTAGs, CAPs, OUTs, instance_list = self.sentence_instances(text)
+
+		self.EVAL_SENTENCEs[:] = SENTENCEs
+		self.EVAL_POSTAGs[:] = POSTAGs
+		self.EVAL_CAPs[:] = CAPs
+		self.EVAL_OUTs[:] = OUTs
+		self.instance_EVAL[:] = instance_list
+
 	def _add_instance(self, dataset_type, paper_id, stmt_id, multi_input, multi_output, attr_tuple):
 		if len(multi_input) == 0 or len(multi_input[0][-1]) > 40 or len(multi_input[0][-1]) < 5:
 			return
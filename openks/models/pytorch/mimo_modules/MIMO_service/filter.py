@@ -1,6 +1,8 @@
 from nltk import pos_tag
 
-def tuple_filter(query):
+def tuple_filter(query, tagger=None):
+    # tagger: preloaded nltk PerceptronTagger, nltk.pos_tag is used if None
+    tag = tagger.tag if tagger is not None else pos_tag
 
     def get_subject(tpl):
         return get_subject_concept(tpl), get_subject_attribute(tpl)
@@ -92,7 +94,7 @@ def tuple_filter(query):
 
             if get_subject(con_tpl1) == get_subject(con_tpl2):
                 relation = get_relation(con_tpl2).split()
-                pos = pos_tag(relation)
+                pos = tag(relation)
                 if pos[0][1] == 'IN':
                     stmt['condition tuples'].remove(con_tpl2)
 
@@ -12,6 +12,9 @@ import itertools
 import copy
 import re
 import time
+import queue
+import logging
+import threading
 import warnings
 import gevent.pywsgi
 
@@ -29,9 +32,12 @@ import torch.optim as optim
 import torch.autograd as autograd
 
 from torch.autograd import Variable
+from concurrent.futures import Future
 from sklearn.utils import shuffle
+import nltk
 from nltk.tokenize import sent_tokenize, word_tokenize
 from nltk import pos_tag
+from nltk.tag.perceptron import PerceptronTagger
 from spacy.lemmatizer import Lemmatizer
 from spacy.lang.en import LEMMA_INDEX, LEMMA_EXC, LEMMA_RULES
 from pytorch_pretrained_bert import BertTokenizer, BertModel
@@ -48,8 +54,10 @@ from flask import Flask, request
 from flask import render_template
 import json, argparse
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 clusters = dict()
+metrics = LatencyMetrics()
 
 parser = argparse.ArgumentParser(description='Implement of SISO, SIMO, MISO, MIMO for Conditional Statement Extraction')
 
@@ -66,6 +74,14 @@ parser.add_argument('--debug', action='store_true')
 parser.add_argument('--local', action='store_true')
 parser.add_argument('--wv', action='store_true')
 parser.add_argument('--port', type=int, default='9997')
+parser.add_argument('--workers', type=int, default=1,
+					help='number of threads running batches on the shared models')
+parser.add_argument('--max_batch', type=int, default=64,
+					help='maximum number of sentences of concurrent requests run together')
+parser.add_argument('--max_wait', type=float, default=0.01,
+					help='seconds a sentence waits for others to share its batch')
+parser.add_argument('--embedding_cache', type=int, default=100000,
+					help='number of phrase embeddings kept in the LRU cache')
 args = parser.parse_args()
 
 if torch.cuda.is_available():
@@ -92,11 +108,20 @@ def device_model(dumped_models):
 	dumped_models = [models, tokenizer, LM_model, LM_corpus, mimo_extractor_fact, mimo_extractor_cond, multi_head, multi_head_two]
 	return dumped_models
 
-def getEmbeddings(phr_list):
-	embed_list = []
-	for phr in phr_list:
-		if phr in wv_model.vocab:
-			embed_list.append(wv_model.word_vec(phr))
+class PhraseEmbeddings(object):
+	"""LRU cache of the normalized phrase embeddings of wv_model, out-of-vocabulary phrases are tokenized only when they are missed"""
+	def __init__(self, wv_model, maxsize=100000):
+		super(PhraseEmbeddings, self).__init__()
+		self.wv_model = wv_model
+		self.maxsize = maxsize
+		self.cache = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def embed(self, phr):
+		if phr in self.wv_model.vocab:
+			vec = self.wv_model.word_vec(phr)
 		# else:
 		# 	vec = np.zeros(50, np.float32)
 		# 	wrds = word_tokenize(phr)
@@ -109,21 +134,110 @@ def getEmbeddings(phr_list):
 			vecs = []
 			wrds = word_tokenize(phr)
 			for wrd in wrds:
-				if wrd in wv_model.vocab: 	
-					vecs.append(wv_model.word_vec(wrd))
-				else: vecs.append(np.random.randn(50))
+				if wrd in self.wv_model.vocab: 	
+					vecs.append(self.wv_model.word_vec(wrd))
+				else: vecs.append(np.random.randn(self.wv_model.vector_size))
 			vec = np.max(np.asarray(vecs), axis=0)
-			embed_list.append(vec)
+		vec = vec/np.linalg.norm(vec, ord=2)
+		vec.flags.writeable = False
+		return vec
+
+	def get(self, phr):
+		with self.lock:
+			vec = self.cache.get(phr)
+			if vec is not None:
+				self.cache.move_to_end(phr)
+				self.hits += 1
+				return vec
+			self.misses += 1
+		vec = self.embed(phr)
+		with self.lock:
+			self.cache[phr] = vec
+			if len(self.cache) > self.maxsize:
+				self.cache.popitem(last=False)
+		return vec
+
+	def stats(self):
+		return {'size': len(self.cache), 'hits': self.hits, 'misses': self.misses}
 
-	embs = np.array(embed_list)
-	embs = embs/np.expand_dims(np.linalg.norm(embs,ord=2,axis=1), 1)
-	return embs
+def getEmbeddings(phr_list):
+	return np.array([phrase_embeddings.get(phr) for phr in phr_list])
+
+def preload_nltk():
+	"""load the punkt sentence splitter and the POS tagger once, nltk.pos_tag would unpickle the tagger on every call"""
+	sent_splitter = nltk.data.load('tokenizers/punkt/english.pickle')
+	tagger = PerceptronTagger()
+	# word_tokenize loads its own punkt models on first use
+	tagger.tag(word_tokenize(sent_splitter.tokenize('Warm up the tokenizers.')[0]))
+	return sent_splitter, tagger
+
+class SentenceBatcher(object):
+	"""Sentences submitted by concurrent requests are run through run_mimo together by a pool of worker threads sharing the resident models.
+	A batch is started as soon as max_batch sentences are waiting or max_wait seconds after its first sentence arrived.
+	"""
+	def __init__(self, run_batch, max_batch=64, max_wait=0.01, workers=1):
+		super(SentenceBatcher, self).__init__()
+		self.run_batch = run_batch
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self.queue = queue.Queue()
+		self.threads = [threading.Thread(target=self._loop, name='mimo-worker-%d' % i, daemon=True) for i in range(workers)]
+		for thread in self.threads:
+			thread.start()
+
+	def submit(self, item):
+		future = Future()
+		self.queue.put((item, future, time.perf_counter()))
+		return future
+
+	def _collect(self):
+		pending = [self.queue.get()]
+		deadline = time.monotonic() + self.max_wait
+		while len(pending) < self.max_batch:
+			timeout = deadline - time.monotonic()
+			if timeout <= 0:
+				break
+			try:
+				pending.append(self.queue.get(timeout=timeout))
+			except queue.Empty:
+				break
+		return pending
+
+	def _loop(self):
+		while True:
+			pending = self._collect()
+			metrics.record('queue', time.perf_counter() - pending[0][2])
+			try:
+				results = self.run_batch([item for item, _, _ in pending])
+			except Exception as e:
+				logger.exception('batch of %d sentences failed', len(pending))
+				for _, future, _ in pending:
+					future.set_exception(e)
+				continue
+			for (_, future, _), result in zip(pending, results):
+				future.set_result(result)
+
+def predict_sentences(items):
+	"""CFE of every (SENTENCE, POSTAG, CAP, OUT, instance) item, in the order of items"""
+	data = [list(column) for column in zip(*items)]
+	# grad mode is per thread, so it is turned off in the worker running the batch
+	with torch.no_grad():
+		CFE_list = run_mimo(dumped_models, dataCenter, data, device=device, metrics=metrics)
+	CFE_by_instance = {id(CFE[3]): CFE for CFE in CFE_list}
+	return [CFE_by_instance[id(item[-1])] for item in items]
 
 def CFE_Data_Transform(text):
-	dataCenter.WPC_Data_Transform(text)
-	DATA = dataCenter.get_data_to_predict()
-	CFE_list = run_mimo(dumped_models, dataCenter, DATA, device=device)
+	with stage_timer(metrics, 'preprocess'):
+		DATA = dataCenter.sentence_instances(text, sent_splitter, tagger)
+	futures = [batcher.submit(item) for item in zip(*DATA)]
+	# statements are numbered in the order run_mimo used to return them, longest sentence first
+	order = sorted(range(len(futures)), key=lambda i: len(DATA[0][i]), reverse=True)
+	CFE_list = [futures[i].result() for i in order]
 
+	with stage_timer(metrics, 'filtering'):
+		return CFE_Filter(CFE_list)
+
+def CFE_Filter(CFE_list):
 	statements = {}
 	stmts_tagging = [[] for i in range(len(CFE_list))]
 	stmt_id = 1
@@ -170,7 +284,7 @@ def CFE_Data_Transform(text):
 		predicate_indx = sorted(list(set(predicate_indx)))
 		_statement = {'text': ' '.join(sentence), 'fact tuples': fact_tuples, 'condition tuples': cond_tuples, 'concept_indx': concpet_indx, 'attr_indx': attr_indx, 'predicate_indx': predicate_indx}
 
-		_statement = tuple_filter(_statement)
+		_statement = tuple_filter(_statement, tagger)
 
 		statements[CFE[3].stmt_id] = _statement
 		stmt_id += 1
@@ -206,13 +320,18 @@ def mimo():
 		start_time = time.time()
 		text = request.get_json()['text']
 
-		statements, stmts_tagging = run_search(text)
+		with stage_timer(metrics, 'request'):
+			statements, stmts_tagging = run_search(text)
 		print('Searching elapse: ', time.time() - start_time)
 
 		return json.dumps({'statements': statements})
 	else:
 		return 'Error! in mimo'
 
+@app.route('/metrics', methods=['GET'])
+def latency_metrics():
+	return json.dumps({'latency_ms': metrics.summary(), 'phrase_embeddings': phrase_embeddings.stats()})
+
 
 def debug():
 	text = 'Histone deacetylase inhibitor valproic acid (VPA) has been used to increase the reprogramming efficiency of induced pluripotent stem cell (iPSC) from somatic cells, yet the specific molecular mechanisms underlying this effect is unknown. Here, we demonstrate that reprogramming with lentiviruses carrying the iPSC-inducing factors (Oct4-Sox2-Klf4-cMyc, OSKM) caused senescence in mouse fibroblasts, establishing a stress barrier for cell reprogramming. Administration of VPA protected cells from reprogramming-induced senescent stress. Using an in vitro pre-mature senescence model, we found that VPA treatment increased cell proliferation and inhibited apoptosis through the suppression of the p16/p21 pathway. In addition, VPA also inhibited the G2/M phase blockage derived from the senescence stress. These findings highlight the role of VPA in breaking the cell senescence barrier required for the induction of pluripotency.'
@@ -236,6 +355,12 @@ if __name__ == "__main__":
 	dumped_models = device_model(torch.load('../resources/dumped_models.pt', map_location=device))
 	print('done.')
 
+	print('loading nltk resources')
+	sent_splitter, tagger = preload_nltk()
+	print('done.')
+
+	batcher = SentenceBatcher(predict_sentences, args.max_batch, args.max_wait, args.workers)
+
 	print('loading word2vector models')
 	if args.wv:
 		wv_model = gensim.models.KeyedVectors.load_word2vec_format('./word2vector/glove.6B.50d_word2vec.txt', binary=False)
@@ -245,6 +370,7 @@ if __name__ == "__main__":
 		# pickle.dump(wv_model, open('./word2vector/pubmed-wv_model.pkl','wb'))
 		# wv_model = pickle.load(open('./word2vector/pubmed-wv_model.pkl','rb'))
 		threshold = 0.8
+	phrase_embeddings = PhraseEmbeddings(wv_model, args.embedding_cache)
 	
 	print('done.')
 
@@ -252,6 +378,6 @@ if __name__ == "__main__":
 		debug()
 	else:
 		print("MIMO Server Running")
-		app.run(host='127.0.0.1', port=args.port)
+		app.run(host='127.0.0.1', port=args.port, threaded=True)
 		# app_server = gevent.pywsgi.WSGIServer(('127.0.0.1', args.port), app)
 		# app_server.serve_forever()
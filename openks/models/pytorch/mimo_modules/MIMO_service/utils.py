@@ -8,6 +8,8 @@ import struct
 import math
 import itertools
 import copy
+import time
+import threading
 import nltk
 
 if sys.version_info[0] == 2:
@@ -22,6 +24,8 @@ import torch.optim as optim
 import torch.autograd as autograd
 
 from torch.autograd import Variable
+from collections import deque
+from contextlib import contextmanager
 from sklearn.utils import shuffle
 from pytorch_pretrained_bert import BertTokenizer, BertModel
 
@@ -1497,7 +1501,43 @@ def _core_evaluation(OUTs, SENTENCEs, instance_list, predict_fact_batch, predict
 
 	return [tag_level_fact, tag_level_cond, tag_level], [Tag2Metrics, tag2tag_fact, tag2tag_cond], [tuple_level_fact, tuple_level_cond, tuple_level], predicted_str
 
-def _core_predict(SENTENCEs, POSTAGs, CAPs, instance_list, models, dataCenter, device=torch.device("cuda"), tokenizer=None, LM_model=None, LM_corpus=None, mimo_extractor_fact=None, mimo_extractor_cond=None, pretrain=False, ensemble=None, ensemble_two=None, writer=None):
+class LatencyMetrics(object):
+	"""latencies of the serving stages, the last window samples of every stage are kept"""
+	def __init__(self, window=1000):
+		super(LatencyMetrics, self).__init__()
+		self.window = window
+		self.samples = dict()
+		self.counts = dict()
+		self.lock = threading.Lock()
+
+	def record(self, stage, seconds):
+		with self.lock:
+			if stage not in self.samples:
+				self.samples[stage] = deque(maxlen=self.window)
+				self.counts[stage] = 0
+			self.samples[stage].append(seconds)
+			self.counts[stage] += 1
+
+	def summary(self):
+		"""count, mean, p50, p95 and max in milliseconds of every stage"""
+		with self.lock:
+			samples = {stage: np.array(values) * 1000 for stage, values in self.samples.items()}
+			counts = dict(self.counts)
+		return {stage: {'count': counts[stage], 'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)), 'max': float(values.max())} for stage, values in samples.items()}
+
+@contextmanager
+def stage_timer(metrics, stage, device=None):
+	"""record the time spent in the block as stage, cuda kernels are waited for so they are charged to the stage launching them"""
+	if metrics is None:
+		yield
+		return
+	start = time.perf_counter()
+	yield
+	if getattr(device, 'type', None) == 'cuda':
+		torch.cuda.synchronize(device)
+	metrics.record(stage, time.perf_counter() - start)
+
+def _core_predict(SENTENCEs, POSTAGs, CAPs, instance_list, models, dataCenter, device=torch.device("cuda"), tokenizer=None, LM_model=None, LM_corpus=None, mimo_extractor_fact=None, mimo_extractor_cond=None, pretrain=False, ensemble=None, ensemble_two=None, writer=None, metrics=None):
 	predict_fact = []
 	predict_condition = []
 	predict_fact_tuples = []
@@ -1512,15 +1552,17 @@ def _core_predict(SENTENCEs, POSTAGs, CAPs, instance_list, models, dataCenter, d
 		POSTAGs_batch = POSTAGs[index*batch_size: (index+1)*batch_size]
 		CAPs_batch = CAPs[index*batch_size: (index+1)*batch_size]
 		instances_batch = instance_list[index*batch_size: (index+1)*batch_size]
-		predict_fact_batch, predict_condition_batch, hidden_out_batch = Tag_Extractor(SENTENCEs_batch, POSTAGs_batch, CAPs_batch, models, tokenizer, LM_model, LM_corpus, device, ensemble, ensemble_two)
+		with stage_timer(metrics, 'tagging', device):
+			predict_fact_batch, predict_condition_batch, hidden_out_batch = Tag_Extractor(SENTENCEs_batch, POSTAGs_batch, CAPs_batch, models, tokenizer, LM_model, LM_corpus, device, ensemble, ensemble_two)
 
 		if not pretrain:
-			predict_fact_tuples_batch, predict_cond_tuples_batch = Tuple_Extractor(predict_fact_batch, predict_condition_batch, hidden_out_batch, mimo_extractor_fact, mimo_extractor_cond, dataCenter)
-			# if writer == None:
-			# 	predict_fact_tuples.extend(predict_fact_tuples_batch)
-			# 	predict_cond_tuples.extend(predict_cond_tuples_batch)
+			with stage_timer(metrics, 'extraction', device):
+				predict_fact_tuples_batch, predict_cond_tuples_batch = Tuple_Extractor(predict_fact_batch, predict_condition_batch, hidden_out_batch, mimo_extractor_fact, mimo_extractor_cond, dataCenter)
+				# if writer == None:
+				# 	predict_fact_tuples.extend(predict_fact_tuples_batch)
+				# 	predict_cond_tuples.extend(predict_cond_tuples_batch)
 
-			CFE_list.extend(write_tuples(instances_batch, predict_fact_tuples_batch, predict_cond_tuples_batch, dataCenter, writer))
+				CFE_list.extend(write_tuples(instances_batch, predict_fact_tuples_batch, predict_cond_tuples_batch, dataCenter, writer))
 		# if writer == None:
 		# 	for row in predict_fact_batch:
 		# 		predict_fact.append(row)
@@ -1563,7 +1605,7 @@ def write_tuples(instance_list, fact_tuples_batch, cond_tuples_batch, dataCenter
 		CFE_list.append([instance.SENTENCE, facts, conditions, instance])
 	return CFE_list
 
-def run_mimo(dumped_models, dataCenter, data, threshold_fact=0, threshold_cond=0, write_prediction=True, device=None, pretrain=False, output_file=None):
+def run_mimo(dumped_models, dataCenter, data, threshold_fact=0, threshold_cond=0, write_prediction=True, device=None, pretrain=False, output_file=None, metrics=None):
 	raw_SENTENCEs, raw_POSTAGs, raw_CAPs, raw_OUTs, raw_instance_list = data
 	#SENTENCEs, POSTAGs, CAPs, LM_SENTENCEs, POSCAPs, OUTs = shuffle(raw_SENTENCEs, raw_POSTAGs, raw_CAPs, raw_LM_SENTENCEs, raw_POSCAPs, raw_OUTs)
 
@@ -1581,7 +1623,7 @@ def run_mimo(dumped_models, dataCenter, data, threshold_fact=0, threshold_cond=0
 	else:
 		writer = None
 	models, tokenizer, LM_model, LM_corpus, mimo_extractor_fact, mimo_extractor_cond, multi_head, multi_head_two = dumped_models
-	predict_fact, predict_condition, predict_fact_tuples, predict_cond_tuples, CFE_list = _core_predict(SENTENCEs, POSTAGs, CAPs, instance_list, models, dataCenter, device, tokenizer, LM_model, LM_corpus, mimo_extractor_fact, mimo_extractor_cond, pretrain, multi_head, multi_head_two, writer=writer)
+	predict_fact, predict_condition, predict_fact_tuples, predict_cond_tuples, CFE_list = _core_predict(SENTENCEs, POSTAGs, CAPs, instance_list, models, dataCenter, device, tokenizer, LM_model, LM_corpus, mimo_extractor_fact, mimo_extractor_cond, pretrain, multi_head, multi_head_two, writer=writer, metrics=metrics)
 	return CFE_list
 
 def prediction(models, dataCenter, data, threshold_fact, threshold_cond, write_prediction=False, device=None, tokenizer=None, LM_model=None, LM_corpus=None, mimo_extractor_fact=None, mimo_extractor_cond=None, pretrain=False, ensemble=None, ensemble_two=None, output_file=None):
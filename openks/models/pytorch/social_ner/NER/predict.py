@@ -6,9 +6,15 @@ from social_ner.common.singleton import SingletonMeta
 
 sys.path.append("./social_ner/NER/")
 
+import asyncio
 import logging
 import os
 import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List
 
 import torch
 from models import BERT_BiLSTM_CRF
@@ -27,13 +33,80 @@ def boolean_string(s):
     return s == "True"
 
 
+class MicroBatcher:
+    """Coalesces items submitted by concurrent callers into batches run by one worker thread.
+
+    A batch is started as soon as max_batch_size items are waiting or max_wait seconds after its
+    first item arrived, whichever comes first, so the latency cost of batching is bounded.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List], List],
+        max_batch_size: int = 128,
+        max_wait: float = 0.005,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="ner-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        # items of callers which gave up (timeout, disconnect) are dropped, the others can no longer be cancelled
+        return [(item, future) for item, future in pending if future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        # the only worker thread, nothing may escape this loop or later requests would wait forever
+        while True:
+            pending = self._collect()
+            if not pending:
+                continue
+            try:
+                results = self.run_batch([item for item, _ in pending])
+            except Exception as e:
+                logger.exception("batch of %d items failed", len(pending))
+                results, error = None, e
+            for i, (_, future) in enumerate(pending):
+                try:
+                    if results is None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(results[i])
+                except Exception:
+                    logger.exception("could not hand over the result of a batch item")
+
+
 class predict(metaclass=SingletonMeta):
-    def __init__(self):
+    def __init__(self, batch_size: int = 32, max_wait: float = 0.005, device: str = None):
+        """
+        batch_size: number of sentences run through the model at once
+        max_wait: seconds a sentence submitted through predict_async waits for others to share its batch
+        device: torch device, cuda if it is available and cpu otherwise by default
+        """
         output_dir = "./social_ner/NER/model/"
         args = torch.load(os.path.join(output_dir, "training_args.bin"))
         args.output_dir = output_dir
 
-        device = torch.device("cuda")
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = torch.device(device)
         # os.environ["CUDA_VISIBLE_DEVICES"] = args.gpu_
         args.device = device
         n_gpu = torch.cuda.device_count()
@@ -77,38 +150,72 @@ class predict(metaclass=SingletonMeta):
         self.model = model
         self.tokenizer = tokenizer
         self.id2label = id2label
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        # 字符 -> token id 缓存，每个字符只经过一次 tokenizer
+        self.char2id: Dict[str, int] = {}
+        self.cls_id, self.sep_id = tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]"])
+        self._batcher = None
+        self._batcher_lock = threading.Lock()
+
+    @property
+    def batcher(self) -> MicroBatcher:
+        with self._batcher_lock:
+            if self._batcher is None:
+                # the worker collects a few batches worth of sentences, so predict_batch can bucket them by length
+                self._batcher = MicroBatcher(self.predict_batch, 4 * self.batch_size, self.max_wait)
+            return self._batcher
 
-    @torch.no_grad()
     def predict(self, x: str):
         sent_list = self.__split_sentence(x)
-        result = []
-        global_offset = 0
-
-        for sent in sent_list:
-            pred_labels = []
-            (
-                input_tokens,
-                input_ids,
-                input_mask,
-                segment_ids,
-            ) = self.__preprocess_sentence(sent)
+        return self.__collect_entities(sent_list, self.predict_batch(sent_list))
 
-            input_ids = input_ids.unsqueeze(dim=0).to(self.args.device)
-            input_mask = input_mask.unsqueeze(dim=0).to(self.args.device)
-            segment_ids = segment_ids.unsqueeze(dim=0).to(self.args.device)
+    async def predict_async(self, x: str):
+        """predict without blocking the event loop, the sentences are batched with those of concurrent requests"""
+        sent_list = self.__split_sentence(x)
+        futures = [asyncio.wrap_future(self.batcher.submit(sent)) for sent in sent_list]
+        return self.__collect_entities(sent_list, await asyncio.gather(*futures))
 
-            logits = self.model.predict(input_ids, segment_ids, input_mask)[0]
+    @torch.no_grad()
+    def predict_batch(self, sent_list: List[str]) -> List[List[str]]:
+        """labels of the characters of every sentence
+
+        Sentences are sorted by length and cut into batches of batch_size, each padded to its longest sentence.
+        """
+        ids_list = [self.__sentence_ids(sent) for sent in sent_list]
+        result = [None] * len(sent_list)
+        order = sorted(range(len(ids_list)), key=lambda i: len(ids_list[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            max_len = max(len(ids_list[i]) for i in batch)
+            input_ids = torch.zeros(len(batch), max_len, dtype=torch.long)
+            input_mask = torch.zeros(len(batch), max_len, dtype=torch.long)
+            for row, i in enumerate(batch):
+                input_ids[row, : len(ids_list[i])] = torch.tensor(ids_list[i], dtype=torch.long)
+                input_mask[row, : len(ids_list[i])] = 1
+            segment_ids = torch.zeros_like(input_ids)
+
+            logits = self.model.predict(
+                input_ids.to(self.args.device),
+                segment_ids.to(self.args.device),
+                input_mask.to(self.args.device),
+            )
+            for row, i in enumerate(batch):
+                result[i] = [self.id2label[idx] for idx in logits[row][1:-1]]
+        return result
 
-            for idx in logits:
-                pred_labels.append(self.id2label[idx])
+    def __collect_entities(self, sent_list: List[str], labels_list: List[List[str]]):
+        result = []
+        global_offset = 0
 
+        for sent, pred_labels in zip(sent_list, labels_list):
             ner_token = ""
             ner_pos_begin = -1
             ner_pos_end = -1
             ner_label = ""
             pos = 0
 
-            for token, label in zip(input_tokens[1:-1], pred_labels[1:-1]):
+            for token, label in zip(sent, pred_labels):
                 logger.debug(f"{pos}: {token} {label}")
                 if label == "O":
                     if ner_token:
@@ -163,25 +270,18 @@ class predict(metaclass=SingletonMeta):
         sent_list = x.split(sep_token)
         return [sent for sent in sent_list if sent]
 
-    def __preprocess_sentence(self, sent: str):
-        ori_token_list = [ch for ch in sent]
-        
-        ori_token_list = ["[CLS]"] + ori_token_list + ["[SEP]"]
-
-        token_list = [self.tokenizer.tokenize(x)[0] for x in ori_token_list]
-        token_id_list = self.tokenizer.convert_tokens_to_ids(token_list)
-
-        seq_len = len(token_id_list)
-
-        input_ids = torch.zeros(self.args.max_seq_length, dtype=torch.long)
-        input_ids[:seq_len] += torch.tensor(token_id_list, dtype=torch.long)
-
-        input_mask = torch.zeros(self.args.max_seq_length, dtype=torch.long)
-        input_mask[:seq_len] = 1
-
-        segment_ids = torch.zeros(self.args.max_seq_length, dtype=torch.long)
-
-        return ori_token_list, input_ids, input_mask, segment_ids
+    def __sentence_ids(self, sent: str) -> List[int]:
+        # sentences longer than max_seq_length are cut, their remaining characters get no label
+        chars = sent[: self.args.max_seq_length - 2]
+        ids = [self.cls_id]
+        for ch in chars:
+            if ch not in self.char2id:
+                tokens = self.tokenizer.tokenize(ch)
+                # whitespace and other characters dropped by the tokenizer become [UNK]
+                self.char2id[ch] = self.tokenizer.convert_tokens_to_ids(tokens[:1] or ["[UNK]"])[0]
+            ids.append(self.char2id[ch])
+        ids.append(self.sep_id)
+        return ids
 
 
 if __name__ == "__main__":
@@ -16,7 +16,7 @@ class NERRequest(BaseModel):
 @router.post("", tags=["ner"])
 @router.post("/", tags=["ner"])
 async def ner(request: NERRequest):
-    ners = predictor.predict(request.text)
+    ners = await predictor.predict_async(request.text)
     r = {"text": request.text, "nes": ners}
     content = ujson.dumps(r, ensure_ascii=False).encode("utf-8")
     return Response(content=content, media_type="application/json")
@@ -3,11 +3,19 @@
 
 """
 init
+
+submodules are imported on first access of one of their names, see openks.common.register.lazy_exports
 """
-from .ke_learn import *
-# from .kg_learn import *
-from .rec_learn import *
+from ...common.register import lazy_exports
+
+_SUBMODULES = [
+	'.ke_learn',
+	# '.kg_learn',
+	'.rec_learn',
+
+	'.ke_modules',
+	# '.kg_modules',
+	'.rec_modules',
+]
 
-from .ke_modules import *
-# from .kg_modules import *
-from .rec_modules import *
\ No newline at end of file
+__getattr__ = lazy_exports(__name__, _SUBMODULES)
@@ -4,13 +4,220 @@
 '''
 reference to: https://github.com/xiangwang1223/neural_graph_collaborative_filtering
 '''
+import hashlib
+import os
+import queue
+import sys
+import threading
+from time import time
 import numpy as np
 import scipy.sparse as sp
-import random as rd
 import tensorflow as tf
-import multiprocessing
 from ..model import RecModel
 
+
+def interaction_matrix(users, items, n_users, n_items):
+	""" n_users x n_items CSR matrix with 1. at every (user, item) interaction, repeated interactions count once """
+	R = sp.csr_matrix((np.ones(len(users), dtype=np.float32), (users, items)), shape=(n_users, n_items))
+	R.sum_duplicates()
+	R.data[:] = 1.
+	return R
+
+
+def interaction_key(R):
+	""" content hash of an interaction matrix, used to key the cached adjacency matrices """
+	R = R.tocsr()
+	R.sort_indices()
+	digest = hashlib.sha1()
+	digest.update(np.array(R.shape, dtype=np.int64).tobytes())
+	digest.update(R.indptr.astype(np.int64).tobytes())
+	digest.update(R.indices.astype(np.int64).tobytes())
+	return digest.hexdigest()
+
+
+def bipartite_adj(R):
+	""" symmetric (users + items)^2 adjacency of the interaction matrix R, users first, built from its COO arrays """
+	n_users, n_items = R.shape
+	R = R.tocoo()
+	rows = np.concatenate((R.row, R.col + n_users))
+	cols = np.concatenate((R.col + n_users, R.row))
+	data = np.concatenate((R.data, R.data)).astype(np.float32)
+	return sp.csr_matrix((data, (rows, cols)), shape=(n_users + n_items, n_users + n_items))
+
+
+def normalize_adj(adj, mode='mean'):
+	"""
+	mean: D^-1 A, every row divided by its sum; symmetric: D^-1/2 A D^-1/2 (square matrices only).
+	Rows (and for symmetric, columns) with a zero sum stay zero.
+	"""
+	rowsum = np.asarray(adj.sum(axis=1)).flatten()
+	with np.errstate(divide='ignore'):
+		d_inv = np.power(rowsum, -1.) if mode == 'mean' else np.power(rowsum, -0.5)
+	d_inv[np.isinf(d_inv)] = 0.
+	norm_adj = sp.diags(d_inv).dot(adj)
+	if mode == 'symmetric':
+		norm_adj = norm_adj.dot(sp.diags(d_inv))
+	elif mode != 'mean':
+		raise ValueError("mode should be 'mean' or 'symmetric', got {}".format(mode))
+	return norm_adj.tocsr()
+
+
+def renormalize_rows(norm_adj, sub_adj, rows):
+	""" norm_adj with its rows replaced by the mean normalization of sub_adj, the adjacency rows of the same nodes """
+	n = norm_adj.shape[0]
+	keep = np.ones(n, dtype=np.float32)
+	keep[rows] = 0.
+	scatter = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, np.arange(len(rows)))), shape=(n, len(rows)))
+	return (sp.diags(keep).dot(norm_adj) + scatter.dot(normalize_adj(sub_adj))).tocsr()
+
+
+def mask_items(rate_batch, mask):
+	""" set the ratings of the nonzero entries of the sparse mask to -inf, in place """
+	mask = mask.tocoo()
+	rate_batch[mask.row, mask.col] = -np.inf
+
+
+def top_k(scores, k, items=None):
+	"""
+	the k best scores of every row in decreasing order and their items (column indexes by default),
+	selected by a partition so that only the k candidates get sorted.
+	Equal scores keep their column order, so ties are broken as by a stable sort of the whole row.
+	"""
+	rows = np.arange(scores.shape[0])[:, None]
+	if items is None:
+		items = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+	if scores.shape[1] > k:
+		part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+		kth = scores[rows, part].min(axis=1, keepdims=True)
+		# rows with more ties at the k-th score than selected ones take the first tied columns instead
+		ties = (scores == kth).sum(axis=1) > (scores[rows, part] == kth).sum(axis=1)
+		if ties.any():
+			tied_scores, tied_kth = scores[ties], kth[ties]
+			above = tied_scores > tied_kth
+			tied = tied_scores == tied_kth
+			keep = above | (tied & (np.cumsum(tied, axis=1) <= k - above.sum(axis=1, keepdims=True)))
+			part[ties] = np.nonzero(keep)[1].reshape(-1, k)
+		part.sort(axis=1)
+		scores, items = scores[rows, part], items[rows, part]
+	order = np.argsort(-scores, axis=1, kind='stable')
+	return scores[rows, order], items[rows, order]
+
+
+def ranking_metrics(hits, n_pos, ranks):
+	"""
+	precision, recall, ndcg and hit ratio at every K of ranks for a batch of users, as defined by NGCF:
+	hits is the [users, max(ranks)] 0/1 matrix of the ranked lists, n_pos the number of test items of every user,
+	and the ideal dcg of ndcg@K is the one of the hits of the whole list moved to its top.
+	return arrays of shape [users, len(ranks)]
+	"""
+	hits = np.asarray(hits, dtype=np.float64)
+	discount = 1. / np.log2(np.arange(2, hits.shape[1] + 2))
+	dcg = np.cumsum(hits * discount, axis=1)
+	idcg = np.cumsum(discount)
+	n_hits = hits.sum(axis=1).astype(np.int64)
+	cum_hits = np.cumsum(hits, axis=1)
+	n_pos = np.asarray(n_pos, dtype=np.float64)
+	result = {'precision': [], 'recall': [], 'ndcg': [], 'hit_ratio': []}
+	for K in ranks:
+		found = cum_hits[:, K - 1]
+		ideal_hits = np.minimum(n_hits, K)
+		ideal = np.where(ideal_hits > 0, idcg[np.maximum(ideal_hits - 1, 0)], 0.)
+		result['precision'].append(found / K)
+		result['recall'].append(np.divide(found, n_pos, out=np.zeros_like(found), where=n_pos > 0))
+		result['ndcg'].append(np.divide(dcg[:, K - 1], ideal, out=np.zeros_like(found), where=ideal > 0))
+		result['hit_ratio'].append((found > 0).astype(np.float64))
+	return {key: np.stack(value, axis=1) for key, value in result.items()}
+
+
+def batch_auc(rate_batch, pos_mat, mask_mat):
+	"""
+	area under the ROC curve of every row of rate_batch, positives are the nonzero entries of pos_mat
+	and entries of mask_mat are not candidates; ties count one half, and rows without positive or negative get 0
+	"""
+	from scipy.stats import rankdata
+	candidate = np.ones(rate_batch.shape, dtype=bool)
+	candidate[mask_mat.tocoo().row, mask_mat.tocoo().col] = False
+	positive = np.asarray(pos_mat.todense()) > 0
+	positive &= candidate
+	# masked entries are -inf and take the lowest ranks, they are removed from the ranks of the candidates
+	ranks = rankdata(rate_batch, axis=1) - (~candidate).sum(axis=1, keepdims=True)
+	n_pos = positive.sum(axis=1)
+	n_neg = candidate.sum(axis=1) - n_pos
+	rank_sum = np.where(positive, ranks, 0.).sum(axis=1)
+	return np.divide(rank_sum - n_pos * (n_pos + 1) / 2., n_pos * n_neg,
+					out=np.zeros(len(n_pos)), where=(n_pos > 0) & (n_neg > 0))
+
+
+class BatchSampler(object):
+	"""
+	Draws BPR training batches (users, one positive and one negative item per user) as arrays:
+	positives are picked from the CSR offsets/indices of the interaction matrix and negatives are drawn uniformly
+	and redrawn while the sorted (user, item) keys of the interactions contain them.
+	All draws come from one numpy Generator, so a seed reproduces the whole sequence of batches, prefetched or not.
+	"""
+	def __init__(self, R, users, seed=None):
+		R = R.tocsr()
+		R.sort_indices()
+		self.n_users, self.n_items = R.shape
+		self.indptr = R.indptr.astype(np.int64)
+		self.indices = R.indices.astype(np.int64)
+		self.keys = np.repeat(np.arange(self.n_users, dtype=np.int64), np.diff(self.indptr)) * self.n_items + self.indices
+		self.users = np.asarray(users, dtype=np.int64)
+		degree = np.diff(self.indptr)[self.users]
+		if (degree == 0).any() or (degree == self.n_items).any():
+			raise ValueError("Every sampled user needs at least one positive and one negative item.")
+		self.rng = np.random.default_rng(seed)
+
+	def sample(self, batch_size):
+		users = self.rng.choice(self.users, batch_size, replace=batch_size > len(self.users))
+		start = self.indptr[users]
+		pos_items = self.indices[start + (self.rng.random(batch_size) * (self.indptr[users + 1] - start)).astype(np.int64)]
+		neg_items = self.rng.integers(0, self.n_items, batch_size)
+		redraw = np.arange(batch_size)
+		while len(redraw):
+			keys = users[redraw] * self.n_items + neg_items[redraw]
+			pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+			redraw = redraw[self.keys[pos] == keys]
+			neg_items[redraw] = self.rng.integers(0, self.n_items, len(redraw))
+		return users, pos_items, neg_items
+
+	def prefetch(self, batch_size, n_batch, depth=4):
+		"""
+		yield n_batch batches drawn by a background thread, which keeps up to depth batches ready
+		"""
+		batches = queue.Queue(maxsize=depth)
+		stop = threading.Event()
+
+		def put(item):
+			while not stop.is_set():
+				try:
+					batches.put(item, timeout=0.1)
+					return True
+				except queue.Full:
+					continue
+			return False
+
+		def produce():
+			try:
+				for _ in range(n_batch):
+					if not put(self.sample(batch_size)):
+						return
+			except Exception as e:
+				put(e)
+
+		thread = threading.Thread(target=produce, name='rec-sampler', daemon=True)
+		thread.start()
+		try:
+			for _ in range(n_batch):
+				batch = batches.get()
+				if isinstance(batch, Exception):
+					raise batch
+				yield batch
+		finally:
+			stop.set()
+			thread.join()
+
+
 @RecModel.register("recommendation", "TensorFlow")
 class RecTF(RecModel):
 
@@ -25,6 +232,7 @@ class RecTF(RecModel):
 	def data_counter(self):
 		self.n_items, self.n_users = 0, 0
 		self.n_train, self.n_test = 0, 0
+		self.exist_users = []
 		for l in self.train_set:
 			if len(l) > 0:
 				l = l.strip('\n').split(' ')
@@ -49,23 +257,26 @@ class RecTF(RecModel):
 		return self.n_items, self.n_users, self.n_train, self.n_test
 
 	def data_generator(self):
-		self.R = sp.dok_matrix((self.n_users, self.n_items), dtype=np.float32)
-
 		self.train_items, self.test_set = {}, {}
+		users, items = [], []
 
 		for l in self.train_set:
 			if len(l) == 0: 
 				break
 			l = l.strip('\n')
-			items = [int(i) for i in l.split(' ')]
-			uid, train_items = items[0], items[1:]
+			line = [int(i) for i in l.split(' ')]
+			uid, train_items = line[0], line[1:]
 
-			for i in train_items:
-				self.R[uid, i] = 1.
-				# self.R[uid][i] = 1
+			users.append(np.full(len(train_items), uid, dtype=np.int64))
+			items.append(np.array(train_items, dtype=np.int64))
 
 			self.train_items[uid] = train_items
 
+		self.R = interaction_matrix(
+			np.concatenate(users) if users else np.zeros(0, dtype=np.int64),
+			np.concatenate(items) if items else np.zeros(0, dtype=np.int64),
+			self.n_users, self.n_items)
+
 		for l in self.valid_set:
 			if len(l) == 0: break
 			l = l.strip('\n')
@@ -79,98 +290,97 @@ class RecTF(RecModel):
 
 		return self.train_items, self.test_set
 
-	def sample(self, batch_size):
-		if batch_size <= self.n_users:
-			users = rd.sample(self.exist_users, batch_size)
-		else:
-			users = [rd.choice(self.exist_users) for _ in range(batch_size)]
-
-		def sample_pos_items_for_u(u, num):
-			pos_items = self.train_items[u]
-			n_pos_items = len(pos_items)
-			pos_batch = []
-			while True:
-				if len(pos_batch) == num: break
-				pos_id = np.random.randint(low=0, high=n_pos_items, size=1)[0]
-				pos_i_id = pos_items[pos_id]
-
-				if pos_i_id not in pos_batch:
-					pos_batch.append(pos_i_id)
-			return pos_batch
-
-		def sample_neg_items_for_u(u, num):
-			neg_items = []
-			while True:
-				if len(neg_items) == num: break
-				neg_id = np.random.randint(low=0, high=self.n_items,size=1)[0]
-				if neg_id not in self.train_items[u] and neg_id not in neg_items:
-					neg_items.append(neg_id)
-			return neg_items
-
-		def sample_neg_items_for_u_from_pools(u, num):
-			neg_items = list(set(self.neg_pools[u]) - set(self.train_items[u]))
-			return rd.sample(neg_items, num)
-
-		pos_items, neg_items = [], []
-		for u in users:
-			pos_items += sample_pos_items_for_u(u, 1)
-			neg_items += sample_neg_items_for_u(u, 1)
+	def get_sampler(self):
+		""" the BatchSampler of the training interactions, seeded by args['seed'] if given """
+		if getattr(self, 'sampler', None) is None:
+			self.sampler = BatchSampler(self.R, self.exist_users, self.args.get('seed'))
+		return self.sampler
 
-		return users, pos_items, neg_items
+	def sample(self, batch_size):
+		return self.get_sampler().sample(batch_size)
+
+	def adj_cache_path(self, name):
+		"""
+		cache file of an adjacency matrix, keyed by the content hash of the training interactions
+		so that matrices of other data are never reused; None if args has no cache_dir
+		"""
+		cache_dir = self.args.get('cache_dir')
+		if not cache_dir:
+			return None
+		return os.path.join(cache_dir, '{}_{}.npz'.format(name, interaction_key(self.R)))
 
 	def get_adj_mat(self):
-		try:
+		names = ['s_adj_mat', 's_norm_adj_mat', 's_mean_adj_mat']
+		paths = [self.adj_cache_path(name) for name in names]
+		if paths[0] and all(os.path.exists(path) for path in paths):
 			t1 = time()
-			adj_mat = sp.load_npz(self.path + '/s_adj_mat.npz')
-			norm_adj_mat = sp.load_npz(self.path + '/s_norm_adj_mat.npz')
-			mean_adj_mat = sp.load_npz(self.path + '/s_mean_adj_mat.npz')
-			print('already load adj matrix', adj_mat.shape, time() - t1)
-
-		except Exception:
-			adj_mat, norm_adj_mat, mean_adj_mat = self.create_adj_mat()
-			sp.save_npz(self.path + '/s_adj_mat.npz', adj_mat)
-			sp.save_npz(self.path + '/s_norm_adj_mat.npz', norm_adj_mat)
-			sp.save_npz(self.path + '/s_mean_adj_mat.npz', mean_adj_mat)
-		return adj_mat, norm_adj_mat, mean_adj_mat
+			self.adj_mats = tuple(sp.load_npz(path).tocsr() for path in paths)
+			print('already load adj matrix', self.adj_mats[0].shape, time() - t1)
+			return self.adj_mats
+
+		self.adj_mats = self.create_adj_mat()
+		self.save_adj_mat()
+		return self.adj_mats
+
+	def save_adj_mat(self):
+		names = ['s_adj_mat', 's_norm_adj_mat', 's_mean_adj_mat']
+		paths = [self.adj_cache_path(name) for name in names]
+		if not paths[0]:
+			return
+		if not os.path.exists(os.path.dirname(paths[0])):
+			os.makedirs(os.path.dirname(paths[0]))
+		for path, mat in zip(paths, self.adj_mats):
+			sp.save_npz(path, mat)
 
 	def create_adj_mat(self):
 		t1 = time()
-		adj_mat = sp.dok_matrix((self.n_users + self.n_items, self.n_users + self.n_items), dtype=np.float32)
-		adj_mat = adj_mat.tolil()
-		R = self.R.tolil()
-
-		adj_mat[:self.n_users, self.n_users:] = R
-		adj_mat[self.n_users:, :self.n_users] = R.T
-		adj_mat = adj_mat.todok()
+		adj_mat = bipartite_adj(self.R)
 		print('already create adjacency matrix', adj_mat.shape, time() - t1)
 
 		t2 = time()
-
-		def normalized_adj_single(adj):
-			rowsum = np.array(adj.sum(1))
-
-			d_inv = np.power(rowsum, -1).flatten()
-			d_inv[np.isinf(d_inv)] = 0.
-			d_mat_inv = sp.diags(d_inv)
-
-			norm_adj = d_mat_inv.dot(adj)
-			# norm_adj = adj.dot(d_mat_inv)
-			print('generate single-normalized adjacency matrix.')
-			return norm_adj.tocoo()
-
-		def check_adj_if_equal(adj):
-			dense_A = np.array(adj.todense())
-			degree = np.sum(dense_A, axis=1, keepdims=False)
-
-			temp = np.dot(np.diag(np.power(degree, -1)), dense_A)
-			print('check normalized adjacency matrix whether equal to this laplacian matrix.')
-			return temp
-
-		norm_adj_mat = normalized_adj_single(adj_mat + sp.eye(adj_mat.shape[0]))
-		mean_adj_mat = normalized_adj_single(adj_mat)
+		norm_adj_mat = normalize_adj(adj_mat + sp.eye(adj_mat.shape[0]))
+		mean_adj_mat = normalize_adj(adj_mat)
 
 		print('already normalize adjacency matrix', time() - t2)
-		return adj_mat.tocsr(), norm_adj_mat.tocsr(), mean_adj_mat.tocsr()
+		return adj_mat, norm_adj_mat, mean_adj_mat
+
+	def add_interactions(self, users, items):
+		"""
+		append new training interactions and update the adjacency matrices of get_adj_mat in place of a rebuild:
+		the new edges are added to the adjacency and only the rows of the users and items they touch are normalized again.
+		Unknown users or items change the shape of the matrices, they need the full rebuild of get_adj_mat.
+		return the updated (adj_mat, norm_adj_mat, mean_adj_mat)
+		"""
+		if getattr(self, 'adj_mats', None) is None:
+			self.get_adj_mat()
+		users = np.asarray(users, dtype=np.int64)
+		items = np.asarray(items, dtype=np.int64)
+		if len(users) and (users.max() >= self.n_users or items.max() >= self.n_items):
+			raise ValueError("New users or items need a full rebuild, call data_counter, data_generator and get_adj_mat again.")
+		for u, i in zip(users.tolist(), items.tolist()):
+			if u not in self.train_items:
+				self.train_items[u] = []
+				self.exist_users.append(u)
+			if i not in self.train_items[u]:
+				self.train_items[u].append(i)
+				self.n_train += 1
+		delta = interaction_matrix(users, items, self.n_users, self.n_items)
+		delta = delta - delta.multiply(self.R)
+		delta.eliminate_zeros()
+		self.R = (self.R + delta).tocsr()
+		# the sampler draws from the interactions at the time it was built, the next one sees the new ones
+		self.sampler = None
+
+		adj_mat, norm_adj_mat, mean_adj_mat = self.adj_mats
+		adj_mat = (adj_mat + bipartite_adj(delta)).tocsr()
+		touched = np.unique(np.concatenate((delta.tocoo().row, delta.tocoo().col + self.n_users)))
+		sub_adj = adj_mat[touched]
+		self_loops = sp.csr_matrix((np.ones(len(touched)), (np.arange(len(touched)), touched)), shape=sub_adj.shape)
+		norm_adj_mat = renormalize_rows(norm_adj_mat, sub_adj + self_loops, touched)
+		mean_adj_mat = renormalize_rows(mean_adj_mat, sub_adj, touched)
+		self.adj_mats = (adj_mat, norm_adj_mat, mean_adj_mat)
+		self.save_adj_mat()
+		return self.adj_mats
 
 	def save_model(self):
 		return NotImplemented
@@ -178,142 +388,78 @@ class RecTF(RecModel):
 	def load_model(self):
 		return NotImplemented
 
-	def get_auc(item_score, user_pos_test):
-		item_score = sorted(item_score.items(), key=lambda kv: kv[1])
-		item_score.reverse()
-		item_sort = [x[0] for x in item_score]
-		posterior = [x[1] for x in item_score]
-
-		r = []
-		for i in item_sort:
-			if i in user_pos_test:
-				r.append(1)
-			else:
-				r.append(0)
-		auc = metrics.auc(ground_truth=r, prediction=posterior)
-		return auc
-
-	def ranklist_by_sorted(user_pos_test, test_items, rating, ranks):
-		item_score = {}
-		for i in test_items:
-			item_score[i] = rating[i]
-
-		K_max = max(ranks)
-		K_max_item_score = heapq.nlargest(K_max, item_score, key=item_score.get)
-
-		r = []
-		for i in K_max_item_score:
-			if i in user_pos_test:
-				r.append(1)
-			else:
-				r.append(0)
-		auc = get_auc(item_score, user_pos_test)
-		return r, auc
-
-	def get_performance(user_pos_test, r, auc, ranks):
-		precision, recall, ndcg, hit_ratio = [], [], [], []
-
-		for K in ranks:
-			precision.append(metrics.precision_at_k(r, K))
-			recall.append(metrics.recall_at_k(r, K, len(user_pos_test)))
-			ndcg.append(metrics.ndcg_at_k(r, K))
-			hit_ratio.append(metrics.hit_at_k(r, K))
-
-		return {'recall': np.array(recall), 'precision': np.array(precision),
-				'ndcg': np.array(ndcg), 'hit_ratio': np.array(hit_ratio), 'auc': auc}
-
-	def test_one_user(x):
-		# user u's ratings for user u
-		rating = x[0]
-		#uid
-		u = x[1]
-		#user u's items in the training set
-		try:
-			training_items = data_generator.train_items[u]
-		except Exception:
-			training_items = []
-		#user u's items in the test set
-		user_pos_test = data_generator.test_set[u]
-
-		all_items = set(range(self.n_items))
-
-		test_items = list(all_items - set(training_items))
-
-		r, auc = ranklist_by_sorted(user_pos_test, test_items, rating, self.args['ranks'])
-
-		return get_performance(user_pos_test, r, auc, self.args['ranks'])
-
-	def evaluate(sess, model, users_to_test, batch_size, drop_flag=False, batch_test_flag=False):
-		result = {'precision': np.zeros(len(self.args['ranks'])), 'recall': np.zeros(len(self.args['ranks'])), 
-					'ndcg': np.zeros(len(self.args['ranks'])), 'hit_ratio': np.zeros(len(self.args['ranks'])), 'auc': 0.}
-
-		pool = multiprocessing.Pool(cores)
+	def train_matrix(self):
+		""" user x item CSR matrix of the training interactions """
+		return self.R.tocsr()
+
+	def test_matrix(self):
+		""" user x item CSR matrix of the test interactions """
+		users = np.repeat(np.array(list(self.test_set.keys()), dtype=np.int64), [len(items) for items in self.test_set.values()])
+		items = np.array([i for items in self.test_set.values() for i in items], dtype=np.int64)
+		mat = sp.csr_matrix((np.ones(len(users), dtype=np.float32), (users, items)), shape=(self.n_users, self.n_items))
+		mat.sum_duplicates()
+		mat.data[:] = 1.
+		return mat
+
+	def batch_ratings(self, sess, model, user_batch, item_batch, drop_flag=False):
+		feed_dict = {model.users: user_batch, model.pos_items: item_batch}
+		if drop_flag:
+			feed_dict[model.node_dropout] = [0.] * len(eval(self.args['layer_size']))
+			feed_dict[model.mess_dropout] = [0.] * len(eval(self.args['layer_size']))
+		return sess.run(model.batch_ratings, feed_dict)
+
+	def evaluate(self, sess, model, users_to_test, batch_size, drop_flag=False, batch_test_flag=False, auc_flag=False):
+		"""
+		precision, recall, ndcg and hit ratio at every K of args['ranks'] (as defined by NGCF), and auc, averaged over users_to_test.
+		Training items are masked through the training CSR matrix and the top max(ranks) items of a whole user batch are taken with argpartition.
+		With batch_test_flag the items are scored by chunks of batch_size and only the running top items are kept,
+		so memory does not grow with the number of items.
+		auc ranks all items of every user, it is only computed with auc_flag and full rating rows (it is 0 otherwise).
+		"""
+		ranks = self.args['ranks']
+		k_max = max(ranks)
+		result = {'precision': np.zeros(len(ranks)), 'recall': np.zeros(len(ranks)),
+					'ndcg': np.zeros(len(ranks)), 'hit_ratio': np.zeros(len(ranks)), 'auc': 0.}
+		train_mat = self.train_matrix()
+		test_mat = self.test_matrix()
 
 		u_batch_size = batch_size * 2
 		i_batch_size = batch_size
 
-		test_users = users_to_test
+		test_users = np.asarray(users_to_test, dtype=np.int64)
 		n_test_users = len(test_users)
-		n_user_batchs = n_test_users // u_batch_size + 1
 
-		count = 0
-
-		for u_batch_id in range(n_user_batchs):
-			start = u_batch_id * u_batch_size
-			end = (u_batch_id + 1) * u_batch_size
-
-			user_batch = test_users[start: end]
+		for start in range(0, n_test_users, u_batch_size):
+			user_batch = test_users[start: start + u_batch_size]
+			user_train = train_mat[user_batch]
+			user_test = test_mat[user_batch]
 
 			if batch_test_flag:
-
-				n_item_batchs = self.n_items // i_batch_size + 1
-				rate_batch = np.zeros(shape=(len(user_batch), self.n_items))
-
-				i_count = 0
-				for i_batch_id in range(n_item_batchs):
-					i_start = i_batch_id * i_batch_size
-					i_end = min((i_batch_id + 1) * i_batch_size, self.n_items)
-
-					item_batch = range(i_start, i_end)
-
-					if drop_flag == False:
-						i_rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-																	model.pos_items: item_batch})
-					else:
-						i_rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-																	model.pos_items: item_batch,
-																	model.node_dropout: [0.]*len(eval(self.args['layer_size'])),
-																	model.mess_dropout: [0.]*len(eval(self.args['layer_size']))})
-					rate_batch[:, i_start: i_end] = i_rate_batch
-					i_count += i_rate_batch.shape[1]
-
-				assert i_count == self.n_items
-
+				top_scores = np.full((len(user_batch), 0), -np.inf)
+				top_items = np.zeros((len(user_batch), 0), dtype=np.int64)
+				for i_start in range(0, self.n_items, i_batch_size):
+					i_end = min(i_start + i_batch_size, self.n_items)
+					rate_batch = np.array(self.batch_ratings(sess, model, user_batch, range(i_start, i_end), drop_flag), dtype=np.float64)
+					mask_items(rate_batch, user_train[:, i_start: i_end])
+					top_scores, top_items = top_k(
+						np.hstack((top_scores, rate_batch)),
+						k_max,
+						np.hstack((top_items, np.broadcast_to(np.arange(i_start, i_end), rate_batch.shape)))
+					)
+				auc = np.zeros(len(user_batch))
 			else:
-				item_batch = range(self.n_items)
-
-				if drop_flag == False:
-					rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-																  model.pos_items: item_batch})
-				else:
-					rate_batch = sess.run(model.batch_ratings, {model.users: user_batch,
-																  model.pos_items: item_batch,
-																  model.node_dropout: [0.] * len(eval(self.args['layer_size'])),
-																  model.mess_dropout: [0.] * len(eval(self.args['layer_size']))})
-
-			user_batch_rating_uid = zip(rate_batch, user_batch)
-			batch_result = pool.map(test_one_user, user_batch_rating_uid)
-			count += len(batch_result)
-
-			for re in batch_result:
-				result['precision'] += re['precision']/n_test_users
-				result['recall'] += re['recall']/n_test_users
-				result['ndcg'] += re['ndcg']/n_test_users
-				result['hit_ratio'] += re['hit_ratio']/n_test_users
-				result['auc'] += re['auc']/n_test_users
-
-		assert count == n_test_users
-		pool.close()
+				rate_batch = np.array(self.batch_ratings(sess, model, user_batch, range(self.n_items), drop_flag), dtype=np.float64)
+				mask_items(rate_batch, user_train)
+				top_scores, top_items = top_k(rate_batch, k_max)
+				auc = batch_auc(rate_batch, user_test, user_train) if auc_flag else np.zeros(len(user_batch))
+
+			# masked training items only show up when a user has fewer candidates than k_max, they are never hits
+			hits = np.asarray(user_test[np.arange(len(user_batch))[:, None], top_items].todense()) * np.isfinite(top_scores)
+			batch_result = ranking_metrics(hits, np.diff(user_test.indptr), ranks)
+			for key in ['precision', 'recall', 'ndcg', 'hit_ratio']:
+				result[key] += batch_result[key].sum(axis=0) / n_test_users
+			result['auc'] += auc.sum() / n_test_users
+
 		return result
 
 	def early_stopping(self, log_value, best_value, stopping_step, expected_order='acc', flag_step=100):
@@ -356,8 +502,7 @@ class RecTF(RecModel):
 			t1 = time()
 			loss, mf_loss, emb_loss, reg_loss = 0., 0., 0., 0.
 			n_batch = n_train // self.args['batch_size'] + 1
-			for idx in range(n_batch):
-				users, pos_items, neg_items = self.sample(self.args['batch_size'])
+			for users, pos_items, neg_items in self.get_sampler().prefetch(self.args['batch_size'], n_batch, self.args.get('prefetch', 4)):
 				_, batch_loss, batch_mf_loss, batch_emb_loss, batch_reg_loss = sess.run(
 					[model.opt, model.loss, model.mf_loss, model.emb_loss, model.reg_loss],
 					feed_dict={model.users: users, 
@@ -0,0 +1,68 @@
+# Copyright (c) 2021 OpenKS Authors, DCD Research Lab, Zhejiang University. 
+# All Rights Reserved.
+
+"""
+Abstract classes for openks models to be trained with PyTorch
+"""
+import torch
+import torch.nn as nn
+from torch.utils import data
+from ..common.register import Register
+
+
+class TorchModel(nn.Module, Register):
+	def __init__(self, **kwargs):
+		super(TorchModel, self).__init__()
+
+	def forward(self, *args):
+		return NotImplemented
+
+	def loss(self, *args):
+		return NotImplemented
+
+	def predict(self, *args):
+		return NotImplemented
+
+	def _algorithm(self, *args):
+		return NotImplemented
+
+	# getter and setter for Ray distributed training
+	def get_weights(self):
+		return {k: v.cpu() for k, v in self.state_dict().items()}
+
+	def set_weights(self, weights):
+		self.load_state_dict(weights)
+
+	def get_gradients(self):
+		grads = []
+		for p in self.parameters():
+			grad = None if p.grad is None else p.grad.data.cpu().numpy()
+			grads.append(grad)
+		return grads
+
+	def set_gradients(self, gradients):
+		for g, p in zip(gradients, self.parameters()):
+			if g is not None:
+				p.grad = torch.from_numpy(g)
+
+
+class KGC1TorchModel(nn.Module, Register):
+	def __init__(self, **kwargs):
+		super(KGC1TorchModel, self).__init__()
+
+
+class KGC2TorchModel(nn.Module, Register):
+	def __init__(self, **kwargs):
+		super(KGC2TorchModel, self).__init__()
+
+
+class TorchDataset(data.Dataset):
+	def __init__(self, samples):
+		self.samples = samples
+
+	def __len__(self):
+		return len(self.samples)
+
+	def __getitem__(self, index):
+		item = self.samples[index]
+		return item